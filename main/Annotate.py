@@ -19,6 +19,8 @@ class FrameProcessor:
         self.total_experiments = 0  # Contador de ensaios
         self.current_color = "blue"  # Cor padrão
         self.previous_labels = {}  # Guarda os valores das fases anteriores
+        self.operation_stats = RunningStats()  # Estatísticas (end - start) atualizadas a cada operação, O(1)
+        self.paired_operations = 0  # Pares (start, end) já incluídos em operation_stats
 
     def update_state(self, labels, frame_number):
         # Obter cores e atualizar estado com base em cada função
@@ -32,6 +34,12 @@ class FrameProcessor:
         self.total_hits, self.percentage_hits = metrics(self.total_hits, self.percentage_hits, labels,
                                                         self.start_frames)
 
+        # Atualizar as estatísticas só com os novos pares (start, end), sem percorrer o histórico
+        while self.paired_operations < min(len(self.end_frames), len(self.start_frames)):
+            self.operation_stats.update(self.end_frames[self.paired_operations] -
+                                        self.start_frames[self.paired_operations])
+            self.paired_operations += 1
+
         # Verificar mudanças nos rótulos e definir a cor atual
         color_changed = self.compare_labels(labels)
         if color_changed:
@@ -71,14 +79,21 @@ class FrameProcessor:
         # Chamar a função de anotação
         annotate_image_with_boxes_and_labels(image_path, detections, output_path, labels, frame_number, font_size, self)
 
+    def render_frame(self, frame, detections, labels, frame_number, renderer):
+        # Atualizar estado e desenhar o frame em memória (OverlayRenderer), sem gravar um JPEG por frame
+        self.update_state(labels, frame_number)
+        return renderer.render(frame, detections, labels, self)
+
 
 from PIL import Image, ImageDraw, ImageFont
+from frames import Frame
+from running_stats import RunningStats
 
 
 def annotate_image_with_boxes_and_labels(image_path, detections, output_path, labels, frame_number, font_size=50,
                                          processor=None):
-    # Carregar a imagem
-    image = Image.open(image_path)
+    # Carregar a imagem (um Frame já descodificado é copiado, não volta a ser lido do disco)
+    image = image_path.to_image() if isinstance(image_path, Frame) else Image.open(image_path)
     draw = ImageDraw.Draw(image)
 
     # Definir a cor padrão para caixas e texto
@@ -116,40 +131,45 @@ def annotate_image_with_boxes_and_labels(image_path, detections, output_path, la
 
         # Desenhar os rótulos e seus valores dentro da caixa
         label_y = box_y + 10
-        phase_values = {
-            "Start": labels.get('start', 0),
-            "Poke": labels.get('poke', 0),
-            "Pen": labels.get('pen', 0),
-            "End": labels.get('end', 0)
-        }
-
-        for label, value in phase_values.items():
-            text = f"{label}: {value}"
-            draw.text((box_x + 10, label_y), text, font=font, fill="black")
+        for label, value in hud_lines(labels, processor):
+            draw.text((box_x + 10, label_y), label + value, font=font, fill="black")
             label_y += font_size + 5
 
-        # Calcular e desenhar a duração média das operações e a duração atual
-        if processor.end_frames and processor.start_frames:
-            avg_duration = sum([end - start for end, start in zip(processor.end_frames, processor.start_frames)]) / len(
-                processor.end_frames)
-            current_duration = processor.duration[-1] if processor.duration else 0
-        else:
-            avg_duration = 0
-            current_duration = 0
-
-        # convert to s
-        avg_duration = avg_duration * 0.167
-        current_duration = current_duration * 0.167
-        avg_duration_text = f"Avg Duration: {avg_duration:.2f} s"
-        current_duration_text = f"Current Duration: {current_duration:.2f} s"
-        success_ratio_text = f"Success Ratio: {(processor.success_count / processor.total_experiments * 100) if processor.total_experiments > 0 else 0:.0f}%"
-
-        draw.text((box_x + 10, label_y), avg_duration_text, font=font, fill="black")
-        label_y += font_size + 5
-        draw.text((box_x + 10, label_y), current_duration_text, font=font, fill="black")
-        label_y += font_size + 5
-        draw.text((box_x + 10, label_y), success_ratio_text, font=font, fill="black")
-        label_y += font_size + 5
-
     # Salvar a imagem anotada
-    image.save(output_path)
\ No newline at end of file
+    image.save(output_path)
+
+
+def hud_lines(labels, processor):
+    """
+    Linhas do painel como pares (rótulo, valor), ex. ("Start: ", "2") ou ("Avg Duration: ", "1.50 s").
+    O rótulo é fixo; só o valor muda de frame para frame.
+    """
+    lines = [
+        ("Start: ", str(labels.get('start', 0))),
+        ("Poke: ", str(labels.get('poke', 0))),
+        ("Pen: ", str(labels.get('pen', 0))),
+        ("End: ", str(labels.get('end', 0))),
+    ]
+
+    # Calcular a duração média das operações e a duração atual (soma mantida em operation_stats, O(1))
+    if processor.end_frames and processor.start_frames:
+        operation_stats = getattr(processor, 'operation_stats', None)
+        if operation_stats is not None:
+            total_duration = operation_stats.total
+        else:
+            total_duration = sum([end - start for end, start in zip(processor.end_frames, processor.start_frames)])
+        avg_duration = total_duration / len(processor.end_frames)
+        current_duration = processor.duration[-1] if processor.duration else 0
+    else:
+        avg_duration = 0
+        current_duration = 0
+
+    # convert to s
+    avg_duration = avg_duration * 0.167
+    current_duration = current_duration * 0.167
+    success_ratio = (processor.success_count / processor.total_experiments * 100) if processor.total_experiments > 0 else 0
+
+    lines.append(("Avg Duration: ", f"{avg_duration:.2f} s"))
+    lines.append(("Current Duration: ", f"{current_duration:.2f} s"))
+    lines.append(("Success Ratio: ", f"{success_ratio:.0f}%"))
+    return lines
\ No newline at end of file
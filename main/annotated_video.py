@@ -0,0 +1,293 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from Annotate import hud_lines
+from frames import load_frame
+
+HUD_FONT_PATH = "/System/Library/Fonts/Supplemental/AppleMyungjo.ttf"
+
+
+@lru_cache(maxsize=None)
+def load_font(font_size, font_path=HUD_FONT_PATH):
+    """The HUD font, loaded once per size (annotate_image_with_boxes_and_labels loads it on every frame)."""
+    try:
+        return ImageFont.truetype(font_path, size=font_size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=None)
+def bgr_color(color):
+    """BGR tuple of a PIL color name ("blue", "yellow", ...)."""
+    red, green, blue = ImageColor.getrgb(color)[:3]
+    return blue, green, red
+
+
+class OverlayRenderer:
+    """
+    Draws the detection boxes and the HUD panel of annotate_image_with_boxes_and_labels straight into a
+    BGR NumPy canvas, ready for cv2.VideoWriter or JPEG encoding.
+
+    The font is loaded once and the fixed HUD labels ("Start: ", "Avg Duration: ", ...) are rendered once
+    into alpha masks; values are rendered on first use and cached. Every frame then costs one colour
+    conversion into a reused canvas, a few slice assignments for the boxes and one alpha blend per text.
+
+    Parameters:
+    - font_size (int): HUD font size.
+    - panel (tuple): (x, y, width, height) of the HUD box.
+    - box_width (int): Line width of the detection boxes.
+    - panel_line_width (int): Line width of the HUD box.
+    - max_cached_texts (int): Number of rendered value strings kept.
+    """
+
+    def __init__(self, font_size=50, panel=(100, 100, 700, 500), box_width=2, panel_line_width=5,
+                 max_cached_texts=256):
+        self.font = load_font(font_size)
+        self.font_size = font_size
+        self.panel = panel
+        self.box_width = box_width
+        self.panel_line_width = panel_line_width
+        self.max_cached_texts = max_cached_texts
+        self._texts = OrderedDict()
+        self._canvas = None
+        # Static part of the panel: the labels never change
+        self._labels = [(label, self._render_text(label), self.font.getlength(label))
+                        for label, _ in hud_lines({}, _EmptyProcessor)]
+
+    def _render_text(self, text):
+        """Alpha mask (uint8, drawn from the text origin like ImageDraw.text) of a string."""
+        left, top, right, bottom = self.font.getbbox(text)
+        mask = Image.new('L', (max(right, 1), max(bottom, 1)), 0)
+        ImageDraw.Draw(mask).text((0, 0), text, font=self.font, fill=255)
+        return np.asarray(mask)
+
+    def _text_mask(self, text):
+        mask = self._texts.get(text)
+        if mask is None:
+            mask = self._texts[text] = self._render_text(text)
+            if len(self._texts) > self.max_cached_texts:
+                self._texts.popitem(last=False)
+        else:
+            self._texts.move_to_end(text)
+        return mask
+
+    def _blend_text(self, canvas, mask, x, y, color):
+        """Alpha blends a text mask of one colour into the canvas at (x, y) (clipped to the canvas)."""
+        height, width = canvas.shape[:2]
+        x, y = int(x), int(y)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + mask.shape[1], width), min(y + mask.shape[0], height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        alpha = mask[y0 - y:y1 - y, x0 - x:x1 - x, None].astype(np.uint16)
+        region = canvas[y0:y1, x0:x1]
+        region[:] = (region * (255 - alpha) + np.array(color, dtype=np.uint16) * alpha + 127) // 255
+
+    @staticmethod
+    def _draw_rectangle(canvas, x_min, y_min, x_max, y_max, color, width):
+        """
+        Rectangle outline drawn inwards from the (inclusive) corners, like ImageDraw.rectangle. Edges outside
+        the canvas are not drawn.
+        """
+        height, canvas_width = canvas.shape[:2]
+        x_min, y_min, x_max, y_max = int(x_min), int(y_min), int(x_max), int(y_max)
+        if x_min > x_max or y_min > y_max:
+            return
+
+        def fill(top, bottom, left, right):
+            # Inclusive band, clipped to the canvas
+            top, left = max(top, 0), max(left, 0)
+            bottom, right = min(bottom, height - 1), min(right, canvas_width - 1)
+            if top <= bottom and left <= right:
+                canvas[top:bottom + 1, left:right + 1] = color
+
+        fill(y_min, min(y_min + width - 1, y_max), x_min, x_max)
+        fill(max(y_max - width + 1, y_min), y_max, x_min, x_max)
+        fill(y_min, y_max, x_min, min(x_min + width - 1, x_max))
+        fill(y_min, y_max, max(x_max - width + 1, x_min), x_max)
+
+    def render(self, frame, detections, labels, processor=None):
+        """
+        Draws one annotated frame.
+
+        Parameters:
+        - frame: Frame, RGB array, PIL image or image path.
+        - detections: YOLO detections, (class_id, x_center, y_center, width, height) rows.
+        - labels (dict): Phase counters (stream.phases).
+        - processor (FrameProcessor): Colour and HUD values; without it only the boxes are drawn.
+
+        Returns:
+        - ndarray: BGR canvas (reused by the next call; copy it to keep it).
+        """
+        pixels = load_frame(frame).pixels
+        if self._canvas is None or self._canvas.shape != pixels.shape:
+            self._canvas = np.empty_like(pixels)
+        canvas = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR, dst=self._canvas)
+        height, width = canvas.shape[:2]
+
+        box_color = bgr_color(processor.current_color if processor else "blue")
+        for class_id, x_center, y_center, box_width, box_height in detections:
+            x_center *= width
+            y_center *= height
+            box_width *= width
+            box_height *= height
+            self._draw_rectangle(canvas, int(x_center - box_width / 2), int(y_center - box_height / 2),
+                                 int(x_center + box_width / 2), int(y_center + box_height / 2), box_color,
+                                 self.box_width)
+
+        if processor:
+            panel_x, panel_y, panel_width, panel_height = self.panel
+            self._draw_rectangle(canvas, panel_x, panel_y, panel_x + panel_width, panel_y + panel_height, box_color,
+                                 self.panel_line_width)
+            text_color = bgr_color("black")
+            label_y = panel_y + 10
+            for (_, label_mask, label_width), (_, value) in zip(self._labels, hud_lines(labels, processor)):
+                self._blend_text(canvas, label_mask, panel_x + 10, label_y, text_color)
+                self._blend_text(canvas, self._text_mask(value), panel_x + 10 + label_width, label_y, text_color)
+                label_y += self.font_size + 5
+        return canvas
+
+
+class _EmptyProcessor:
+    """Stand-in FrameProcessor used to list the HUD labels."""
+    end_frames = []
+    start_frames = []
+    duration = []
+    success_count = 0
+    total_experiments = 0
+
+
+class VideoFileSink:
+    """
+    Writes annotated BGR frames straight into a video file (replaces the per-frame JPEGs and the separate
+    video step).
+
+    Parameters:
+    - path (str): Output video (.mp4 with 'mp4v', .avi with 'MJPG', ...).
+    - fps (float): Frame rate of the output (6 fps for the 5x sampled 30 fps recordings).
+    - fourcc (str): OpenCV codec code.
+    """
+
+    def __init__(self, path, fps=6, fourcc='mp4v'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self._writer = None
+
+    def write(self, canvas):
+        if self._writer is None:
+            height, width = canvas.shape[:2]
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+            if not self._writer.isOpened():
+                raise IOError(f"Cannot open video writer for {self.path}")
+        self._writer.write(canvas)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MjpegStreamSink:
+    """
+    Serves the latest annotated frame as an MJPEG HTTP stream (multipart/x-mixed-replace) for the line display.
+
+    Open http://<host>:<port>/ in a browser. Frames are JPEG encoded once, and only while a client is
+    connected; slow clients skip frames instead of slowing down the analysis.
+
+    Parameters:
+    - port (int): HTTP port.
+    - host (str): Interface to listen on.
+    - quality (int): JPEG quality.
+    """
+
+    def __init__(self, port=8080, host='0.0.0.0', quality=80):
+        self.quality = quality
+        self._condition = threading.Condition()
+        self._jpeg = None
+        self._sequence = 0
+        self._clients = 0
+        self._closed = False
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MjpegStreamSink", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _handler_class(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                with sink._condition:
+                    sink._clients += 1
+                try:
+                    sequence = 0
+                    while True:
+                        with sink._condition:
+                            sink._condition.wait_for(lambda: sink._closed or sink._sequence != sequence)
+                            if sink._closed:
+                                return
+                            jpeg, sequence = sink._jpeg, sink._sequence
+                        self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                         + f'Content-Length: {len(jpeg)}\r\n\r\n'.encode() + jpeg + b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with sink._condition:
+                        sink._clients -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write(self, canvas):
+        if self._clients == 0:
+            return
+        ok, jpeg = cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if ok:
+            with self._condition:
+                self._jpeg = jpeg.tobytes()
+                self._sequence += 1
+                self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Example usage
+#renderer = OverlayRenderer(font_size=50)
+#with VideoFileSink('/Users/nunofernandes/PycharmProjects/challenge_vc/annotated.mp4', fps=6) as sink:
+#    for frame_number, frame in enumerate(FrameSource(input_folder)):
+#        processor.update_state(stream.phases, frame_number)
+#        sink.write(renderer.render(frame, detections, stream.phases, processor))
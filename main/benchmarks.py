@@ -0,0 +1,357 @@
+"""
+Benchmarks of the per-frame hot path.
+
+Usage:
+    python benchmarks.py                                   # Hough line filter micro-benchmark
+    python benchmarks.py pipeline --lengths 1000 10000 100000 [--model THIS_model.onnx] [--json results.json]
+    python benchmarks.py crops                             # Per-crop path vs crop_hand_batch, per preprocessing
+
+The pipeline benchmark generates a reproducible synthetic recording (seeded hand tracks going through
+start/work/end cycles, YOLO label files and noise frames), times every stage frame by frame and reports
+frames/sec, p50/p99 latency per stage and the peak RSS of a fresh process per recording length, so costs
+that grow with the recording length show up as falling frames/sec between lengths.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from frame_differencing import filter_hough_lines, line_angle_range, detect_poke_pen_lines
+
+
+def filter_hough_lines_loop(lines, image_shape, min_length_threshold=10, max_length_threshold=50,
+                            angle_range=(0, np.pi / 4)):
+    """Per-line Python loop detect_poke_pen_lines used before filter_hough_lines (reference for the benchmark)."""
+    if lines is None:
+        return None, None
+    height, width = image_shape
+    scale_factor = np.sqrt(height ** 2 + width ** 2) / 2000
+    for line in lines:
+        rho, theta = line[0]
+        a = np.cos(theta)
+        b = np.sin(theta)
+        x0 = a * rho
+        y0 = b * rho
+        length = 100 * scale_factor
+        x1 = int(x0 + length * (-b))
+        y1 = int(y0 + length * (a))
+        x2 = int(x0 - length * (-b))
+        y2 = int(y0 - length * (a))
+        line_length = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        if min_length_threshold <= line_length <= max_length_threshold and angle_range[0] <= theta <= angle_range[1]:
+            return line_length, theta
+    return None, None
+
+
+def synthetic_hough_lines(count, seed=0):
+    """(count, 1, 2) float32 rho/theta array shaped like cv2.HoughLines output."""
+    rng = np.random.default_rng(seed)
+    rhos = rng.uniform(-300, 300, count)
+    thetas = rng.uniform(0, np.pi, count)
+    return np.stack([rhos, thetas], axis=1).astype(np.float32)[:, None, :]
+
+
+def benchmark_line_filter(line_counts=(10, 100, 1000), repeat=5, number=200):
+    """
+    Micro-benchmark of the Hough line filter: scalar loop vs filter_hough_lines.
+
+    The loop stops at the first valid line, so lines are drawn with a length band no line satisfies
+    (the worst case, where every line is visited; frames with no poke or pen stroke look like this).
+
+    Returns:
+    - dict: line count -> {'loop_us', 'vectorised_us', 'speedup'} (best of repeat, per call).
+    """
+    results = {}
+    image_shape = (224, 224)
+    angle_range = line_angle_range("pen")
+    for count in line_counts:
+        lines = synthetic_hough_lines(count)
+        loop_s = min(timeit.repeat(lambda: filter_hough_lines_loop(lines, image_shape, 1000, 1001, angle_range),
+                                   repeat=repeat, number=number)) / number
+        vectorised_s = min(timeit.repeat(lambda: filter_hough_lines(lines, image_shape, 1000, 1001, angle_range),
+                                         repeat=repeat, number=number)) / number
+        results[count] = {
+            'loop_us': loop_s * 1e6,
+            'vectorised_us': vectorised_s * 1e6,
+            'speedup': loop_s / vectorised_s,
+        }
+    return results
+
+
+# Stages timed by benchmark_pipeline, in hot path order; 'stream' is the whole PokaYokeStream.push
+STAGES = ('label_parsing', 'dominant_hand', 'crop_hand_region', 'detect_poke_pen_lines', 'vgg_preprocess',
+          'vgg_inference', 'annotation', 'stream')
+
+
+def benchmark_crop_batch(batch_sizes=(1, 8, 32), frame_size=(1920, 1080), repeat=5, seed=0):
+    """
+    Hand crops to classifier batch: crop_hand_region + preprocessing per crop vs crop_hand_batch, for every
+    PREPROCESSING (max_abs_diff is 0: the batch rows are the per-crop rows).
+
+    Returns:
+    - dict: preprocessing -> batch size -> {'loop_ms', 'batch_ms', 'speedup', 'max_abs_diff'} (best of repeat).
+    """
+    from main_helper import crop_hand_region
+    from vgg_batcher import PREPROCESSING, crop_hand_batch
+
+    frames = synthetic_frames(8, frame_size, seed)
+    detections = synthetic_detections(max(batch_sizes), seed)
+    results = {}
+    for name, preprocess in PREPROCESSING.items():
+        results[name] = {}
+        for batch_size in batch_sizes:
+            batch_frames = [frames[i % len(frames)] for i in range(batch_size)]
+            batch_detections = detections[:batch_size]
+            out = np.empty((batch_size, 224, 224, 3), dtype=np.float32)
+            loop = lambda: np.stack([preprocess(crop_hand_region(frame, frame_detections))
+                                     for frame, frame_detections in zip(batch_frames, batch_detections)])
+            batched = lambda: crop_hand_batch(batch_frames, batch_detections, name, out=out)[0]
+            loop_s = min(timeit.repeat(loop, repeat=repeat, number=1))
+            batch_s = min(timeit.repeat(batched, repeat=repeat, number=1))
+            results[name][batch_size] = {
+                'loop_ms': loop_s * 1e3,
+                'batch_ms': batch_s * 1e3,
+                'speedup': loop_s / batch_s,
+                'max_abs_diff': float(np.abs(loop() - batched()).max()),
+            }
+    return results
+
+
+def synthetic_detections(n_frames, seed=0, cycle=50):
+    """
+    Hand detections of a synthetic recording: one operation every `cycle` frames.
+
+    Each cycle has idle hands, a reach of the non-dominant hand (start), two-hand work with the non-dominant
+    hand low in the image (crops sent to the classifier) and a few frames with only the dominant hand (end).
+    Positions get a small seeded jitter and are rounded to float32 like detector outputs.
+
+    Returns:
+    - List (one per frame) of lists of (class_id, x_center, y_center, width, height) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    jitters = rng.normal(0, 0.002, (n_frames, 4))
+    frames = []
+    for frame_number in range(n_frames):
+        t = frame_number % cycle
+        if t < 12 or t >= 46:  # Idle
+            non_dominant = (0.3, 0.8, 0.12, 0.2)
+            dominant = (0.7, 0.8)
+        elif t < 18:  # Reach and pick up: the hand moves up and its box contracts
+            k = t - 11
+            non_dominant = (0.3 + 0.025 * k, 0.8 - 0.06 * k, 0.12, 0.2 - 0.025 * k)
+            dominant = (0.7, 0.8)
+        elif t < 38:  # Work
+            k = t - 18
+            non_dominant = (0.45, 0.75, 0.12, 0.15)
+            dominant = (0.6 + 0.1 * np.sin(k / 3), 0.6 + 0.05 * np.cos(k / 3))
+        else:  # The non-dominant hand leaves with the part
+            non_dominant = None
+            dominant = (0.7, 0.7 - 0.02 * (t - 38))
+
+        jitter = jitters[frame_number]
+        detections = []
+        if non_dominant is not None:
+            detections.append((0, non_dominant[0] + jitter[0], non_dominant[1] + jitter[1], non_dominant[2],
+                               non_dominant[3]))
+        detections.append((1, dominant[0] + jitter[2], dominant[1] + jitter[3], 0.12, 0.2))
+        frames.append([(class_id, *(float(np.float32(v)) for v in values)) for class_id, *values in detections])
+    return frames
+
+
+def synthetic_frames(count=8, size=(640, 480), seed=0):
+    """
+    `count` different RGB frames (cycled over the recording, so consecutive crops differ): smooth random
+    blobs, upscaled from low resolution noise, so edge and line densities look like camera frames rather
+    than pixel noise.
+    """
+    import cv2
+    from frames import Frame
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    return [Frame(cv2.resize(rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8), (width, height),
+                             interpolation=cv2.INTER_CUBIC)) for _ in range(count)]
+
+
+class _ConstantClassifier:
+    """Poke/pen classifier stand-in with a fixed output, used by the stream stage when no model is given."""
+
+    def predict(self, batch):
+        return np.tile(np.array([[0.2, 0.5, 0.3]], dtype=np.float32), (len(batch), 1))
+
+
+class _StageTimer:
+    """Per-call latencies (ns) of each stage, in preallocated arrays."""
+
+    def __init__(self, n_frames):
+        self.latencies = {stage: np.empty(n_frames, dtype=np.int64) for stage in STAGES}
+        self.counts = dict.fromkeys(STAGES, 0)
+
+    def time(self, stage, function, *args, **kwargs):
+        start = time.perf_counter_ns()
+        result = function(*args, **kwargs)
+        self.latencies[stage][self.counts[stage]] = time.perf_counter_ns() - start
+        self.counts[stage] += 1
+        return result
+
+    def summary(self, stage):
+        latencies = self.latencies[stage][:self.counts[stage]]
+        if len(latencies) == 0:
+            return None
+        total_s = latencies.sum() / 1e9
+        return {
+            'calls': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)) / 1e6,
+            'p99_ms': float(np.percentile(latencies, 99)) / 1e6,
+            'mean_ms': float(latencies.mean()) / 1e6,
+            'calls_per_s': len(latencies) / total_s if total_s > 0 else float('inf'),
+        }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is in KB on Linux, in bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def benchmark_pipeline(n_frames, model=None, seed=0, workdir=None):
+    """
+    Times every stage of the per-frame hot path on a synthetic recording of n_frames frames.
+
+    Stages: parsing the frame's YOLO label file, dominant hand estimation, crop_hand_region,
+    detect_poke_pen_lines on consecutive crops, VGG preprocessing and inference of the crop (inference only
+    with a model), drawing the annotated frame, and the whole PokaYokeStream.push (live settings, batch 8).
+
+    Parameters:
+    - n_frames (int): Recording length.
+    - model: Poke/pen classifier (see load_poke_pen_model); None skips vgg_inference and uses a constant
+      stand-in inside the stream.
+    - seed (int): Seed of the synthetic recording.
+    - workdir (str): Directory for the label files (a temporary one if None).
+
+    Returns:
+    - dict: frames, fps (stream stage), stages (stage -> p50/p99/mean latency and calls/s), phases and
+      peak_rss_mb.
+    """
+    from Annotate import FrameProcessor
+    from annotated_video import OverlayRenderer
+    from hand_detector import LabelSink
+    from main_helper import parse_txt_file, crop_hand_region
+    from non_dominant_hand import DominantHandEstimator
+    from poka_yoke_stream import PokaYokeStream
+    from vgg_batcher import preprocess_crop
+
+    detections = synthetic_detections(n_frames, seed)
+    frames = synthetic_frames(seed=seed)
+    with tempfile.TemporaryDirectory(dir=workdir) as labels_dir:
+        label_sink = LabelSink(labels_dir)
+        for frame_number, frame_detections in enumerate(detections):
+            label_sink.write(frame_number, frame_detections)
+        label_files = sorted(os.path.join(labels_dir, f) for f in os.listdir(labels_dir))
+
+        timer = _StageTimer(n_frames)
+        estimator = DominantHandEstimator(warmup_frames=300)
+        renderer = OverlayRenderer(font_size=50)
+        processor = FrameProcessor()
+        # Timing only: the PREPROCESSING functions cost about the same
+        stream = PokaYokeStream(model if model is not None else _ConstantClassifier(), batch_size=8,
+                                preprocess=preprocess_crop)
+        previous_crop = None
+
+        for frame_number, label_file in enumerate(label_files):
+            frame = frames[frame_number % len(frames)]
+            frame_detections = timer.time('label_parsing', parse_txt_file, label_file)
+            timer.time('dominant_hand', estimator.update, frame_detections)
+
+            crop = timer.time('crop_hand_region', crop_hand_region, frame, frame_detections)
+            if previous_crop is not None:
+                timer.time('detect_poke_pen_lines', detect_poke_pen_lines, previous_crop, crop,
+                           min_length_threshold=31.14, max_length_threshold=31.149, type="poke")
+            previous_crop = crop
+            batch = timer.time('vgg_preprocess', preprocess_crop, crop)[None]
+            if model is not None:
+                timer.time('vgg_inference', model.predict, batch)
+
+            timer.time('stream', stream.push, frame, frame_detections, frame_number)
+            timer.time('annotation', renderer.render, frame, frame_detections, stream.phases, processor)
+        stream.flush()
+
+    stages = {stage: timer.summary(stage) for stage in STAGES}
+    stream_s = timer.latencies['stream'][:timer.counts['stream']].sum() / 1e9
+    return {
+        'frames': n_frames,
+        'fps': n_frames / stream_s if stream_s > 0 else float('inf'),
+        'stages': stages,
+        'phases': dict(stream.phases),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _benchmark_pipeline_job(n_frames, model_path, seed, workdir):
+    model = None
+    if model_path is not None:
+        from poke_pen_backend import load_poke_pen_model
+        model = load_poke_pen_model(model_path)
+    return benchmark_pipeline(n_frames, model, seed, workdir)
+
+
+def benchmark_scaling(lengths=(1000, 10000, 100000), model_path=None, seed=0, workdir=None):
+    """
+    Runs benchmark_pipeline for each recording length, each in a fresh process so peak RSS is per length.
+
+    Returns:
+    - dict: length -> benchmark_pipeline result.
+    """
+    results = {}
+    for n_frames in lengths:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[n_frames] = pool.submit(_benchmark_pipeline_job, n_frames, model_path, seed, workdir).result()
+    return results
+
+
+def print_pipeline_results(results):
+    for n_frames, result in results.items():
+        print(f"{n_frames} frames: {result['fps']:.1f} frames/s (stream), peak RSS {result['peak_rss_mb']:.0f} MB, "
+              f"phases {result['phases']}")
+        for stage, summary in result['stages'].items():
+            if summary is None:
+                print(f"  {stage:22s} skipped")
+            else:
+                print(f"  {stage:22s} p50 {summary['p50_ms']:8.3f} ms  p99 {summary['p99_ms']:8.3f} ms  "
+                      f"{summary['calls_per_s']:10.1f} calls/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the per-frame hot path.")
+    parser.add_argument('benchmark', nargs='?', default='lines', choices=('lines', 'pipeline', 'crops'))
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Synthetic recording lengths (pipeline)")
+    parser.add_argument('--model', default=None, help="Poke/pen classifier for the vgg_inference stage (pipeline)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.benchmark == 'lines':
+        results = benchmark_line_filter()
+        for count, result in results.items():
+            print(f"{count:5d} lines: loop {result['loop_us']:9.1f} us, vectorised {result['vectorised_us']:7.1f} us, "
+                  f"x{result['speedup']:.1f}")
+    elif args.benchmark == 'crops':
+        results = benchmark_crop_batch(seed=args.seed)
+        for name, by_batch_size in results.items():
+            for batch_size, result in by_batch_size.items():
+                print(f"{name:8s} batch {batch_size:3d}: loop {result['loop_ms']:8.1f} ms, crop_hand_batch "
+                      f"{result['batch_ms']:7.1f} ms, x{result['speedup']:.1f} (max |diff| {result['max_abs_diff']})")
+    else:
+        results = benchmark_scaling(args.lengths, args.model, args.seed)
+        print_pipeline_results(results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1)
@@ -0,0 +1,111 @@
+import os
+import pickle
+from collections import namedtuple
+
+# 2: PredictionWindow keeps its landmark predictions, 3: classifier gate state, 4: no dominant hand track
+CHECKPOINT_VERSION = 4
+
+# PokaYokeStream attributes saved in a checkpoint (everything but the classifier and its batcher)
+STREAM_FIELDS = ('hand_estimator', 'state', 'crop_jobs', 'frame_number', 'previous_frame_number', 'last_reset_frame')
+
+# PredictionBatcher attributes saved along: a ChangeGate reuses last_prediction until its reference crop changes
+BATCHER_FIELDS = ('last_prediction', 'model_calls')
+
+# A loaded checkpoint: frame_number is the last analysed frame, events the PhaseEvents up to it, source the
+# (input_folder, frame_stride) it was made from and extra the caller's object (e.g. the annotation FrameProcessor)
+Checkpoint = namedtuple('Checkpoint', ['frame_number', 'events', 'source', 'stream_fields', 'batcher_fields',
+                                       'extra'])
+
+
+def _batcher_state(batcher):
+    """Attributes of a batcher (and its ChangeGate) a resumed run needs to reuse the same predictions."""
+    if batcher is None:
+        return None
+    state = {field: getattr(batcher, field) for field in BATCHER_FIELDS}
+    if batcher.gate is not None:
+        state['gate'] = {slot: getattr(batcher.gate, slot) for slot in type(batcher.gate).__slots__}
+    return state
+
+
+def save_checkpoint(path, stream, events, source=None, extra=None):
+    """
+    Writes the analysis state of a stream after its last pushed frame.
+
+    The file is written next to path and renamed over it, so a run killed while checkpointing leaves the
+    previous checkpoint intact.
+
+    Parameters:
+    - path (str): Checkpoint file.
+    - stream (PokaYokeStream): Stream to save; its pending crops must have been classified (stream.flush()).
+    - events (list): PhaseEvents returned so far.
+    - source (tuple): (input_folder, frame_stride), checked on resume.
+    - extra: Any picklable object saved along (returned as Checkpoint.extra).
+    """
+    if stream.batcher is not None and len(stream.batcher):
+        raise ValueError("Flush the pending crops before checkpointing the stream")
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'frame_number': stream.frame_number,
+        'events': list(events),
+        'source': source,
+        'stream': {field: getattr(stream, field) for field in STREAM_FIELDS},
+        'batcher': _batcher_state(stream.batcher),
+        'extra': extra,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint written by save_checkpoint.
+
+    Returns:
+    - Checkpoint
+    """
+    with open(path, 'rb') as file:
+        checkpoint = pickle.load(file)
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version in {path}: {checkpoint.get('version')}")
+    return Checkpoint(checkpoint['frame_number'], checkpoint['events'], checkpoint['source'], checkpoint['stream'],
+                      checkpoint['batcher'], checkpoint['extra'])
+
+
+def restore_stream(stream, checkpoint, source=None):
+    """
+    Puts a freshly built stream (same classifier and settings) in the state of a checkpoint.
+
+    Parameters:
+    - stream (PokaYokeStream): Stream to restore (updated in place).
+    - checkpoint (Checkpoint): From load_checkpoint.
+    - source (tuple): (input_folder, frame_stride) of the run being resumed; must match the checkpoint's.
+
+    Returns:
+    - PokaYokeStream
+    """
+    if source is not None and checkpoint.source is not None and tuple(checkpoint.source) != tuple(source):
+        raise ValueError(f"Checkpoint was made from {checkpoint.source}, not {source}")
+    for field, value in checkpoint.stream_fields.items():
+        setattr(stream, field, value)
+    batcher_fields = dict(checkpoint.batcher_fields or {})
+    gate_fields = batcher_fields.pop('gate', None)
+    if stream.batcher is not None:
+        if (gate_fields is None) != (stream.batcher.gate is None):
+            raise ValueError("Checkpoint and stream differ in the use of a classifier gate")
+        for field, value in batcher_fields.items():
+            setattr(stream.batcher, field, value)
+        # Restored in place: the caller keeps its ChangeGate (and reads its hit rate after the run)
+        for slot, value in (gate_fields or {}).items():
+            setattr(stream.batcher.gate, slot, value)
+    return stream
+
+
+# Example usage
+#save_checkpoint('/Users/nunofernandes/PycharmProjects/challenge_vc/run.ckpt', stream, events)
+#checkpoint = load_checkpoint('/Users/nunofernandes/PycharmProjects/challenge_vc/run.ckpt')
+#stream = restore_stream(PokaYokeStream(model_poke_pen, preprocess='vgg19'), checkpoint)
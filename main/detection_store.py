@@ -0,0 +1,178 @@
+import os
+import numpy as np
+
+# One row per YOLO detection; frame_idx is the position of the label file in the sorted listing,
+# which is the frame_number used by main(). The box is float64, the value float() reads from the label file
+DETECTION_DTYPE = np.dtype([
+    ('frame_idx', '<i4'),
+    ('class_id', '<i2'),
+    ('xc', '<f8'),
+    ('yc', '<f8'),
+    ('w', '<f8'),
+    ('h', '<f8'),
+    ('conf', '<f4'),  # NaN when the labels were saved without save_conf
+])
+
+STORE_SUFFIX = '.dets'
+
+
+def _parse_label_lines(txt_file):
+    """Reads the rows of one YOLO .txt file as (class_id, xc, yc, w, h, conf) tuples."""
+    rows = []
+    with open(txt_file, 'r') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 5:
+                conf = float(parts[5]) if len(parts) >= 6 else np.nan
+                rows.append((int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), conf))
+    return rows
+
+
+def ingest_labels(txt_dir, store_path=None):
+    """
+    Packs a whole runs/detect/*/labels directory into a single detection store file.
+
+    The file holds two .npy blocks back to back: the per-frame offset index (int64, n_frames + 1)
+    and the structured detections array (DETECTION_DTYPE). Rows of frame N are
+    detections[offsets[N]:offsets[N + 1]].
+
+    Parameters:
+    - txt_dir (str): Directory containing .txt files with YOLO detections.
+    - store_path (str): Output file. Defaults to the labels directory path + '.dets'.
+
+    Returns:
+    - str: Path of the written store.
+    """
+    if store_path is None:
+        store_path = default_store_path(txt_dir)
+    txt_files = sorted([os.path.join(txt_dir, f) for f in os.listdir(txt_dir) if f.endswith('.txt')])
+
+    offsets = np.zeros(len(txt_files) + 1, dtype='<i8')
+    rows = []
+    for frame_idx, txt_file in enumerate(txt_files):
+        frame_rows = _parse_label_lines(txt_file)
+        rows.extend((frame_idx,) + row for row in frame_rows)
+        offsets[frame_idx + 1] = offsets[frame_idx] + len(frame_rows)
+    detections = np.array(rows, dtype=DETECTION_DTYPE)
+
+    # Write to a temporary file first so a crashed ingest never leaves a truncated store behind
+    tmp_path = store_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.lib.format.write_array(file, offsets, allow_pickle=False)
+        np.lib.format.write_array(file, detections, allow_pickle=False)
+    os.replace(tmp_path, store_path)
+    return store_path
+
+
+def default_store_path(txt_dir):
+    """Store file that sits next to the labels directory (e.g. runs/detect/predict4/labels.dets)."""
+    return os.path.normpath(txt_dir) + STORE_SUFFIX
+
+
+def _memmap_next_array(file, path):
+    """Reads the .npy header at the current position of file and memory maps the array behind it."""
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    offset = file.tell()
+    count = int(np.prod(shape))
+    if count == 0:
+        array = np.zeros(shape, dtype=dtype)
+    else:
+        array = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                          order='F' if fortran_order else 'C')
+    file.seek(offset + count * dtype.itemsize)
+    return array
+
+
+def _store_headers(store_path):
+    """(shape, dtype) of the offsets and of the detections of a store file, read without mapping them."""
+    headers = []
+    with open(store_path, 'rb') as file:
+        for _ in range(2):
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            file.seek(int(np.prod(shape)) * dtype.itemsize, os.SEEK_CUR)
+            headers.append((shape, dtype))
+    return headers
+
+
+def _store_is_current(txt_dir, store_path):
+    """
+    True if the store holds the labels directory as it is now: one frame per .txt file, no file (nor the
+    directory) modified after the store was written, and the current DETECTION_DTYPE. A label file
+    rewritten in place does not change the directory's mtime, so every file is checked.
+    """
+    if not os.path.exists(store_path):
+        return False
+    store_mtime = os.path.getmtime(store_path)
+    label_mtimes = [entry.stat().st_mtime for entry in os.scandir(txt_dir) if entry.name.endswith('.txt')]
+    (offsets_shape, _), (_, dtype) = _store_headers(store_path)
+    return (dtype == DETECTION_DTYPE and offsets_shape[0] - 1 == len(label_mtimes) and
+            os.path.getmtime(txt_dir) <= store_mtime and max(label_mtimes, default=0) <= store_mtime)
+
+
+class DetectionStore:
+    """
+    Read-only, memory mapped view of a detection store written by ingest_labels.
+
+    Parameters:
+    - store_path (str): Path of the .dets file.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(store_path, 'rb') as file:
+            self.offsets = _memmap_next_array(file, store_path)
+            self.detections = _memmap_next_array(file, store_path)
+        if self.detections.dtype != DETECTION_DTYPE:
+            raise ValueError(f"{store_path} was written by an older ingest_labels; ingest the labels again")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, frame_idx):
+        """Structured array with the rows of one frame (a view, no copy)."""
+        return self.detections[self.offsets[frame_idx]:self.offsets[frame_idx + 1]]
+
+    def frame_detections(self, frame_idx):
+        """
+        Detections of one frame in the same format as parse_txt_file.
+
+        Returns:
+        - List of tuples: Each tuple contains (class_id, x_center, y_center, width, height)
+        """
+        rows = self.frame(frame_idx)
+        return list(zip(rows['class_id'].tolist(), rows['xc'].tolist(), rows['yc'].tolist(), rows['w'].tolist(),
+                        rows['h'].tolist()))
+
+    def __iter__(self):
+        for frame_idx in range(len(self)):
+            yield self.frame_detections(frame_idx)
+
+
+def open_detection_store(source):
+    """
+    Returns a DetectionStore for a labels directory, a .dets file or an existing store.
+
+    A labels directory is ingested once; the store is rebuilt only when the labels changed after the store
+    was written (files added, removed or rewritten), or when the store has an older DETECTION_DTYPE.
+    """
+    if isinstance(source, DetectionStore):
+        return source
+    if os.path.isdir(source):
+        store_path = default_store_path(source)
+        if not _store_is_current(source, store_path):
+            ingest_labels(source, store_path)
+        source = store_path
+    return DetectionStore(source)
+
+
+def iter_frame_detections(source):
+    """Yields the detections of every frame, in frame order, from any source accepted by open_detection_store."""
+    return iter(open_detection_store(source))
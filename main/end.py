@@ -1,5 +1,5 @@
-import os
 from non_dominant_hand import analyze_disappearance_and_position
+from detection_store import open_detection_store
 
 def parse_txt_file(txt_file):
     """
@@ -29,20 +29,22 @@ def analyze_single_hand_frames(txt_dir='/Users/nunofernandes/PycharmProjects/cha
     and check the direction of movement based on previous y_center values.
 
     Parameters:
-    - txt_dir (str): Directory containing .txt files with YOLO detections.
+    - txt_dir (str): Directory containing .txt files with YOLO detections (or a detection store).
 
     Returns:
     - List of frame numbers where only one hand is detected and the vertical movement direction is evaluated.
     """
-    txt_files = sorted([os.path.join(txt_dir, f) for f in os.listdir(txt_dir) if f.endswith('.txt')])
+    detection_store = open_detection_store(txt_dir)
 
     single_hand_frames = []
     last_valid_frame = -5  # Initialize to ensure the first valid frame is always added
 
     y_positions = []  # List to keep track of y_center values
 
-    for frame_number, txt_file in enumerate(txt_files):
-        detections = parse_txt_file(txt_file)
+    # Dominant hand is estimated once for the whole directory, not once per frame
+    dominant_hand_position = analyze_disappearance_and_position(detection_store)[0]
+
+    for frame_number, detections in enumerate(detection_store):
 
         # Filter out the hand detections (assuming class_id 0 and 1 represent the hands)
         hand_detections = [d for d in detections if d[0] == 0 or d[0] == 1]
@@ -54,7 +56,7 @@ def analyze_single_hand_frames(txt_dir='/Users/nunofernandes/PycharmProjects/cha
             hand_1_x = hand_detections[1][1]  # X-center of hand 1
             hand_1_y = hand_detections[1][2]  # Y-center of hand 1
 
-            if analyze_disappearance_and_position(txt_dir)[0] == "right":
+            if dominant_hand_position == "right":
                 if hand_1_x > hand_0_x:
                     dominant_hand_detection = hand_detections[0]  # Hand 1 is on the right
                 else:
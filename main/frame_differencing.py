@@ -1,29 +1,47 @@
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+from collections import namedtuple
 
 
 import cv2
 import numpy as np
 
-def detect_poke_pen_lines(image_before, image_after, target_size=(224, 224), line_threshold=100,
-                          min_length_threshold=10, max_length_threshold=50, angle_range=(0, np.pi / 4), type="poka"):
+# Precision of float32 * python float in this NumPy version (float64 before NumPy 2, float32 after).
+# The line endpoints are computed with it so the vectorised filter truncates exactly like the old scalar loop.
+_ENDPOINT_DTYPE = (np.float32(1) * 1.0).dtype
+
+
+class DetectedLines(namedtuple('DetectedLines', ['lengths', 'thetas', 'rhos'])):
     """
-    Detect and visualize the pickup action by comparing two images.
+    Hough lines that passed the length and angle filter, in Hough order.
 
-    Parameters:
-    - image_before: Image before the pickup action (PIL or numpy array).
-    - image_after: Image after the pickup action (PIL or numpy array).
-    - target_size: Tuple indicating the size to which both images should be resized.
-    - line_threshold: Threshold for the Hough Line Transform.
-    - min_length_threshold: Minimum length of lines to consider.
-    - max_length_threshold: Maximum length of lines to consider.
-    - angle_range: Tuple (min_angle, max_angle) defining the range of angles to keep in radians.
-    - type: Specifies "poka" or "pen" movement.
+    - lengths (ndarray): Segment length of each line.
+    - thetas (ndarray): Angle of each line in radians.
+    - rhos (ndarray): Distance of each line to the origin.
     """
-    # Convert the PIL image to a numpy array if necessary
-    img_np_before = np.array(image_before)
-    img_np_after = np.array(image_after)
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def first(self):
+        """(line_length, theta) of the first line, or (None, None) like detect_poke_pen_lines."""
+        if len(self.lengths) == 0:
+            return None, None
+        return self.lengths[0], self.thetas[0]
+
+
+def difference_edges(image_before, image_after, target_size=(224, 224)):
+    """
+    Computes the absolute grayscale difference of two images and its Canny edges.
+
+    Returns:
+    - Tuple: (diff, edges), both uint8 arrays of the target size.
+    """
+    # Convert the PIL image to a numpy array if necessary (arrays, e.g. Frame crops, are used without a copy)
+    img_np_before = np.asarray(image_before)
+    img_np_after = np.asarray(image_after)
 
     # Convert to RGB if the image is in grayscale
     if img_np_before.ndim == 2 or img_np_before.shape[2] == 1:  # Check if image is grayscale
@@ -50,69 +68,294 @@ def detect_poke_pen_lines(image_before, image_after, target_size=(224, 224), lin
     # Apply Canny edge detection to the difference image
     edges = cv2.Canny(diff, 150, 160, apertureSize=3)
 
-    # Apply Hough Line Transform to detect lines in the edge-detected image
-    lines = cv2.HoughLines(edges, 1.5, np.pi / 180, line_threshold)
+    return diff, edges
+
+
+def hough_lines(edges, line_threshold=100):
+    """Hough Line Transform of an edge image: (N, 1, 2) rho/theta array, or None."""
+    return cv2.HoughLines(edges, 1.5, np.pi / 180, line_threshold)
 
-    small_lines = []
 
-    # Initialize variables for the line length and angle
-    detected_line_length = None
-    detected_theta = None
+def difference_lines(image_before, image_after, target_size=(224, 224), line_threshold=100):
+    """
+    Runs the frame difference, Canny and Hough Line Transform on two images.
 
+    Returns:
+    - Tuple: (lines, (height, width)) where lines is the (N, 1, 2) rho/theta array of cv2.HoughLines
+      (None if nothing was found) and (height, width) is the size of the difference image.
+    """
+    diff, edges = difference_edges(image_before, image_after, target_size)
+    return hough_lines(edges, line_threshold), edges.shape[:2]
 
-    # Offset to shift the line position if needed
-    x_offset = 0  # Adjust this value as needed
-    y_offset = 0
 
-    # Set angle ranges based on the type
+def line_angle_range(type, angle_range=(0, np.pi / 4)):
+    """Angle range used for a movement type ("pen", "poka"); other types keep angle_range."""
     if type == "pen":
-        angle_range = [0.1, np.pi/2]  # Approx range for pen movement
+        return [0.1, np.pi / 2]  # Approx range for pen movement
     elif type == "poka":
-        angle_range = [np.pi / 2, np.pi]  # Approx range for poka movement
+        return [np.pi / 2, np.pi]  # Approx range for poka movement
+    return angle_range
+
+
+def filter_hough_lines(lines, image_shape, min_length_threshold=10, max_length_threshold=50,
+                       angle_range=(0, np.pi / 4)):
+    """
+    Filters the whole cv2.HoughLines output by segment length and angle in one NumPy pass.
+
+    Parameters:
+    - lines: (N, 1, 2) rho/theta array from cv2.HoughLines, or None.
+    - image_shape: (height, width) of the image the lines were found in.
+    - min_length_threshold: Minimum length of lines to consider.
+    - max_length_threshold: Maximum length of lines to consider.
+    - angle_range: Tuple (min_angle, max_angle) defining the range of angles to keep in radians.
+
+    Returns:
+    - DetectedLines with every qualifying line.
+    """
+    if lines is None or len(lines) == 0:
+        empty = np.empty(0)
+        return DetectedLines(empty, empty.astype(np.float32), empty.astype(np.float32))
+
+    rhos = lines[:, 0, 0]
+    thetas = lines[:, 0, 1]
+
+    # Set a scaling factor based on the image resolution
+    height, width = image_shape
+    scale_factor = np.sqrt(height ** 2 + width ** 2) / 2000
+    # Adjust the length of the line based on the image resolution (same for every line)
+    length = 100 * scale_factor
+
+    a = np.cos(thetas)
+    b = np.sin(thetas)
+    x0 = (a * rhos).astype(_ENDPOINT_DTYPE)
+    y0 = (b * rhos).astype(_ENDPOINT_DTYPE)
+    dx = float(length) * -b.astype(_ENDPOINT_DTYPE)
+    dy = float(length) * a.astype(_ENDPOINT_DTYPE)
+
+    # Endpoints truncated to int, as int() did in the scalar loop
+    x1 = np.trunc(x0 + dx).astype(np.int64)
+    y1 = np.trunc(y0 + dy).astype(np.int64)
+    x2 = np.trunc(x0 - dx).astype(np.int64)
+    y2 = np.trunc(y0 - dy).astype(np.int64)
+    line_lengths = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+    thetas_compared = thetas.astype(_ENDPOINT_DTYPE)
+    keep = ((min_length_threshold <= line_lengths) & (line_lengths <= max_length_threshold)
+            & (angle_range[0] <= thetas_compared) & (thetas_compared <= angle_range[1]))
+    return DetectedLines(line_lengths[keep], thetas[keep], rhos[keep])
+
+
+# Crop boxes and ROI window of an ROI frame difference, in frame pixels: box_before/box_after are the integer
+# (min_x, min_y, max_x, max_y) boxes of the two crops (as Frame.crop rounds them) and window the region to compare
+DiffWindow = namedtuple('DiffWindow', ['box_before', 'box_after', 'window'])
+
+
+def dominant_hand_window(dominant_hand_detection, frame_size, window_scale=2.0, min_side=32):
+    """
+    Adaptive ROI window centred on the dominant hand: a square window_scale times the larger side of its box.
+
+    Parameters:
+    - dominant_hand_detection: (class_id, x_center, y_center, width, height) YOLO detection.
+    - frame_size (tuple): (width, height) of the frame in pixels.
+    - window_scale (float): Window side over the larger side of the hand box.
+    - min_side (int): Minimum window side in pixels.
+
+    Returns:
+    - Tuple: (min_x, min_y, max_x, max_y) in frame pixels (not clipped).
+    """
+    width, height = frame_size
+    x_center = dominant_hand_detection[1] * width
+    y_center = dominant_hand_detection[2] * height
+    half_side = max(window_scale * max(dominant_hand_detection[3] * width, dominant_hand_detection[4] * height),
+                    min_side) / 2
+    return (int(round(x_center - half_side)), int(round(y_center - half_side)),
+            int(round(x_center + half_side)), int(round(y_center + half_side)))
+
+
+def map_hough_lines(lines, offset, scale):
+    """
+    Re-expresses (N, 1, 2) rho/theta Hough lines of a window in another image frame, where
+    x' = (x + offset_x) * scale_x and y' = (y + offset_y) * scale_y (window inside a resized crop).
+    """
+    if lines is None:
+        return None
+    rhos = lines[:, 0, 0].astype(np.float64)
+    thetas = lines[:, 0, 1].astype(np.float64)
+    cos_t, sin_t = np.cos(thetas), np.sin(thetas)
+    # x cos + y sin = rho in the window is (x + ox) cos + (y + oy) sin = rho + ox cos + oy sin
+    rhos = rhos + offset[0] * cos_t + offset[1] * sin_t
+    normal_x, normal_y = cos_t / scale[0], sin_t / scale[1]
+    norm = np.sqrt(normal_x ** 2 + normal_y ** 2)
+    thetas = np.arctan2(normal_y, normal_x)
+    rhos = rhos / norm
+    # cv2.HoughLines keeps theta in [0, pi)
+    flip = thetas < 0
+    thetas[flip] += np.pi
+    rhos[flip] = -rhos[flip]
+    return np.stack([rhos, thetas], axis=1).astype(np.float32)[:, None, :]
+
+
+def window_difference_lines(image_before, image_after, diff_window, target_size=(224, 224), line_threshold=100):
+    """
+    Frame difference, Canny and Hough lines inside an ROI window at native resolution.
+
+    The window is cut from both crops at the same frame position (the crops are aligned by their boxes instead
+    of being stretched to target_size), and the lines are returned in the coordinates of image_after resized
+    to target_size, the frame the length bands of the phase detectors were tuned in. The Hough threshold is
+    scaled by the native pixels per target pixel.
+
+    Returns:
+    - Tuple: (diff, edges, lines), or None when the window does not overlap both crops.
+    """
+    box_before, box_after, window = diff_window
+    if box_before is None or box_after is None:
+        return None
+    min_x = max(window[0], box_before[0], box_after[0])
+    min_y = max(window[1], box_before[1], box_after[1])
+    max_x = min(window[2], box_before[2], box_after[2])
+    max_y = min(window[3], box_before[3], box_after[3])
+    if max_x - min_x < 8 or max_y - min_y < 8:
+        return None
+
+    def gray_window(image, box):
+        pixels = np.asarray(image)
+        pixels = pixels[min_y - box[1]:max_y - box[1], min_x - box[0]:max_x - box[0]]
+        # Same channel weights as difference_edges, so the Canny thresholds see the same differences
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY) if pixels.ndim == 3 and pixels.shape[2] == 3 else pixels
+
+    diff = cv2.absdiff(gray_window(image_after, box_after), gray_window(image_before, box_before))
+    edges = cv2.Canny(diff, 150, 160, apertureSize=3)
+
+    after_width, after_height = box_after[2] - box_after[0], box_after[3] - box_after[1]
+    scale = (target_size[0] / after_width, target_size[1] / after_height)
+    native_per_target = 1 / np.sqrt(scale[0] * scale[1])
+    lines = hough_lines(edges, max(int(round(line_threshold * native_per_target)), 1))
+    return diff, edges, map_hough_lines(lines, (min_x - box_after[0], min_y - box_after[1]), scale)
+
+
+class FrameDiff:
+    """
+    Difference image, edges and Hough lines of one frame pair, computed once and shared by every
+    line classifier (poke, pen, future probes) that looks at the pair.
+
+    Everything is computed lazily on the first query, and each (length band, angle range) query is cached.
+
+    Parameters:
+    - image_before: Previous hand crop (PIL or numpy array).
+    - image_after: Current hand crop (PIL or numpy array).
+    - target_size: Tuple indicating the size to which both images should be resized.
+    - line_threshold: Threshold for the Hough Line Transform.
+    - diff_window (DiffWindow or None): ROI mode. Diff, edges and lines are computed only inside the window
+      around the dominant hand, at native resolution (see window_difference_lines); lines are still
+      expressed in the target_size frame, so the length bands and angle ranges keep their meaning. Falls
+      back to the whole crops when the window misses them.
+    """
+
+    def __init__(self, image_before, image_after, target_size=(224, 224), line_threshold=100, diff_window=None):
+        self.image_before = image_before
+        self.image_after = image_after
+        self.target_size = target_size
+        self.line_threshold = line_threshold
+        self.diff_window = diff_window
+        self._diff = None
+        self._edges = None
+        self._lines = None
+        self._lines_computed = False
+        self._queries = {}
+
+    @classmethod
+    def from_lines(cls, lines, target_size=(224, 224), line_threshold=100):
+        """
+        FrameDiff of a pair whose Hough lines were computed elsewhere (e.g. in another process).
+        Only the line queries (query, detect) are available; diff and edges need the images.
+        """
+        frame_diff = cls(None, None, target_size, line_threshold)
+        frame_diff._lines = lines
+        frame_diff._lines_computed = True
+        return frame_diff
+
+    @property
+    def image_shape(self):
+        """(height, width) of the difference image."""
+        return self.target_size[1], self.target_size[0]
 
-    if lines is not None:
-        height, width = img_after.shape[:2]
+    def _compute_edges(self):
+        if self._edges is None:
+            if self.diff_window is not None:
+                result = window_difference_lines(self.image_before, self.image_after, self.diff_window,
+                                                 self.target_size, self.line_threshold)
+                if result is not None:
+                    self._diff, self._edges, self._lines = result
+                    self._lines_computed = True
+                    return
+            self._diff, self._edges = difference_edges(self.image_before, self.image_after, self.target_size)
 
-        # Set a scaling factor based on the image resolution
-        scale_factor = np.sqrt(height ** 2 + width ** 2) / 2000  # Adjust this scaling factor as needed
+    @property
+    def diff(self):
+        self._compute_edges()
+        return self._diff
 
-        for line in lines:
-            rho, theta = line[0]
-            a = np.cos(theta)
-            b = np.sin(theta)
-            x0 = a * rho
-            y0 = b * rho
+    @property
+    def edges(self):
+        self._compute_edges()
+        return self._edges
 
-            # Adjust the length of the line based on the image resolution
-            length = 100 * scale_factor  # Dynamically adjust the length
+    @property
+    def lines(self):
+        """(N, 1, 2) rho/theta array of cv2.HoughLines, or None."""
+        if not self._lines_computed:
+            edges = self.edges  # In ROI mode this also computes the lines
+            if not self._lines_computed:
+                self._lines = hough_lines(edges, self.line_threshold)
+                self._lines_computed = True
+        return self._lines
 
-            # Calculate the endpoints of the line
-            x1 = int(x0 + length * (-b)) + x_offset
-            y1 = int(y0 + length * (a)) + y_offset
-            x2 = int(x0 - length * (-b)) + x_offset
-            y2 = int(y0 - length * (a)) + y_offset
+    def query(self, min_length_threshold=10, max_length_threshold=50, angle_range=(0, np.pi / 4)):
+        """All lines within the length band and angle range, as DetectedLines."""
+        key = (min_length_threshold, max_length_threshold, tuple(angle_range))
+        if key not in self._queries:
+            self._queries[key] = filter_hough_lines(self.lines, self.image_shape, min_length_threshold,
+                                                    max_length_threshold, angle_range)
+        return self._queries[key]
 
-            # Calculate the actual length of the line segment
-            line_length = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    def detect(self, min_length_threshold=10, max_length_threshold=50, angle_range=(0, np.pi / 4), type="poka"):
+        """Same result as detect_poke_pen_lines on the pair: (line_length, theta) or (None, None)."""
+        return self.query(min_length_threshold, max_length_threshold, line_angle_range(type, angle_range)).first()
 
 
-            # Filter lines based on length and angle orientation
-            # Filter lines based on length and angle orientation
-            if min_length_threshold <= line_length <= max_length_threshold and angle_range[0] <= theta <= angle_range[1]:
-                detected_line_length = line_length
-                detected_theta = theta
-                #print(f"Detected Line Length: {line_length}, Angle: {theta}")
-                break  # Exit after finding the first valid line
+def find_poke_pen_lines(image_before, image_after, target_size=(224, 224), line_threshold=100,
+                        min_length_threshold=10, max_length_threshold=50, angle_range=(0, np.pi / 4), type="poka"):
+    """
+    Same as detect_poke_pen_lines, but returns every qualifying line as DetectedLines.
+    """
+    frame_diff = FrameDiff(image_before, image_after, target_size, line_threshold)
+    return frame_diff.query(min_length_threshold, max_length_threshold, line_angle_range(type, angle_range))
 
 
-    return detected_line_length, detected_theta
-                #print(f"Line length Target : {line_length}, Angle: {theta}, THIS")
+def detect_poke_pen_lines(image_before, image_after, target_size=(224, 224), line_threshold=100,
+                          min_length_threshold=10, max_length_threshold=50, angle_range=(0, np.pi / 4), type="poka"):
+    """
+    Detect and visualize the pickup action by comparing two images.
 
-    # Return lines were detected
+    Parameters:
+    - image_before: Image before the pickup action (PIL or numpy array).
+    - image_after: Image after the pickup action (PIL or numpy array).
+    - target_size: Tuple indicating the size to which both images should be resized.
+    - line_threshold: Threshold for the Hough Line Transform.
+    - min_length_threshold: Minimum length of lines to consider.
+    - max_length_threshold: Maximum length of lines to consider.
+    - angle_range: Tuple (min_angle, max_angle) defining the range of angles to keep in radians.
+    - type: Specifies "poka" or "pen" movement.
+
+    Returns:
+    - Tuple: (line_length, theta) of the first valid line, or (None, None).
+    """
+    return find_poke_pen_lines(image_before, image_after, target_size, line_threshold, min_length_threshold,
+                               max_length_threshold, angle_range, type).first()
 
 
 # Example usage
 #image_path_before = '/Users/nunofernandes/PycharmProjects/challenge_vc/frames_5_xyz_w_cropped/frame_00051.jpg'
 #image_path_after = '/Users/nunofernandes/PycharmProjects/challenge_vc/frames_5_xyz_w_cropped/frame_00052.jpg'
 
-#detect_and_visualize_pickup(image_path_before, image_path_after, length_threshold=63, type="pen")
\ No newline at end of file
+#detect_and_visualize_pickup(image_path_before, image_path_after, length_threshold=63, type="pen")
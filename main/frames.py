@@ -0,0 +1,205 @@
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class Frame:
+    """
+    A video frame decoded once and kept as a read-only RGB NumPy array.
+
+    Cropping returns views into the same array, so crop_hand_region, detect_poke_pen_lines, the
+    classifier and the annotation all share one decode per frame.
+
+    Parameters:
+    - pixels (ndarray): (height, width, 3) uint8 RGB array.
+    - frame_number (int): Index of the frame in the recording.
+    - path (str): File the frame was decoded from, if any.
+    """
+
+    def __init__(self, pixels, frame_number=None, path=None):
+        pixels = np.asarray(pixels).view()
+        pixels.flags.writeable = False  # Crops are views: nobody may draw on the shared pixels
+        self.pixels = pixels
+        self.frame_number = frame_number
+        self.path = path
+
+    @classmethod
+    def open(cls, image_path, frame_number=None):
+        """Decodes an image file (same decoder as Image.open, so pixels match the PIL code paths)."""
+        with Image.open(image_path) as image:
+            pixels = np.asarray(image.convert('RGB'))
+        return cls(pixels, frame_number, image_path)
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def size(self):
+        """(width, height), like PIL's Image.size."""
+        return self.width, self.height
+
+    def crop(self, box):
+        """
+        Zero-copy crop with the same rounding as PIL's Image.crop.
+
+        Parameters:
+        - box (tuple): (min_x, min_y, max_x, max_y) in pixels, inside the frame.
+
+        Returns:
+        - ndarray: View of the cropped region.
+        """
+        min_x, min_y, max_x, max_y = (int(round(v)) for v in box)
+        return self.pixels[min_y:max_y, min_x:max_x]
+
+    def to_image(self):
+        """Writable PIL copy of the frame (for drawing annotations)."""
+        return Image.fromarray(self.pixels)
+
+
+def load_frame(image, frame_number=None):
+    """Returns a Frame for an image path, a PIL image, an RGB array or an existing Frame."""
+    if isinstance(image, Frame):
+        return image
+    if isinstance(image, str):
+        return Frame.open(image, frame_number)
+    if isinstance(image, Image.Image):
+        return Frame(np.asarray(image.convert('RGB')), frame_number)
+    return Frame(image, frame_number)
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+_END_OF_SOURCE = object()
+
+
+class FrameSource:
+    """
+    Iterates the frames of a recording as Frame objects, decoded on a background thread.
+
+    The source is either a video file (.mp4, .avi, ...) read directly with OpenCV, or a folder of
+    pre-extracted frame_XXXXX.jpg images (backwards compatibility). Decoded frames wait in a bounded
+    queue, so the analysis loop does not block on disk or decode unless it is faster than the decoder.
+
+    Parameters:
+    - source (str): Video file or frames folder.
+    - stride (int): Keep one frame out of every stride frames (e.g. 5 turns 30 fps into 6 fps).
+    - prefetch (int): Maximum number of decoded frames waiting in the queue.
+    - start (int): First kept frame to return (lets a worker read one segment of a recording).
+    - stop (int or None): Kept frame number to stop before; None reads to the end.
+
+    Frame numbers count the kept frames (0, 1, 2, ...) and stay the same when start is set. Label
+    directories have one file per recording frame, so kept frame k goes with label file k * stride
+    (see analyze_recording).
+    """
+
+    def __init__(self, source, stride=1, prefetch=8, start=0, stop=None):
+        if stride < 1:
+            raise ValueError("stride must be >= 1")
+        self.source = source
+        self.stride = stride
+        self.prefetch = prefetch
+        self.start = start
+        self.stop = stop
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _image_files(self):
+        image_files = sorted(f for f in os.listdir(self.source) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return image_files[::self.stride]
+
+    def _read_folder(self):
+        image_files = self._image_files()
+        stop = len(image_files) if self.stop is None else min(self.stop, len(image_files))
+        for frame_number in range(self.start, stop):
+            if self._stop.is_set():
+                return
+            yield Frame.open(os.path.join(self.source, image_files[frame_number]), frame_number)
+
+    def _read_video(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise IOError(f"Cannot open video {self.source}")
+        try:
+            frame_number = self.start
+            if self.start > 0:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, self.start * self.stride)
+            while not self._stop.is_set() and (self.stop is None or frame_number < self.stop):
+                ok, bgr = capture.read()
+                if not ok:
+                    return
+                yield Frame(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), frame_number)
+                frame_number += 1
+                # grab() skips the frames dropped by the stride without converting them
+                for _ in range(self.stride - 1):
+                    if not capture.grab():
+                        return
+        finally:
+            capture.release()
+
+    def frame_count(self):
+        """
+        Number of kept frames in the whole source (ignores start/stop). For videos it comes from the
+        container header, which some encoders get slightly wrong.
+        """
+        if os.path.isdir(self.source):
+            return len(self._image_files())
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise IOError(f"Cannot open video {self.source}")
+        try:
+            total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        finally:
+            capture.release()
+        return -(-total // self.stride)
+
+    def _produce(self):
+        try:
+            frames = self._read_folder() if os.path.isdir(self.source) else self._read_video()
+            for frame in frames:
+                self._put(frame)
+        except Exception as error:  # Re-raised in the consumer thread
+            self._put(error)
+        self._put(_END_OF_SOURCE)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        self.close()
+        self._stop.clear()
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        self._thread = threading.Thread(target=self._produce, name="FrameSource", daemon=True)
+        self._thread.start()
+        while True:
+            item = self._queue.get()
+            if item is _END_OF_SOURCE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """Stops the decoding thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
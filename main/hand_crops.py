@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def stack_detections(detections):
+    """
+    Stacks the detections of several frames into one (B, N, 5) float64 array, padded with class -1 rows.
+
+    Parameters:
+    - detections: (N, 5) array or list of rows for one frame, (B, N, 5) array, or a list of per-frame
+      detections (frames of different streams may have different numbers of rows). Extra columns (conf)
+      are dropped.
+
+    Returns:
+    - ndarray: (B, N, 5) with N >= 1.
+    """
+    if isinstance(detections, np.ndarray) and detections.ndim == 3:
+        return detections[..., :5].astype(np.float64)
+    if isinstance(detections, np.ndarray) or (len(detections) and np.ndim(detections[0]) == 1 and
+                                              len(detections[0]) and np.isscalar(detections[0][0])):
+        detections = [detections]  # One frame
+    frames = [np.asarray(rows, dtype=np.float64).reshape(-1, np.shape(rows)[-1] if len(rows) else 5)[:, :5]
+              for rows in detections]
+    stacked = np.zeros((len(frames), max([len(rows) for rows in frames] + [1]), 5), dtype=np.float64)
+    stacked[:, :, 0] = -1
+    for i, rows in enumerate(frames):
+        stacked[i, :len(rows)] = rows
+    return stacked
+
+
+def hand_crop_boxes(widths, heights, detections, width_reduction=0.8, height_reduction=0.6, move_factor=1):
+    """
+    hand_crop_box for a batch of frames, in one NumPy pass (same boxes as hand_crop_box frame by frame).
+
+    Parameters:
+    - widths (int or array): Image width(s) in pixels, one per frame for frames of different sizes.
+    - heights (int or array): Image height(s) in pixels.
+    - detections: Detections of the frames (see stack_detections).
+    - width_reduction (float): Fraction of the bounding box width to reduce.
+    - height_reduction (float): Fraction of the bounding box height to reduce.
+    - move_factor (float): Fraction to adjust the bounding box position to move it away from the body.
+
+    Returns:
+    - ndarray: (B, 4) float64 rows of (min_x, min_y, max_x, max_y) in pixels, clipped to the images.
+    """
+    detections = stack_detections(detections)
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.float64), detections.shape[:1])
+    heights = np.broadcast_to(np.asarray(heights, dtype=np.float64), detections.shape[:1])
+    is_hand = (detections[:, :, 0] == 0) | (detections[:, :, 0] == 1)
+
+    # YOLO format to pixel coordinates, truncated like int()
+    x_center = detections[:, :, 1] * widths[:, None]
+    y_center = detections[:, :, 2] * heights[:, None]
+    box_width = detections[:, :, 3] * widths[:, None]
+    box_height = detections[:, :, 4] * heights[:, None]
+    min_x = np.minimum(np.where(is_hand, np.trunc(x_center - box_width / 2), np.inf).min(axis=1), widths)
+    min_y = np.minimum(np.where(is_hand, np.trunc(y_center - box_height / 2), np.inf).min(axis=1), heights)
+    max_x = np.maximum(np.where(is_hand, np.trunc(x_center + box_width / 2), -np.inf).max(axis=1), 0)
+    max_y = np.maximum(np.where(is_hand, np.trunc(y_center + box_height / 2), -np.inf).max(axis=1), 0)
+
+    # Reduce the box, then move it away from the body (same steps as hand_crop_box)
+    box_width = max_x - min_x
+    box_height = max_y - min_y
+    width_reduction_amount = (box_width - (box_width - width_reduction * box_width)) / 2
+    height_reduction_amount = (box_height - (box_height - height_reduction * box_height)) / 2
+    min_x = min_x + width_reduction_amount
+    max_x = max_x - width_reduction_amount
+    min_y = min_y + height_reduction_amount
+    max_y = max_y - height_reduction_amount
+    move_x = (max_x - min_x) * move_factor
+    move_y = (max_y - min_y) * move_factor
+
+    return np.stack([
+        np.maximum(min_x - move_x, 0),
+        np.maximum(min_y - move_y, 0),
+        np.minimum(max_x + move_x, widths),
+        np.minimum(max_y + move_y, heights),
+    ], axis=1)
+
+
+def crop_boxes(widths, heights, detections, width_reduction=0.8, height_reduction=0.6, move_factor=1):
+    """
+    Integer pixel boxes of hand_crop_boxes, rounded like Frame.crop (the boxes the crops are cut with).
+
+    Returns:
+    - ndarray: (B, 4) int64 rows of (min_x, min_y, max_x, max_y).
+    """
+    return np.rint(hand_crop_boxes(widths, heights, detections, width_reduction, height_reduction,
+                                   move_factor)).astype(np.int64)
@@ -0,0 +1,85 @@
+import os
+import numpy as np
+from frames import load_frame
+
+
+class YoloHandDetector:
+    """
+    Runs the YOLO hand detector in-process, on frames as they arrive.
+
+    Replaces the offline `yolo task=detect mode=predict ... save_txt=True` run: the weights are loaded
+    once and every call returns the detections as an array, without writing label files.
+
+    Parameters:
+    - weights (str): best.pt, or an ONNX copy made with export_onnx (runs on ONNX Runtime).
+    - conf (float): Confidence threshold (the CLI run used conf=0.5).
+    - imgsz (int): Inference size.
+    - device (str): 'cpu' for the line PCs.
+    """
+
+    def __init__(self, weights, conf=0.5, imgsz=640, device='cpu'):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights, task='detect')
+        self.conf = conf
+        self.imgsz = imgsz
+        self.device = device
+
+    def detect(self, frame):
+        """
+        Detects the hands in one frame.
+
+        Parameters:
+        - frame: Frame, RGB array, PIL image or image path.
+
+        Returns:
+        - ndarray: (N, 6) float32 rows of (class_id, x_center, y_center, width, height, conf), coordinates
+          normalised to [0, 1] like the label files.
+        """
+        frame = load_frame(frame)
+        # Ultralytics expects BGR arrays (OpenCV convention)
+        bgr = np.ascontiguousarray(frame.pixels[..., ::-1])
+        result = self.model.predict(bgr, conf=self.conf, imgsz=self.imgsz, device=self.device, verbose=False)[0]
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return np.zeros((0, 6), dtype=np.float32)
+        return np.column_stack([
+            boxes.cls.cpu().numpy(),
+            boxes.xywhn.cpu().numpy(),
+            boxes.conf.cpu().numpy(),
+        ]).astype(np.float32)
+
+
+def export_onnx(weights, imgsz=640):
+    """Exports best.pt to ONNX next to the weights; returns the path of the .onnx file."""
+    from ultralytics import YOLO
+
+    return YOLO(weights).export(format='onnx', imgsz=imgsz)
+
+
+class LabelSink:
+    """
+    Optional sink writing detections in the YOLO label format (one frame_XXXXX.txt per frame).
+
+    Unlike the CLI, a file is written for every frame, even with no detections, so the sorted label files
+    keep lining up with the frame numbers used by main().
+
+    Parameters:
+    - labels_dir (str): Output directory.
+    - save_conf (bool): Append the confidence column (save_conf=True in the CLI).
+    """
+
+    def __init__(self, labels_dir, save_conf=False):
+        os.makedirs(labels_dir, exist_ok=True)
+        self.labels_dir = labels_dir
+        self.save_conf = save_conf
+
+    def write(self, frame_number, detections):
+        lines = []
+        for detection in detections:
+            values = [int(detection[0])] + [float(v) for v in detection[1:5]]
+            if self.save_conf and len(detection) > 5:
+                values.append(float(detection[5]))
+            lines.append(('%g ' * len(values)).rstrip() % tuple(values))
+        with open(os.path.join(self.labels_dir, f"frame_{frame_number:05}.txt"), 'w') as file:
+            file.write(''.join(line + '\n' for line in lines))
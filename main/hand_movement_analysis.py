@@ -1,4 +1,4 @@
-import os
+from detection_store import iter_frame_detections
 
 
 def parse_txt_file(txt_file):
@@ -30,16 +30,13 @@ def analyze_moments(txt_dir):
     Analyzes .txt files in a directory to detect specific moments for both hands.
 
     Parameters:
-    - txt_dir (str): Directory containing .txt files with YOLO detections.
+    - txt_dir (str): Directory containing .txt files with YOLO detections (or a detection store).
     """
-    txt_files = sorted([os.path.join(txt_dir, f) for f in os.listdir(txt_dir) if f.endswith('.txt')])
-
     previous_hand_y_center = [None, None]  # Track Y centers for two hands
     first_moment_frame = None
     last_moment_frame = None
 
-    for i, txt_file in enumerate(txt_files):
-        detections = parse_txt_file(txt_file)
+    for i, detections in enumerate(iter_frame_detections(txt_dir)):
 
         # Track hand detections
         hand_detections = [d for d in detections if d[0] == 0]  # Assuming class_id for hand is 0
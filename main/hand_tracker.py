@@ -0,0 +1,241 @@
+import numpy as np
+
+HAND_CLASSES = (0, 1)
+
+
+class HandTrack:
+    """
+    One tracked hand: alpha-beta filtered (x_center, y_center, width, height) box and its velocity per frame.
+
+    Parameters:
+    - track_id (int): Stable identifier, kept for as long as the hand is tracked.
+    - detection: (class_id, x_center, y_center, width, height) of the detection that started the track.
+    - frame_number (int): Frame of that detection.
+    """
+    __slots__ = ('track_id', 'class_id', 'box', 'velocity', 'frame_number', 'detection_frame', 'hits',
+                 'misses')
+
+    def __init__(self, track_id, detection, frame_number):
+        self.track_id = track_id
+        self.class_id = int(detection[0])
+        self.box = np.array(detection[1:5], dtype=np.float64)
+        self.velocity = np.zeros(4, dtype=np.float64)
+        self.frame_number = frame_number  # Frame the box was predicted to
+        self.detection_frame = frame_number  # Last frame the hand was detected
+        self.hits = 1
+        self.misses = 0  # Keyframes in a row without a matching detection
+
+    def predict(self, frame_number):
+        """Moves the box to frame_number at the current velocity."""
+        self.box += self.velocity * (frame_number - self.frame_number)
+        self.box[2:] = np.maximum(self.box[2:], 1e-3)
+        self.frame_number = frame_number
+
+    def correct(self, detection, frame_number, alpha, beta):
+        """Alpha-beta update with a detection of frame_number (the box must have been predicted to that frame)."""
+        residual = np.asarray(detection[1:5], dtype=np.float64) - self.box
+        elapsed = max(frame_number - self.detection_frame, 1)
+        self.box += alpha * residual
+        self.velocity += beta * residual / elapsed
+        self.class_id = int(detection[0])
+        self.detection_frame = frame_number
+        self.hits += 1
+        self.misses = 0
+
+    def drift(self, frame_number):
+        """Distance (normalised units) the centre has been extrapolated since the last detection."""
+        return float(np.hypot(self.velocity[0], self.velocity[1])) * (frame_number - self.detection_frame)
+
+    def detection(self):
+        return (self.class_id, *(float(v) for v in self.box))
+
+
+class HandTracker:
+    """
+    Alpha-beta tracker of the hands, with stable track IDs.
+
+    update() matches the hand detections of a frame to the tracks (greedy, nearest predicted centre first)
+    and corrects the matched tracks; predict() only extrapolates them, for the frames YOLO is not run on.
+    A track missing from a detection frame stops being reported (the start/end logic relies on the number of
+    hands) but is kept for max_misses detection frames, so a hand detected again near its track keeps its ID.
+
+    Parameters:
+    - alpha (float): Position gain (1 follows the detections exactly).
+    - beta (float): Velocity gain.
+    - max_distance (float): Largest centre distance (normalised units) between a track and its detection.
+    - max_misses (int): Detection frames a track survives without a matching detection.
+    - max_drift (float): Extrapolated centre distance at which the confidence reaches 0.
+    """
+
+    def __init__(self, alpha=0.85, beta=0.3, max_distance=0.15, max_misses=2, max_drift=0.05):
+        self.alpha = alpha
+        self.beta = beta
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.max_drift = max_drift
+        self.tracks = []
+        self.next_track_id = 0
+        self.frame_number = None
+
+    def predict(self, frame_number):
+        """
+        Extrapolates the tracks to frame_number.
+
+        Returns:
+        - List of (class_id, x_center, y_center, width, height) of the reported hands, in track ID order.
+        """
+        for track in self.tracks:
+            track.predict(frame_number)
+        self.frame_number = frame_number
+        return self.detections()
+
+    def update(self, hand_detections, frame_number):
+        """
+        Corrects the tracks with the hand detections of frame_number.
+
+        Parameters:
+        - hand_detections: (class_id, x_center, y_center, width, height[, conf]) rows of the hands.
+        - frame_number (int): Frame of the detections.
+
+        Returns:
+        - List of (class_id, x_center, y_center, width, height) of the reported hands, in track ID order.
+        """
+        for track in self.tracks:
+            track.predict(frame_number)
+        self.frame_number = frame_number
+
+        pairs = sorted(
+            (float(np.hypot(track.box[0] - detection[1], track.box[1] - detection[2])), t, d)
+            for t, track in enumerate(self.tracks) for d, detection in enumerate(hand_detections)
+        )
+        matched_tracks = set()
+        matched_detections = set()
+        for distance, t, d in pairs:
+            if distance > self.max_distance:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            self.tracks[t].correct(hand_detections[d], frame_number, self.alpha, self.beta)
+            matched_tracks.add(t)
+            matched_detections.add(d)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for d, detection in enumerate(hand_detections):
+            if d not in matched_detections:
+                self.tracks.append(HandTrack(self.next_track_id, detection, frame_number))
+                self.next_track_id += 1
+        return self.detections()
+
+    def reported_tracks(self):
+        """Tracks matched on the last detection frame, in track ID order."""
+        return sorted((track for track in self.tracks if track.misses == 0), key=lambda track: track.track_id)
+
+    def detections(self):
+        """Boxes of the reported tracks."""
+        return [track.detection() for track in self.reported_tracks()]
+
+    def track_ids(self):
+        """IDs of the reported tracks, in the order of detections()."""
+        return [track.track_id for track in self.reported_tracks()]
+
+    def confidence(self, frame_number=None):
+        """
+        How much the extrapolated boxes can be trusted: 1 right after a detection, falling linearly to 0 as
+        the fastest hand drifts max_drift away from where it was last detected. 1 when no hand is tracked.
+        """
+        frame_number = self.frame_number if frame_number is None else frame_number
+        drifts = [track.drift(frame_number) for track in self.tracks if track.misses == 0]
+        if not drifts:
+            return 1.0
+        return max(0.0, 1.0 - max(drifts) / self.max_drift)
+
+
+class TrackedHandDetector:
+    """
+    Runs a hand detector only on keyframes and tracks the hands in between.
+
+    The detector runs every detect_every frames, and earlier when the tracker confidence drops below
+    min_confidence (fast hands); the other frames get the tracker's predicted boxes. detect() returns the same
+    (N, 6) rows as YoloHandDetector.detect on every frame, so it is a drop-in replacement for it. Keyframes
+    return the detector's own rows (the tracker is only corrected with them, its smoothed boxes lag behind);
+    between keyframes the non-hand detections are repeated from the last keyframe and the confidence column
+    of the predicted hands is the tracker confidence.
+
+    Parameters:
+    - detector: Object with detect(frame) -> (N, 6) rows (e.g. YoloHandDetector).
+    - detect_every (int): Frames between keyframes (1 runs the detector on every frame and returns exactly its rows).
+    - min_confidence (float): Tracker confidence below which the detector runs before the next keyframe.
+    - tracker (HandTracker): Defaults to HandTracker().
+    """
+
+    def __init__(self, detector, detect_every=5, min_confidence=0.5, tracker=None):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.tracker = tracker if tracker is not None else HandTracker()
+        self.other_detections = np.zeros((0, 6), dtype=np.float32)
+        self.last_keyframe = None
+        self.frame_number = -1
+        self.frames = 0
+        self.detector_calls = 0
+
+    @property
+    def detection_rate(self):
+        """Fraction of the frames the detector ran on."""
+        return self.detector_calls / self.frames if self.frames else 0.0
+
+    def is_keyframe(self, frame_number):
+        if self.last_keyframe is None or frame_number - self.last_keyframe >= self.detect_every:
+            return True
+        return self.tracker.confidence(frame_number) < self.min_confidence
+
+    def detect(self, frame, frame_number=None):
+        """
+        Hand boxes of one frame, detected on keyframes and predicted otherwise.
+
+        Parameters:
+        - frame: Frame, RGB array, PIL image or image path (only decoded on keyframes).
+        - frame_number (int): Defaults to the frame's frame_number, or the previous frame number + 1.
+
+        Returns:
+        - ndarray: (N, 6) float32 rows of (class_id, x_center, y_center, width, height, conf).
+        """
+        if frame_number is None:
+            frame_number = getattr(frame, 'frame_number', None)
+            if frame_number is None:
+                frame_number = self.frame_number + 1
+        self.frame_number = frame_number
+        self.frames += 1
+
+        if self.is_keyframe(frame_number):
+            detections = self.detector.detect(frame)
+            self.detector_calls += 1
+            self.last_keyframe = frame_number
+            is_hand = np.isin(detections[:, 0].astype(int), HAND_CLASSES)
+            self.other_detections = detections[~is_hand]
+            self.tracker.update(detections[is_hand].tolist(), frame_number)
+            return detections
+
+        hands = self.tracker.predict(frame_number)
+        confidences = [self.tracker.confidence(frame_number)] * len(hands)
+        rows = [(*hand, conf) for hand, conf in zip(hands, confidences)]
+        hand_rows = np.array(rows, dtype=np.float32).reshape(-1, 6)
+        return np.concatenate([hand_rows, self.other_detections.astype(np.float32)])
+
+    def to_dict(self):
+        return {
+            'detect_every': self.detect_every,
+            'frames': self.frames,
+            'detector_calls': self.detector_calls,
+            'detection_rate': self.detection_rate,
+        }
+
+
+# Example usage
+#detector = TrackedHandDetector(YoloHandDetector('/Users/nunofernandes/PycharmProjects/challenge_vc/best.onnx'), detect_every=5)
+#for frame in FrameSource('/Users/nunofernandes/PycharmProjects/challenge_vc/frames_5_xyz_w'):
+#    detections = detector.detect(frame)
+#print(detector.detection_rate, detector.tracker.track_ids())
@@ -0,0 +1,242 @@
+"""
+Offline start/end analysis of a whole recording from its hand tracks.
+
+The streaming path (PokaYokeStream.push -> detect_initial_movement_non_dominant and
+analyze_and_update_hand_movement) handles one frame at a time and, for start detection, loops in Python over
+the whole non-dominant hand history on every idle frame. For archived shifts every track is known up front,
+so here the detections are loaded once into arrays: hand counts, dominant/non-dominant positions and the
+dominant hand estimate are computed with NumPy over the whole video, and the history scan of start
+detection is one vectorised test. Only the small state machine that links the events (start, end, buffer,
+last valid frame) still runs frame by frame, over plain Python floats.
+
+The start and end events, durations and crop list are identical to the streaming path.
+"""
+from collections import namedtuple
+import numpy as np
+
+from detection_store import open_detection_store
+from main_helper import START_DISPLACEMENT, PICK_UP_CONTRACTION, PICK_UP_MOVEMENT, initialize_state
+from poka_yoke_stream import PhaseEvent, CropJob
+
+# Per-frame arrays of a recording; positions are NaN on frames without exactly two (or one) hands
+HandTracks = namedtuple('HandTracks', [
+    'n_frames',
+    'hand_counts',  # Number of hand detections (class 0 or 1) per frame
+    'x_non_dominant', 'y_non_dominant', 'height_non_dominant',  # Two-hand frames
+    'x_dominant', 'y_dominant',  # Two-hand frames
+    'y_single',  # Single-hand frames: y center of the only hand
+    'dominant_hand_position',
+])
+
+
+def _first_rows(frame_idx, n_frames):
+    """Index of the first row of every frame in frame-sorted rows."""
+    return np.searchsorted(frame_idx, np.arange(n_frames))
+
+
+def estimate_dominant_hand(detection_store):
+    """
+    Vectorised DominantHandEstimator.from_directory(detection_store).position()[0] (same answer).
+    """
+    rows = detection_store.detections
+    n_frames = len(detection_store)
+    present = np.zeros((2, n_frames + 1), dtype=bool)  # present[:, f + 1]: hand id seen in frame f
+    hand_rows = rows[(rows['class_id'] == 0) | (rows['class_id'] == 1)]
+    present[hand_rows['class_id'], hand_rows['frame_idx'] + 1] = True
+
+    # A hand disappears on a frame where it is missing after being seen in the previous frame
+    disappearances = np.cumsum(present[:, :-1] & ~present[:, 1:], axis=1)
+    both = present[0, 1:] & present[1, 1:]
+
+    # x center of the first detection of each hand id in the frames where both are seen
+    hand_x = []
+    for hand_id in range(2):
+        id_rows = hand_rows[hand_rows['class_id'] == hand_id]
+        first = np.searchsorted(id_rows['frame_idx'], np.flatnonzero(both))
+        hand_x.append(id_rows['xc'][first])
+    # Hand 0 is the non-dominant one while it has disappeared at least as often (index of the first max)
+    non_dominant_is_0 = disappearances[0, both] >= disappearances[1, both]
+    non_dominant_left = np.where(non_dominant_is_0, hand_x[0] < hand_x[1], hand_x[1] < hand_x[0])
+    left_count = int(np.count_nonzero(non_dominant_left))
+    right_count = len(non_dominant_left) - left_count
+    return "left" if left_count > right_count else "right"
+
+
+def load_hand_tracks(txt_dir, dominant_hand_position=None, n_frames=None, frame_stride=1):
+    """
+    Loads the hand tracks of a recording into arrays.
+
+    Parameters:
+    - txt_dir (str): YOLO labels directory, .dets store or DetectionStore.
+    - dominant_hand_position (str): 'left' or 'right'; estimated from the whole recording if None.
+    - n_frames (int): Number of frames to use (defaults to every frame of the store).
+    - frame_stride (int): Keep the labels of one recording frame out of every frame_stride (frame k of the tracks
+      is recording frame k * frame_stride, like analyze_recording with frame_stride).
+
+    Returns:
+    - HandTracks
+    """
+    detection_store = open_detection_store(txt_dir)
+    if dominant_hand_position is None:
+        dominant_hand_position = estimate_dominant_hand(detection_store)
+    if n_frames is None:
+        n_frames = -(-len(detection_store) // frame_stride)
+
+    rows = detection_store.detections
+    hand_rows = rows[((rows['class_id'] == 0) | (rows['class_id'] == 1)) & (rows['frame_idx'] % frame_stride == 0) &
+                     (rows['frame_idx'] // frame_stride < n_frames)]
+    frame_idx = hand_rows['frame_idx'] // frame_stride
+    hand_counts = np.bincount(frame_idx, minlength=n_frames)[:n_frames]
+
+    two_hands = np.flatnonzero(hand_counts == 2)
+    first = _first_rows(frame_idx, n_frames)[two_hands]
+    hand_0 = hand_rows[first]
+    hand_1 = hand_rows[first + 1]
+    # determine_hand: the dominant hand is the one further right (on a tie, hand 0 for "right", hand 1 for "left")
+    if dominant_hand_position == "right":
+        dominant_is_1 = hand_1['xc'] > hand_0['xc']
+    else:
+        dominant_is_1 = ~(hand_0['xc'] > hand_1['xc'])
+    dominant = np.where(dominant_is_1, hand_1, hand_0)
+    non_dominant = np.where(dominant_is_1, hand_0, hand_1)
+
+    single_hand = np.flatnonzero(hand_counts == 1)
+    single = hand_rows[_first_rows(frame_idx, n_frames)[single_hand]]
+
+    def per_frame(frames, values):
+        array = np.full(n_frames, np.nan)
+        array[frames] = values
+        return array
+
+    return HandTracks(
+        n_frames=n_frames,
+        hand_counts=hand_counts,
+        x_non_dominant=per_frame(two_hands, non_dominant['xc']),
+        y_non_dominant=per_frame(two_hands, non_dominant['yc']),
+        height_non_dominant=per_frame(two_hands, non_dominant['h']),
+        x_dominant=per_frame(two_hands, dominant['xc']),
+        y_dominant=per_frame(two_hands, dominant['yc']),
+        y_single=per_frame(single_hand, single['yc']),
+        dominant_hand_position=dominant_hand_position,
+    )
+
+
+# Result of detect_start_end; start_frames is non_dominant_hand_detections, last_reset_frame the last idle
+# two-hand frame (where the poke/pen counters are reset)
+StartEndAnalysis = namedtuple('StartEndAnalysis', [
+    'events', 'start_frames', 'end_frames', 'durations', 'crop_jobs', 'last_reset_frame', 'state',
+])
+
+
+def detect_start_end(tracks, state=None):
+    """
+    Start and end detection over a whole recording, with the same result as pushing every frame through
+    PokaYokeStream.
+
+    Parameters:
+    - tracks (HandTracks): From load_hand_tracks.
+    - state (PipelineState): State from initialize_state to fill in (phases start/end, metrics, start and end
+      sub-states and hand histories). A new one is made if None.
+
+    Returns:
+    - StartEndAnalysis
+    """
+    if state is None:
+        state = initialize_state()
+    phases = state.phases
+    metrics = state.metrics
+    start_frames = state.start.start_frames
+    end_frames = state.end.end_frames
+    durations = state.end.durations
+    last_valid_frame = state.end.last_valid_frame
+    buffer = state.end.buffer
+
+    # Non-dominant hand history, as appended by push and detect_initial_movement_non_dominant
+    capacity = 2 * tracks.n_frames + 2
+    history_x = np.empty(capacity)
+    history_y = np.empty(capacity)
+    history_height = np.empty(capacity)
+    size = 0
+
+    events = []
+    crop_jobs = []
+    last_reset_frame = None
+    previous_frame_number = None
+    x_non_dominant = tracks.x_non_dominant.tolist()
+    y_non_dominant = tracks.y_non_dominant.tolist()
+    height_non_dominant = tracks.height_non_dominant.tolist()
+    x_dominant = tracks.x_dominant.tolist()
+    y_dominant = tracks.y_dominant.tolist()
+    y_single = tracks.y_single.tolist()
+    hand_counts = tracks.hand_counts
+
+    for frame_number in np.flatnonzero((hand_counts == 1) | (hand_counts == 2)).tolist():
+        if hand_counts[frame_number] == 2:
+            x = x_non_dominant[frame_number]
+            y = y_non_dominant[frame_number]
+            height = height_non_dominant[frame_number]
+
+            if phases['start'] <= phases['end']:
+                last_reset_frame = frame_number
+                if size >= 2:
+                    # Cheap scalar conditions first; the history is scanned only when they hold
+                    # Contraction (height decrease) and a small pick up movement
+                    if history_height[size - 1] - height > PICK_UP_CONTRACTION and \
+                            (abs(x - history_x[size - 2]) > PICK_UP_MOVEMENT or
+                             abs(history_y[size - 2] - y) > PICK_UP_MOVEMENT):
+                        previous_x = history_x[:size - 1]
+                        previous_y = history_y[:size - 1]
+                        distance = np.sqrt((x - previous_x) ** 2 + (previous_y - y) ** 2)
+                        # Any earlier position far enough and lower than the current one (initial large movement)
+                        if np.any((distance > START_DISPLACEMENT) & (y < previous_y)):
+                            start_frames.append(frame_number)
+                            phases['start'] += 1
+                            metrics['duration'][0] = 0  # reset trial duration
+                            events.append(PhaseEvent(frame_number, 'start', phases['start']))
+                            size = 0
+                    if size == 0 or history_x[size - 1] != x or history_y[size - 1] != y:
+                        history_x[size], history_y[size], history_height[size] = x, y, height
+                        size += 1
+            else:
+                metrics['duration'][0] += 1  # Update duration of the trial
+                if y > 0.7:
+                    crop_jobs.append(CropJob(frame_number, previous_frame_number, x_dominant[frame_number],
+                                             y_dominant[frame_number]))
+
+            history_x[size], history_y[size], history_height[size] = x, y, height
+            size += 1
+            previous_frame_number = frame_number
+        else:
+            # analyze_and_update_hand_movement
+            positive = size < 2 or y_single[frame_number] - history_y[size - 2] < 0
+            if positive and abs(frame_number - last_valid_frame) > 4:
+                buffer = 1
+            if buffer == 1 and phases['end'] < phases['start']:
+                phases['end'] += 1
+                end_frames.append(frame_number + 1)
+                last_valid_frame = frame_number + 1
+                buffer = 0
+                duration = last_valid_frame - start_frames[-1]
+                durations.append(duration)
+                metrics['duration_stats'].update(duration)
+                metrics['duration'][0] = duration
+                metrics['duration'][1] = metrics['duration_stats'].total / metrics['duration_stats'].count
+                metrics['total'][0] += 1
+                events.append(PhaseEvent(frame_number, 'end', phases['end']))
+
+    state.end.last_valid_frame = last_valid_frame
+    state.end.buffer = buffer
+    state.start.x_centers[:] = history_x[:size].tolist()
+    state.start.y_centers[:] = history_y[:size].tolist()
+    state.start.heights[:] = history_height[:size].tolist()
+    return StartEndAnalysis(events, start_frames, end_frames, durations, crop_jobs, last_reset_frame, state)
+
+
+def analyze_hand_tracks(txt_dir, n_frames=None, dominant_hand_position=None):
+    """Loads the hand tracks of a recording and runs detect_start_end on them."""
+    return detect_start_end(load_hand_tracks(txt_dir, dominant_hand_position, n_frames))
+
+
+# Example usage
+#analysis = analyze_hand_tracks('/Users/nunofernandes/PycharmProjects/challenge_vc/runs/detect/predict4/labels')
+#print(analysis.start_frames, analysis.end_frames, analysis.durations)
@@ -1,4 +1,3 @@
-import numpy as np
 def parse_txt_file(txt_file):
     """
     Parses a YOLO detection .txt file to extract bounding box coordinates.
@@ -83,6 +82,29 @@ def determine_hand(hand_detections, dominant_hand_position, return_dominant=True
 
     return dominant_hand if return_dominant else non_dominant_hand
 
+# Start detection thresholds (detect_initial_movement_non_dominant)
+START_DISPLACEMENT = 0.2  # Distance from an earlier non-dominant hand position (initial large movement)
+PICK_UP_CONTRACTION = 0.02  # Height decrease of the non-dominant hand box
+PICK_UP_MOVEMENT = 0.03  # x or y movement since the previous position (small pick up movement)
+
+
+def start_history_window(displacement=START_DISPLACEMENT, step=PICK_UP_MOVEMENT, slack=4):
+    """
+    Suggested number of non-dominant hand positions for a bounded start detection history (live streams).
+
+    A reach of `displacement` made of pick-up sized steps takes ceil(displacement / step) frames; slack allows
+    reaches that many times slower, and an idle frame can add two positions to the history. This is a
+    heuristic, not a bound: detect_initial_movement_non_dominant compares the current position with every
+    position since the last start, and an older position can still trigger one, so a bounded history can miss
+    or move starts (and the ends that follow) compared with main().
+    """
+    return 2 * slack * math.ceil(displacement / step)
+
+
+# History length of live streams (PokaYokeStream default), bounded memory (56 positions with the thresholds above)
+HISTORY_WINDOW = start_history_window()
+
+
 def detect_initial_movement_non_dominant(current_x_center_non_dominant, current_y_center_non_dominant, x_centers_non_dominant, y_centers_non_dominant, heights_non_dominant, current_height_non_dominant, non_dominant_hand_detections, frame_number, phases,metrics):
     """
     Detects initial movement for the non-dominant hand based on distance moved and height changes.
@@ -97,14 +119,14 @@ def detect_initial_movement_non_dominant(current_x_center_non_dominant, current_
         y_distance_moved = y_centers_non_dominant[i] - current_y_center_non_dominant
         distance = math.sqrt(x_distance_moved ** 2 + y_distance_moved ** 2)
         #detects an initial large movement
-        if distance > 0.2 and current_y_center_non_dominant < y_centers_non_dominant[i]:
+        if distance > START_DISPLACEMENT and current_y_center_non_dominant < y_centers_non_dominant[i]:
             height_decrease = heights_non_dominant[-1] - current_height_non_dominant
             #wait for and contraction
-            if height_decrease > 0.02:
+            if height_decrease > PICK_UP_CONTRACTION:
                 x_movement = current_x_center_non_dominant - x_centers_non_dominant[-2]
                 y_movement = y_centers_non_dominant[-2] - current_y_center_non_dominant
                 #and a small pick up movement
-                if abs(x_movement) > 0.03 or abs(y_movement) > 0.03:
+                if abs(x_movement) > PICK_UP_MOVEMENT or abs(y_movement) > PICK_UP_MOVEMENT:
                     non_dominant_hand_detections.append(frame_number)
                     #update counter
                     if phases['start'] <= phases['end']:
@@ -147,9 +169,11 @@ def update_buffer_frame(frame_number, buffer, phases, end_frames, last_valid_fra
             duration = last_valid_frame - non_dominant_hand_detections[
                 -1]  # calculate interval in frames and convert to ms
             durations.append(duration)  # update durations
+            metrics['duration_stats'].update(duration)  # O(1) running stats instead of np.mean over all durations
             # metrics
             metrics['duration'][0] = duration  # reset duration
-            metrics['duration'][1] = np.mean(durations)  # mean durations
+            # exact sum / count of the frame counts: same value np.mean(durations) gave
+            metrics['duration'][1] = metrics['duration_stats'].total / metrics['duration_stats'].count  # mean durations
             metrics['total'][0] += 1  # update metrics
 
     return buffer, last_valid_frame
@@ -201,27 +225,27 @@ def analyze_and_update_hand_movement(hand_detection, y_centers_non_dominant, fra
 
 from PIL import Image
 import os
+from collections import namedtuple
+from pipeline_state import PipelineState
+from poke_pen_backend import load_poke_pen_model
+from frames import Frame
 
 
-def crop_hand_region(image_path, detections, width_reduction=0.8, height_reduction=0.6, move_factor=1):
+def hand_crop_box(width, height, detections, width_reduction=0.8, height_reduction=0.6, move_factor=1):
     """
-    Crops the region around both hands based on YOLO detections and saves the cropped image with reduced bounding box size.
-    Moves the bounding box inward to be more distant from the body.
+    Computes the crop rectangle around both hands used by crop_hand_region.
 
     Parameters:
-    - image_path (str): Path to the original image.
+    - width (int): Image width in pixels.
+    - height (int): Image height in pixels.
     - detections (list): List of tuples containing YOLO detections.
-    - output_dir (str): Directory to save the cropped image.
     - width_reduction (float): Fraction of the bounding box width to reduce.
     - height_reduction (float): Fraction of the bounding box height to reduce.
     - move_factor (float): Fraction to adjust the bounding box position to move it away from the body.
-    """
-    image = Image.open(image_path)
-    width, height = image.size
-
-    # if not os.path.exists(output_dir):
-    #    os.makedirs(output_dir)
 
+    Returns:
+    - Tuple: (min_x, min_y, max_x, max_y) in pixels, clipped to the image.
+    """
     # Initialize variables for the combined bounding box
     min_x = width
     min_y = height
@@ -283,112 +307,109 @@ def crop_hand_region(image_path, detections, width_reduction=0.8, height_reducti
     max_x = min(max_x, width)
     max_y = min(max_y, height)
 
-    cropped_image = image.crop((min_x, min_y, max_x, max_y))
+    return min_x, min_y, max_x, max_y
+
+
+def crop_hand_region(image_path, detections, width_reduction=0.8, height_reduction=0.6, move_factor=1):
+    """
+    Crops the region around both hands based on YOLO detections and saves the cropped image with reduced bounding box size.
+    Moves the bounding box inward to be more distant from the body.
+
+    Parameters:
+    - image_path (str or Frame): Path to the original image, or an already decoded Frame. For a Frame the
+      crop is a zero-copy NumPy view instead of a PIL image.
+    - detections (list): List of tuples containing YOLO detections.
+    - width_reduction (float): Fraction of the bounding box width to reduce.
+    - height_reduction (float): Fraction of the bounding box height to reduce.
+    - move_factor (float): Fraction to adjust the bounding box position to move it away from the body.
+    """
+    if isinstance(image_path, Frame):
+        box = hand_crop_box(image_path.width, image_path.height, detections, width_reduction, height_reduction,
+                            move_factor)
+        return image_path.crop(box)
+
+    image = Image.open(image_path)
+    width, height = image.size
+
+    # if not os.path.exists(output_dir):
+    #    os.makedirs(output_dir)
+
+    box = hand_crop_box(width, height, detections, width_reduction, height_reduction, move_factor)
+    cropped_image = image.crop(box)
 
     return cropped_image
 
 
-def initialize_variables(txt_dir, model_path, input_folder, output_path):
+def initialize_state(prediction_window_size=32, history_size=None, operation_history_size=None):
+    """
+    Initializes the per-recording analysis state (counters, trailing buffers and phase variables).
+
+    Parameters:
+    - prediction_window_size (int): Number of recent VGG-19 predictions kept for the phase detectors.
+    - history_size (int or None): If set, the hand position histories keep only the last history_size values
+      (constant memory for live streams, see HISTORY_WINDOW; starts can differ from main()); None keeps every
+      position since the last start.
+    - operation_history_size (int or None): If set, the start/end frames and durations keep only the last
+      operation_history_size operations.
+
+    Returns:
+    - PipelineState
+    """
+    return PipelineState(prediction_window_size, history_size, operation_history_size)
+
+
+def detect_start(state, current_x_center_non_dominant, current_y_center_non_dominant, current_height_non_dominant,
+                 frame_number):
+    """
+    detect_initial_movement_non_dominant on a PipelineState (idle frame with both hands).
+
+    Returns:
+    - bool: True if an operation started on this frame.
+    """
+    start_count = state.phases['start']
+    detect_initial_movement_non_dominant(
+        current_x_center_non_dominant, current_y_center_non_dominant,
+        state.start.x_centers, state.start.y_centers, state.start.heights, current_height_non_dominant,
+        state.start.start_frames, frame_number, state.phases, state.metrics
+    )
+    return state.phases['start'] > start_count
+
+
+def update_end(state, hand_detection, frame_number):
+    """
+    analyze_and_update_hand_movement on a PipelineState (frame with a single hand).
+
+    Returns:
+    - bool: True if an operation ended on this frame.
+    """
+    end_count = state.phases['end']
+    end = state.end
+    end.buffer, end.last_valid_frame = analyze_and_update_hand_movement(
+        hand_detection, state.start.y_centers, frame_number, end.last_valid_frame, end.buffer, state.phases,
+        end.end_frames, state.metrics, end.durations, state.start.start_frames
+    )
+    return state.phases['end'] > end_count
+
+
+# Inputs of a recording analysed with the main() loop
+RecordingSetup = namedtuple('RecordingSetup', ['txt_files', 'model_poke_pen', 'input_folder', 'output_path', 'state'])
+
+
+def initialize_variables(txt_dir, model_path, input_folder, output_path, prediction_window_size=32):
     """
     Initializes and returns all necessary variables.
+
+    Parameters:
+    - prediction_window_size (int): Number of recent VGG-19 predictions kept for the phase detectors.
+
+    Returns:
+    - RecordingSetup: label files, loaded model, input/output paths and a fresh PipelineState.
     """
     # Load and sort .txt files
     txt_files = sorted([os.path.join(txt_dir, f) for f in os.listdir(txt_dir) if f.endswith('.txt')])
 
-    # Initialize variables
-    last_valid_pen_length = None
-    first_pen_x = None
-    first_pen_y = None
-
-    first_poke_x = None
-    first_poke_y = None
-    line_lengths = []
-    thetas = []
-
-    non_dominant_hand_detections = []
-    end_frames = []
-    durations = []
-    poke = []
-    pen = []
-    frame_numbers = []
-
-    x_centers_non_dominant = []
-    y_centers_non_dominant = []
-    heights_non_dominant = []
-
-    x_centers_dominant = []
-    y_centers_dominant = []
-
-    pokes = []
-
-    previous_image = None
-
-    phases = {
-        'start': 0,
-        'poke': 0,
-        'pen': 0,
-        'end': 0
-    }
-
-    metrics = {
-        'duration': [0, 0],  # actual, mean
-        'poke': 0,  # 1/2 or 2/2
-        'pen': 0,  # 1/2 or 2/2
-        'total': [0, 0]  # n, correct for presenting %
-    }
-
-    last_valid_frame = -5  # Initialize to ensure the first valid frame is always added
-    buffer = 0
-
-    # Initialize line lengths and angles (thetas)
-    line_lengths = [0, 0, 0]
-    line_lengths_pen = [0, 0, 0]
-    thetas = [0, 0, 0]
-
-    first_poke_x = 0
-    first_poke_y = 0
-
-    # Load the model
-    model_poke_pen = load_model(model_path)
-
-    # Initialize other paths and variables
-    max_line = None
-    predictions = []
-    store_metrics = {'frame_numbers': [], 'phases': []}
-
-    non_dominant_hand_detections = []
-
-    return {
-        'txt_files': txt_files,
-        'last_valid_pen_length': last_valid_pen_length,
-        'first_pen_x': first_pen_x,
-        'first_pen_y': first_pen_y,
-        'first_poke_x': first_poke_x,
-        'first_poke_y': first_poke_y,
-        'line_lengths': line_lengths,
-        'line_lengths_pen': line_lengths_pen,
-        'thetas': thetas,
-        'end_frames': end_frames,
-        'durations': durations,
-        'poke': poke,
-        'pen': pen,
-        'frame_numbers': frame_numbers,
-        'x_centers_non_dominant': x_centers_non_dominant,
-        'y_centers_non_dominant': y_centers_non_dominant,
-        'heights_non_dominant': heights_non_dominant,
-        'x_centers_dominant': x_centers_dominant,
-        'y_centers_dominant': y_centers_dominant,
-        'pokes': pokes,
-        'previous_image': previous_image,
-        'phases': phases,
-        'metrics': metrics,
-        'last_valid_frame': last_valid_frame,
-        'buffer': buffer,
-        'model_poke_pen': model_poke_pen,
-        'input_folder': input_folder,
-        'output_path': output_path,
-        'max_line': max_line,
-        'predictions': predictions,
-        'store_metrics': store_metrics,
-        'non_dominant_hand_detections': non_dominant_hand_detections,
-    }
+    # Load the model (.hdf5 with Keras, .onnx/.xml with the lightweight CPU backends)
+    model_poke_pen = load_poke_pen_model(model_path)
+
+    return RecordingSetup(txt_files, model_poke_pen, input_folder, output_path,
+                          initialize_state(prediction_window_size))
@@ -1,4 +1,4 @@
-import os
+from detection_store import iter_frame_detections
 
 def parse_txt_file(txt_file):
     """
@@ -23,29 +23,43 @@ def parse_txt_file(txt_file):
                 detections.append((class_id, x_center, y_center, width, height))
     return detections
 
-def analyze_disappearance_and_position(txt_dir):
+class DominantHandEstimator:
     """
-    Analyzes .txt files in a directory to determine:
-    - Which hand (left or right) disappears more frequently.
-    - If the non-dominant hand is more often to the left or right of the dominant hand.
+    Streaming version of analyze_disappearance_and_position.
 
-    Parameters:
-    - txt_dir (str): Directory containing .txt files with YOLO detections.
+    Updates the disappearance and left/right counts one frame at a time, so the
+    dominant hand can be queried at any frame without re-reading the label directory.
 
-    Returns:
-    - Tuple: (dominant_hand_position, non_dominant_hand_position)
+    Parameters:
+    - warmup_frames (int or None): If set, the answer is frozen after this many frames
+      and later updates are ignored (stable answer for live runs).
     """
-    txt_files = sorted([os.path.join(txt_dir, f) for f in os.listdir(txt_dir) if f.endswith('.txt')])
 
-    disappearance_counts = [0, 0]  # Count of disappearances for hand 0 and hand 1
-    non_dominant_left_count = 0  # Non-dominant hand to the left of dominant hand
-    non_dominant_right_count = 0  # Non-dominant hand to the right of dominant hand
+    def __init__(self, warmup_frames=None):
+        self.warmup_frames = warmup_frames
+        self.frames_seen = 0
+        self.disappearance_counts = [0, 0]  # Count of disappearances for hand 0 and hand 1
+        self.non_dominant_left_count = 0  # Non-dominant hand to the left of dominant hand
+        self.non_dominant_right_count = 0  # Non-dominant hand to the right of dominant hand
+        self.previous_hand_detections = [False, False]  # Track previous hand detections
+        self.frozen_position = None
 
-    # Track previous hand detections
-    previous_hand_detections = [False, False]
+    @property
+    def frozen(self):
+        return self.frozen_position is not None
 
-    for txt_file in txt_files:
-        detections = parse_txt_file(txt_file)
+    def update(self, detections):
+        """
+        Updates the counts with the detections of one frame.
+
+        Parameters:
+        - detections (list): List of (class_id, x_center, y_center, width, height, ...) tuples.
+
+        Returns:
+        - Tuple: (dominant_hand_position, non_dominant_hand_position) after this frame.
+        """
+        if self.frozen:
+            return self.frozen_position
 
         # Track hand detections
         hand_detections = [d for d in detections if d[0] == 0 or d[0] == 1]  # Assuming class_id 0 and 1 for hands
@@ -53,46 +67,85 @@ def analyze_disappearance_and_position(txt_dir):
 
         # Check if any hand disappeared
         for hand_id in range(2):
-            if hand_id not in hand_ids_detected and previous_hand_detections[hand_id]:
+            if hand_id not in hand_ids_detected and self.previous_hand_detections[hand_id]:
                 # Hand disappeared
-                disappearance_counts[hand_id] += 1
-                previous_hand_detections[hand_id] = False
+                self.disappearance_counts[hand_id] += 1
+                self.previous_hand_detections[hand_id] = False
             elif hand_id in hand_ids_detected:
                 # Hand is detected
-                previous_hand_detections[hand_id] = True
+                self.previous_hand_detections[hand_id] = True
 
         # If both hands are detected, compare their X positions
         if len(hand_ids_detected) == 2:
-            try:
-                hand_0_x = next(d[1] for d in hand_detections if d[0] == 0)
-                hand_1_x = next(d[1] for d in hand_detections if d[0] == 1)
-            except StopIteration:
-                continue  # Skip to the next frame if one hand is missing
+            hand_0_x = next(d[1] for d in hand_detections if d[0] == 0)
+            hand_1_x = next(d[1] for d in hand_detections if d[0] == 1)
 
             # Determine which hand is non-dominant and which is dominant
-            non_dominant_hand = disappearance_counts.index(max(disappearance_counts))
-            dominant_hand = 1 - non_dominant_hand
+            non_dominant_hand = self.disappearance_counts.index(max(self.disappearance_counts))
 
             # Check if the non-dominant hand is to the left or right of the dominant hand
             if non_dominant_hand == 0:
-                if hand_0_x < hand_1_x:
-                    non_dominant_left_count += 1
-                else:
-                    non_dominant_right_count += 1
+                non_dominant_left = hand_0_x < hand_1_x
             else:
-                if hand_1_x < hand_0_x:
-                    non_dominant_left_count += 1
-                else:
-                    non_dominant_right_count += 1
+                non_dominant_left = hand_1_x < hand_0_x
+            if non_dominant_left:
+                self.non_dominant_left_count += 1
+            else:
+                self.non_dominant_right_count += 1
+
+        self.frames_seen += 1
+        if self.warmup_frames is not None and self.frames_seen >= self.warmup_frames:
+            self.frozen_position = self.position()
+
+        return self.position()
+
+    def position(self):
+        """
+        Returns:
+        - Tuple: (dominant_hand_position, non_dominant_hand_position) for the frames seen so far.
+        """
+        if self.frozen:
+            return self.frozen_position
+
+        # Determine the dominant hand's position
+        dominant_hand_position = "left" if self.non_dominant_left_count > self.non_dominant_right_count else "right"
+        non_dominant_hand_position = "left" if dominant_hand_position == "right" else "right"
+        return dominant_hand_position, non_dominant_hand_position
 
-    # Determine the dominant hand's position
-    dominant_hand_position = "left" if non_dominant_left_count > non_dominant_right_count else "right"
-    non_dominant_hand_position = "left" if dominant_hand_position == "right" else "right"
+    def freeze(self):
+        """Freezes the current answer; later updates are ignored."""
+        self.frozen_position = self.position()
+        return self.frozen_position
 
-    #print(f"Dominant hand: {dominant_hand_position}")
-    #print(f"Non-dominant hand: {non_dominant_hand_position}")
+    @classmethod
+    def from_directory(cls, txt_dir):
+        """
+        Builds an estimator from a whole run in a single pass.
 
-    return dominant_hand_position, non_dominant_hand_position
+        txt_dir can be a directory of YOLO .txt files, a .dets detection store or a DetectionStore.
+        """
+        estimator = cls()
+        for detections in iter_frame_detections(txt_dir):
+            estimator.update(detections)
+        return estimator
+
+
+def analyze_disappearance_and_position(txt_dir):
+    """
+    Analyzes .txt files in a directory to determine:
+    - Which hand (left or right) disappears more frequently.
+    - If the non-dominant hand is more often to the left or right of the dominant hand.
+
+    The directory is read once; call this once per run (or use DominantHandEstimator
+    for frame-by-frame updates) instead of once per frame.
+
+    Parameters:
+    - txt_dir (str): Directory containing .txt files with YOLO detections (or a detection store).
+
+    Returns:
+    - Tuple: (dominant_hand_position, non_dominant_hand_position)
+    """
+    return DominantHandEstimator.from_directory(txt_dir).position()
 
 # Example usage:
 #txt_dir = '/Users/nunofernandes/PycharmProjects/challenge_vc/runs/detect/predict4/labels/'
@@ -1,17 +1,24 @@
+from frame_differencing import FrameDiff
+from main_helper import distance_moved
+from prediction_window import settled_predictions, PEN_COLUMN, PEN_THRESHOLD
+
+
 def detect_pen_phase(predictions, previous_image, image_cropped, current_x_center_dominant, current_y_center_dominant,
-                     phases, last_valid_pen_length, first_pen_x, first_pen_y, line_lengths_pen):
+                     phases, last_valid_pen_length, first_pen_x, first_pen_y, line_lengths_pen, frame_diff=None):
     # Ensure line_lengths and thetas are initialized as lists
     if line_lengths_pen is None:
         line_lengths_pen = []
 
     line_length_pen = None
+    # The images are the same for every prediction: the frame difference and lines are computed at most once
+    # per frame pair, and shared with the other detector when frame_diff is passed in
+    if frame_diff is None:
+        frame_diff = FrameDiff(previous_image, image_cropped)
 
-    for pred in predictions[:-3]:  # Analyzing the last few predictions
-        if pred[2] > 0.8:  # Pen detection condition
+    for pred in settled_predictions(predictions):  # Analyzing the last few predictions
+        if pred[PEN_COLUMN] > PEN_THRESHOLD:  # Pen detection condition
             # Detect pen lines
-            line_length_pen, theta_pen = detect_poke_pen_lines(
-                image_before=previous_image,
-                image_after=image_cropped,
+            line_length_pen, theta_pen = frame_diff.detect(
                 type="pen",
                 min_length_threshold=31.3209195267316 - 1,
                 max_length_threshold=31.33 + 1
@@ -42,4 +49,21 @@ def detect_pen_phase(predictions, previous_image, image_cropped, current_x_cente
         if len(line_lengths_pen) > 3:
             line_lengths_pen.pop(0)
 
-    return phases, line_lengths_pen, last_valid_pen_length, first_pen_x, first_pen_y
\ No newline at end of file
+    return phases, line_lengths_pen, last_valid_pen_length, first_pen_x, first_pen_y
+
+
+def update_pen_state(state, frame_diff, current_x_center_dominant, current_y_center_dominant):
+    """
+    detect_pen_phase on a PipelineState: reads state.predictions and updates state.phases and state.pen.
+
+    Returns:
+    - bool: True if the pen counter increased.
+    """
+    pen = state.pen
+    pen_count = state.phases['pen']
+    _, pen.line_lengths, pen.last_valid_length, pen.first_x, pen.first_y = detect_pen_phase(
+        state.predictions, frame_diff.image_before, frame_diff.image_after,
+        current_x_center_dominant, current_y_center_dominant,
+        state.phases, pen.last_valid_length, pen.first_x, pen.first_y, pen.line_lengths, frame_diff=frame_diff
+    )
+    return state.phases['pen'] > pen_count
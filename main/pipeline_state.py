@@ -0,0 +1,129 @@
+import pickle
+
+import numpy as np
+
+from prediction_window import PredictionWindow
+from running_stats import RunningStats
+from track_buffer import TrackBuffer
+
+
+def _history(history_size, dtype=np.float64):
+    """Hand track history: a plain list, or a TrackBuffer keeping the last history_size values."""
+    return [] if history_size is None else TrackBuffer(history_size, dtype)
+
+
+class StartState:
+    """
+    Start detection state: non-dominant hand history and the frames where operations started.
+
+    Parameters:
+    - history_size (int or None): Positions kept (see HISTORY_WINDOW); None keeps them all since the last start.
+    - operation_history_size (int or None): Start frames kept; None keeps them all.
+    """
+    __slots__ = ('x_centers', 'y_centers', 'heights', 'start_frames')
+
+    def __init__(self, history_size=None, operation_history_size=None):
+        self.x_centers = _history(history_size)
+        self.y_centers = _history(history_size)
+        self.heights = _history(history_size)
+        self.start_frames = _history(operation_history_size, np.int64)  # non_dominant_hand_detections
+
+
+class PokeState:
+    """detect_poke_phase state: last three line lengths and angles, and where the first poke was seen."""
+    __slots__ = ('line_lengths', 'thetas', 'first_x', 'first_y')
+
+    def __init__(self):
+        self.line_lengths = [0, 0, 0]
+        self.thetas = [0, 0, 0]
+        self.first_x = 0
+        self.first_y = 0
+
+
+class PenState:
+    """detect_pen_phase state: last three line lengths, last valid pen length and where the first stroke was seen."""
+    __slots__ = ('line_lengths', 'last_valid_length', 'first_x', 'first_y')
+
+    def __init__(self):
+        self.line_lengths = [0, 0, 0]
+        self.last_valid_length = None
+        self.first_x = None
+        self.first_y = None
+
+
+class EndState:
+    """
+    End detection state: end frames, operation durations and the single hand buffer.
+
+    Parameters:
+    - operation_history_size (int or None): End frames and durations kept; None keeps them all.
+    """
+    __slots__ = ('end_frames', 'durations', 'last_valid_frame', 'buffer')
+
+    def __init__(self, operation_history_size=None):
+        self.end_frames = _history(operation_history_size, np.int64)
+        self.durations = _history(operation_history_size, np.int64)
+        self.last_valid_frame = -5  # Initialize to ensure the first valid frame is always added
+        self.buffer = 0
+
+
+class PipelineState:
+    """
+    Per-recording analysis state of one station stream (what initialize_variables used to return as a dict).
+
+    The phase counters and metrics stay dicts (the annotation reads them as such); everything else is kept in
+    one sub-state per detector. Every object in the state is slotted and made of lists, small NumPy arrays
+    and numbers, so one process can host many streams and snapshot() / restore() are plain pickles of a few
+    kilobytes.
+
+    Parameters:
+    - prediction_window_size (int): Number of recent VGG-19 predictions kept for the phase detectors.
+    - history_size (int or None): If set, the hand position histories keep only the last history_size values
+      in fixed-size TrackBuffers (constant memory for live streams, see HISTORY_WINDOW; starts can then differ
+      from main()); None keeps every position since the last start.
+    - operation_history_size (int or None): If set, the per-operation series (start frames, end frames,
+      durations) keep only the last operation_history_size operations; metrics['duration_stats'] still
+      covers every operation.
+    """
+    __slots__ = ('phases', 'metrics', 'start', 'poke', 'pen', 'end', 'predictions', 'previous_image',
+                 'previous_crop_box')
+
+    def __init__(self, prediction_window_size=32, history_size=None, operation_history_size=None):
+        self.phases = {
+            'start': 0,
+            'poke': 0,
+            'pen': 0,
+            'end': 0
+        }
+        self.metrics = {
+            'duration': [0, 0],  # actual, mean
+            'poke': 0,  # 1/2 or 2/2
+            'pen': 0,  # 1/2 or 2/2
+            'total': [0, 0],  # n, correct for presenting %
+            'duration_stats': RunningStats()  # count, mean, std, min/max, p50/p95 of the operation durations
+        }
+        self.start = StartState(history_size, operation_history_size)
+        self.poke = PokeState()
+        self.pen = PenState()
+        self.end = EndState(operation_history_size)
+        self.predictions = PredictionWindow(size=prediction_window_size)
+        self.previous_image = None  # Hand crop of the last frame with both hands
+        self.previous_crop_box = None  # Its (min_x, min_y, max_x, max_y) box in the frame (ROI frame differencing)
+
+    def snapshot(self):
+        """Serialised copy of the state (bytes)."""
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(data):
+        """PipelineState from snapshot() bytes."""
+        state = pickle.loads(data)
+        if not isinstance(state, PipelineState):
+            raise TypeError(f"Expected a PipelineState snapshot, got {type(state).__name__}")
+        return state
+
+
+# Example usage
+#state = PipelineState(history_size=56, operation_history_size=1024)
+#restored = PipelineState.restore(state.snapshot())
+#print(restored.phases, len(restored.start.x_centers))
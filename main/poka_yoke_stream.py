@@ -0,0 +1,441 @@
+import os
+from collections import namedtuple
+from main_helper import (initialize_state, determine_hand, get_hand_data, hand_crop_box, detect_start,
+                         update_end, HISTORY_WINDOW)
+from non_dominant_hand import DominantHandEstimator
+from probe_poke_phases import update_poke_state
+from pen_phase import update_pen_state
+from frame_differencing import FrameDiff, DiffWindow, dominant_hand_window
+from frames import load_frame, FrameSource
+from detection_store import open_detection_store
+from hand_detector import YoloHandDetector, LabelSink
+from hand_tracker import TrackedHandDetector
+from vgg_batcher import PredictionBatcher
+from checkpoint import save_checkpoint, load_checkpoint, restore_stream
+from profiling import NULL_PROFILER
+
+PHASES = ('start', 'poke', 'pen', 'end')
+
+# One phase counter increase: phase is 'start', 'poke', 'pen' or 'end', count is the new counter value
+PhaseEvent = namedtuple('PhaseEvent', ['frame_number', 'phase', 'count'])
+
+# Frames analyze_recording may hold back from on_frame while their crops wait for a batch; past this the pending
+# crops are classified early (decoded frames are kept in memory meanwhile)
+ANNOTATION_MAX_DELAY = 32
+
+# A hand crop the stream sends to the poke/pen classifier: the crop of frame_number is compared with the crop of
+# previous_frame_number (the previous frame with both hands)
+CropJob = namedtuple('CropJob', ['frame_number', 'previous_frame_number', 'x_center_dominant', 'y_center_dominant'])
+
+
+class PokaYokeStream:
+    """
+    Frame-in, event-out version of the main() loop for live analysis.
+
+    push(frame, detections) runs the same per-frame logic as main() (start detection, batched VGG-19
+    poke/pen detection, end detection) and returns the phase events of that frame. All detector state is in
+    self.state (PipelineState); several streams can run side by side in one process.
+
+    By default every series is bounded, so a stream with a classifier uses constant memory however long it
+    runs: the last prediction_window_size predictions, the last HISTORY_WINDOW non-dominant hand positions
+    and the last operation_history_size operations (a detections-only stream also records its crop_jobs).
+    The bounded hand history is the one trade-off: a position older than the window can no longer trigger a
+    start, so starts (and the end/poke/pen events after them) can differ from main(). history_size=None
+    keeps every position since the last start and gives main()'s events exactly, at the cost of memory
+    growing while the station is idle; analyze_recording uses it for offline runs.
+
+    Parameters:
+    - model_poke_pen: Poke/pen classifier (see load_poke_pen_model). With None the stream only runs the
+      detection based start/end logic and records in crop_jobs the crops it would have classified; frames
+      are then not needed (push(None, detections)).
+    - dominant_hand_position (str or None): 'left' or 'right' if known; otherwise it is estimated from
+      the first warmup_frames frames with DominantHandEstimator.
+    - warmup_frames (int): Frames used to estimate the dominant hand before the answer is frozen.
+    - batch_size (int): VGG-19 micro-batch size (1 classifies every crop immediately).
+    - max_latency (float or None): Seconds a crop may wait for its batch.
+    - prediction_window_size (int): Number of recent predictions kept for the phase detectors.
+    - history_size (int or None): Non-dominant hand positions kept (default HISTORY_WINDOW); None keeps them
+      all since the last start, like main().
+    - operation_history_size (int or None): Number of operations whose start/end frames and durations are
+      kept; None keeps them all.
+    - profiler (StageProfiler): Times the stages of push (disabled by default, see profiling).
+    - classifier_gate (ChangeGate or None): Reuse the previous prediction for hand crops that have not changed
+      (see vgg_batcher.ChangeGate); its hits/misses give the hit rate. It is reset at every start and after a
+      frame without a crop, and checkpoints keep its state, so resumed runs reuse the same predictions.
+    - diff_window_scale (float or None): ROI mode of the poke/pen line detection: the frame difference, edges
+      and Hough lines are computed only in a window of diff_window_scale times the dominant hand box, at
+      native resolution (see FrameDiff). None compares the whole crops resized to 224x224.
+    - preprocess (str or callable): Preprocessing the classifier was trained with (see
+      vgg_batcher.resolve_preprocess); required with a model_poke_pen.
+    - batch_crops (bool): Hand the classifier's crops to the batcher as frames (PredictionBatcher.submit_frame),
+      cut and preprocessed together when the batch is flushed; same predictions, the frames of a batch are
+      kept in memory until then.
+    """
+
+    def __init__(self, model_poke_pen, dominant_hand_position=None, warmup_frames=300, batch_size=1,
+                 max_latency=None, prediction_window_size=32, history_size=HISTORY_WINDOW,
+                 operation_history_size=1024, profiler=NULL_PROFILER, classifier_gate=None,
+                 diff_window_scale=None, preprocess=None, batch_crops=False):
+        self.hand_estimator = DominantHandEstimator(warmup_frames=warmup_frames)
+        if dominant_hand_position is not None:
+            non_dominant_hand_position = "left" if dominant_hand_position == "right" else "right"
+            self.hand_estimator.frozen_position = (dominant_hand_position, non_dominant_hand_position)
+        self.batcher = None
+        if model_poke_pen is not None:
+            self.batcher = PredictionBatcher(model_poke_pen, batch_size=batch_size, max_latency=max_latency,
+                                             size=(224, 224), preprocess=preprocess, profiler=profiler,
+                                             gate=classifier_gate)
+        self.profiler = profiler
+        self.diff_window_scale = diff_window_scale
+        self.batch_crops = batch_crops
+        self.crop_jobs = []
+        self.state = initialize_state(prediction_window_size, history_size, operation_history_size)
+        self.frame_number = -1
+        self.previous_frame_number = None  # Last frame with both hands (the crop in state.previous_image)
+        self.last_reset_frame = None  # Last frame where the poke/pen counters were reset
+
+    @property
+    def phases(self):
+        return self.state.phases
+
+    @property
+    def metrics(self):
+        return self.state.metrics
+
+    def push(self, frame, detections, frame_number=None):
+        """
+        Analyses one frame.
+
+        Parameters:
+        - frame: Frame, RGB array, PIL image or image path.
+        - detections: YOLO detections of the frame, (class_id, x_center, y_center, width, height[, conf]) rows.
+        - frame_number (int): Defaults to the previous frame number + 1.
+
+        Returns:
+        - List of PhaseEvent, in the order the counters changed.
+        """
+        if frame_number is None:
+            frame_number = self.frame_number + 1
+        self.frame_number = frame_number
+        profiler = self.profiler
+        profiler.set_frame(frame_number)
+        state = self.state
+        phases = state.phases
+        metrics = state.metrics
+        events = []
+
+        # Reset metrics
+        metrics['poke'] = 0
+        metrics['pen'] = 0
+
+        detections = [(int(d[0]), float(d[1]), float(d[2]), float(d[3]), float(d[4])) for d in detections]
+        hand_detections = [d for d in detections if d[0] == 0 or d[0] == 1]
+        with profiler.span('dominant_hand'):
+            dominant_hand_position = self.hand_estimator.update(detections)[0]
+
+        if len(hand_detections) == 2:
+            dominant_hand_detection = determine_hand(hand_detections, dominant_hand_position, return_dominant=True)
+            non_dominant_hand_detection = determine_hand(hand_detections, dominant_hand_position,
+                                                         return_dominant=False)
+            current_x_center_dominant, current_y_center_dominant, current_height_dominant, current_width_dominant = \
+                get_hand_data(dominant_hand_detection)
+            current_x_center_non_dominant, current_y_center_non_dominant, current_height_non_dominant, \
+                current_width_non_dominant = get_hand_data(non_dominant_hand_detection)
+
+            image_cropped = None
+            if self.batcher is not None:
+                with profiler.span('crop_hand_region'):
+                    # crop_hand_region on a Frame, keeping the integer box the crop was cut with
+                    frame = load_frame(frame, frame_number)
+                    crop_box = tuple(int(round(v)) for v in hand_crop_box(
+                        frame.width, frame.height, detections, width_reduction=0.8, height_reduction=0.6,
+                        move_factor=1))
+                    image_cropped = frame.crop(crop_box)
+
+            if phases['start'] <= phases['end']:
+                phases['poke'] = 0
+                phases['pen'] = 0
+                self.last_reset_frame = frame_number
+                if len(state.start.x_centers) > 0:
+                    with profiler.span('start_detection'):
+                        started = detect_start(state, current_x_center_non_dominant, current_y_center_non_dominant,
+                                               current_height_non_dominant, frame_number)
+                    if started:
+                        events.append(PhaseEvent(frame_number, 'start', phases['start']))
+                        if self.batcher is not None and self.batcher.gate is not None:
+                            # A new operation: never reuse a prediction of the previous one
+                            self.batcher.gate.reset()
+            elif phases['start'] > phases['end']:
+                metrics['duration'][0] += 1  # Update duration of the trial
+                if current_y_center_non_dominant > 0.7:
+                    if self.batcher is None:
+                        self.crop_jobs.append(CropJob(frame_number, self.previous_frame_number,
+                                                      current_x_center_dominant, current_y_center_dominant))
+                    else:
+                        context = (self._frame_diff(image_cropped, crop_box, dominant_hand_detection, frame),
+                                   current_x_center_dominant, current_y_center_dominant, frame_number)
+                        if self.batch_crops:
+                            ready = self.batcher.submit_frame(frame, detections, context, frame_number)
+                        else:
+                            ready = self.batcher.submit(image_cropped, context, frame_number)
+                        events.extend(self._apply_predictions(ready))
+
+            state.start.x_centers.append(current_x_center_non_dominant)
+            state.start.y_centers.append(current_y_center_non_dominant)
+            state.start.heights.append(current_height_non_dominant)
+            state.previous_image = image_cropped
+            if self.batcher is not None:
+                state.previous_crop_box = crop_box
+            self.previous_frame_number = frame_number
+
+        if len(hand_detections) == 1:
+            # The operation may end here: classify the pending crops first
+            events.extend(self.flush())
+            with profiler.span('end_detection'):
+                ended = update_end(state, hand_detections[0], frame_number)
+            if ended:
+                events.append(PhaseEvent(frame_number, 'end', phases['end']))
+
+        if self.batcher is not None:
+            events.extend(self._apply_predictions(self.batcher.poll()))
+        return events
+
+    def _frame_diff(self, image_cropped, crop_box, dominant_hand_detection, frame):
+        """FrameDiff of the previous and current hand crops (ROI mode around the dominant hand if enabled)."""
+        diff_window = None
+        if self.diff_window_scale is not None:
+            window = dominant_hand_window(dominant_hand_detection, frame.size, self.diff_window_scale)
+            diff_window = DiffWindow(self.state.previous_crop_box, crop_box, window)
+        return FrameDiff(self.state.previous_image, image_cropped, diff_window=diff_window)
+
+    def oldest_pending_frame(self):
+        """Frame number of the oldest crop waiting for its prediction, or None."""
+        if self.batcher is None or not len(self.batcher):
+            return None
+        return self.batcher.contexts[0][-1]
+
+    def flush(self):
+        """Classifies the pending crops (call at the end of a stream) and returns their events."""
+        if self.batcher is None:
+            return []
+        return self._apply_predictions(self.batcher.flush())
+
+    def _apply_predictions(self, ready_predictions):
+        """
+        Runs the poke and pen detectors on classified crops, in frame order.
+
+        Parameters:
+        - ready_predictions: ((frame_diff, x_center_dominant, y_center_dominant, frame_number), pred) pairs,
+          frame_diff being the FrameDiff of the crop and the previous crop.
+        """
+        state = self.state
+        events = []
+        for (frame_diff, x_center_dominant, y_center_dominant, frame_number), pred in ready_predictions:
+            state.predictions.append(pred)
+            # Includes the frame differencing and Hough lines (detect_poke_pen_lines), computed on first use
+            with self.profiler.span('poke_pen_detection'):
+                poked = update_poke_state(state, frame_diff, x_center_dominant, y_center_dominant)
+                penned = update_pen_state(state, frame_diff, x_center_dominant, y_center_dominant)
+            if poked:
+                events.append(PhaseEvent(frame_number, 'poke', state.phases['poke']))
+            if penned:
+                events.append(PhaseEvent(frame_number, 'pen', state.phases['pen']))
+        return events
+
+
+def summarize_operations(events):
+    """
+    Per-operation results from a list of PhaseEvent.
+
+    Returns:
+    - List of dicts with start_frame, end_frame, the poke and pen counts reached before the end, and success
+      (both pokes and both pen strokes, 2/2 like the annotation's success count).
+    """
+    operations = []
+    operation = None
+    for event in events:
+        if event.phase == 'start':
+            operation = {'start_frame': event.frame_number, 'poke': 0, 'pen': 0}
+        elif operation is not None and event.phase in ('poke', 'pen'):
+            operation[event.phase] = event.count
+        elif operation is not None and event.phase == 'end':
+            operation['end_frame'] = event.frame_number
+            operation['success'] = operation['poke'] == 2 and operation['pen'] == 2
+            operations.append(operation)
+            operation = None
+    return operations
+
+
+class _PendingFrames:
+    """
+    Frames whose on_frame call waits for the poke/pen predictions of their crops.
+
+    With batch_size > 1 the poke/pen events of a frame come out when its batch is classified, frames later, so
+    stream.phases is not yet the frame's state when it is pushed. Each frame keeps a copy of the counters
+    taken when it was pushed; the poke/pen events of that frame or earlier ones that come out later are applied
+    to the copy, and the frame goes to on_frame(frame_number, frame, detections, phases) once no crop of that
+    frame or an earlier one is pending. No counter is reset while crops are pending (an end flushes them first).
+    """
+
+    def __init__(self, on_frame, profiler=NULL_PROFILER):
+        self.on_frame = on_frame
+        self.profiler = profiler
+        self.frames = []  # (frame_number, frame, detections, phases), oldest first
+
+    def __len__(self):
+        return len(self.frames)
+
+    def update(self, stream, new_events, frame=None, detections=None):
+        """Applies new_events to the waiting frames, queues frame (if given) and releases the classified ones."""
+        for event in new_events:
+            if event.phase in ('poke', 'pen'):
+                for frame_number, _, _, phases in self.frames:
+                    if frame_number >= event.frame_number:
+                        phases[event.phase] = event.count
+        if frame is not None:
+            self.frames.append((frame.frame_number, frame, detections, dict(stream.phases)))
+
+        oldest_pending = stream.oldest_pending_frame()
+        released = 0
+        for frame_number, frame, detections, phases in self.frames:
+            if oldest_pending is not None and frame_number >= oldest_pending:
+                break
+            with self.profiler.span('annotation'):
+                self.on_frame(frame_number, frame, detections, phases)
+            released += 1
+        del self.frames[:released]
+
+
+def analyze_recording(model_poke_pen, input_folder, txt_dir=None, yolo_weights=None, save_txt=False, frame_stride=1,
+                      batch_size=8, max_latency=None, on_frame=None, checkpoint_path=None, checkpoint_every=1000,
+                      resume=False, checkpoint_extra=None, profiler=NULL_PROFILER, classifier_gate=None,
+                      diff_window_scale=None, detect_every=None, hand_detector=None, history_size=None,
+                      operation_history_size=None, batch_crops=False, *, preprocess):
+    """
+    Runs a whole recording through a PokaYokeStream.
+
+    Parameters:
+    - model_poke_pen: Poke/pen classifier (see load_poke_pen_model).
+    - input_folder (str): Video file or folder of frame_XXXXX.jpg images.
+    - txt_dir (str): YOLO labels directory (or .dets store), one label file per frame of the recording (before
+      frame_stride). Used for the detections unless yolo_weights is set.
+    - yolo_weights (str): Detect the hands in-process with these weights instead of reading txt_dir.
+    - save_txt (bool): With yolo_weights, also write the label files to txt_dir (frame_stride 1 only).
+    - frame_stride (int): Keep one frame out of every frame_stride frames of input_folder; kept frame k is paired
+      with the labels of recording frame k * frame_stride.
+    - batch_size (int): VGG-19 micro-batch size.
+    - max_latency (float or None): Seconds a crop may wait for its batch.
+    - on_frame (callable): on_frame(frame_number, frame, detections, phases), called for each frame in order
+      (e.g. to annotate it) with the phase counters the frame reached. With batch_size > 1 a frame waits until
+      the crops up to it are classified (at most ANNOTATION_MAX_DELAY frames), so a poke or pen shows on the
+      frame it was detected on, not batch_size frames late.
+    - checkpoint_path (str): Checkpoint file, rewritten every checkpoint_every frames (see save_checkpoint).
+    - checkpoint_every (int): Frames between checkpoints.
+    - resume (bool): If checkpoint_path exists, continue from the frame after its last checkpointed frame; the
+      result is the same as an uninterrupted run.
+    - checkpoint_extra: Picklable object saved with every checkpoint (e.g. the annotation state used by
+      on_frame; read it back with load_checkpoint(checkpoint_path).extra before resuming).
+    - profiler (StageProfiler): Times every stage of the loop (frame decoding, detections, the stream's stages,
+      on_frame as 'annotation', checkpoints); disabled by default.
+    - classifier_gate (ChangeGate or None): Skip the classifier for unchanged hand crops (see PokaYokeStream).
+    - diff_window_scale (float or None): ROI mode of the poke/pen line detection (see PokaYokeStream).
+    - detect_every (int or None): With yolo_weights, run YOLO on one frame out of detect_every (and when the
+      hands move too fast to be extrapolated) and track the hands in between (see TrackedHandDetector).
+    - hand_detector: Object with detect(frame) used instead of YoloHandDetector(yolo_weights), e.g. a
+      TrackedHandDetector whose detection rate the caller reads afterwards.
+    - history_size (int or None): Non-dominant hand positions kept by the stream. None (default) keeps them
+      all since the last start, for the exact events of main(); HISTORY_WINDOW bounds the memory like a live
+      stream (see PokaYokeStream).
+    - operation_history_size (int or None): Operations whose start/end frames and durations are kept; None
+      (default) keeps them all.
+    - batch_crops (bool): Cut and preprocess the classifier's crops a batch at a time (see PokaYokeStream).
+    - preprocess (str or callable): Required keyword. Preprocessing the classifier was trained with, i.e. the one
+      of make_prediction_VGG19 ('vgg19', 'rescale' or a callable, see vgg_batcher.resolve_preprocess).
+
+    Returns:
+    - Tuple: (stream, events) with the final PokaYokeStream and the list of PhaseEvent.
+    """
+    if save_txt and frame_stride > 1:
+        # Labels are one file per recording frame; a strided run would only write every frame_stride-th one
+        raise ValueError("save_txt needs frame_stride=1 (label directories have one file per recording frame)")
+    if yolo_weights is None and hand_detector is None:
+        # YOLO labels are packed once into a memory mapped store, frames are read from it without opening files
+        detection_store = open_detection_store(txt_dir)
+        # Offline runs know the whole recording: the dominant hand is estimated once, in a single pass
+        dominant_hand_position = DominantHandEstimator.from_directory(detection_store).position()[0]
+    else:
+        # Hands are detected frame by frame; the dominant hand is estimated on the first frames of the stream
+        detection_store = None
+        detector = hand_detector if hand_detector is not None else YoloHandDetector(yolo_weights)
+        if detect_every is not None and hand_detector is None:
+            # YOLO on keyframes only, the tracker gives the boxes of the frames in between
+            detector = TrackedHandDetector(detector, detect_every=detect_every)
+        label_sink = LabelSink(txt_dir) if save_txt else None
+        dominant_hand_position = None
+
+    # Same per-frame logic as a live stream; offline runs keep the whole hand history unless told otherwise
+    stream = PokaYokeStream(model_poke_pen, dominant_hand_position=dominant_hand_position,
+                            batch_size=batch_size, max_latency=max_latency, history_size=history_size,
+                            operation_history_size=operation_history_size, profiler=profiler,
+                            classifier_gate=classifier_gate, diff_window_scale=diff_window_scale,
+                            preprocess=preprocess, batch_crops=batch_crops)
+    events = []
+    pending_frames = _PendingFrames(on_frame, profiler) if on_frame is not None else None
+
+    source = (input_folder, frame_stride)
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        restore_stream(stream, checkpoint, source)
+        events = list(checkpoint.events)
+
+    with FrameSource(input_folder, stride=frame_stride, start=stream.frame_number + 1) as frame_source:
+        frames = iter(frame_source)
+        while True:
+            with profiler.span('frame_decode'):  # Time waiting for the decoding thread
+                frame = next(frames, None)
+            if frame is None:
+                break
+            frame_number = frame.frame_number
+            profiler.set_frame(frame_number)
+            if detection_store is not None:
+                label_frame = frame_number * frame_stride  # Labels are numbered like the recording's frames
+                if label_frame >= len(detection_store):
+                    break
+                with profiler.span('label_parsing'):
+                    detections = detection_store.frame_detections(label_frame)
+            else:
+                with profiler.span('hand_detection'):
+                    detections = detector.detect(frame)
+                if label_sink is not None:
+                    label_sink.write(frame_number, detections)
+                detections = [(int(d[0]), *d[1:5]) for d in detections.tolist()]
+
+            with profiler.span('frame'):
+                new_events = stream.push(frame, detections, frame_number)
+                if detection_store is not None and label_frame + frame_stride >= len(detection_store):
+                    # Classify the crops still waiting for a batch
+                    new_events.extend(stream.flush())
+            events.extend(new_events)
+
+            if pending_frames is not None:
+                pending_frames.update(stream, new_events, frame, detections)
+                if len(pending_frames) > ANNOTATION_MAX_DELAY:
+                    # Too many decoded frames held back: classify the pending crops now
+                    new_events = stream.flush()
+                    events.extend(new_events)
+                    pending_frames.update(stream, new_events)
+
+            if checkpoint_path is not None and (frame_number + 1) % checkpoint_every == 0:
+                with profiler.span('checkpoint'):
+                    # Crops waiting for a batch are classified first, so the checkpoint holds no pending work
+                    new_events = stream.flush()
+                    events.extend(new_events)
+                    if pending_frames is not None:
+                        pending_frames.update(stream, new_events)
+                    save_checkpoint(checkpoint_path, stream, events, source, checkpoint_extra)
+
+    new_events = stream.flush()
+    events.extend(new_events)
+    if pending_frames is not None:
+        pending_frames.update(stream, new_events)
+    return stream, events
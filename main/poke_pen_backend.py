@@ -0,0 +1,259 @@
+import os
+import time
+import numpy as np
+from PIL import Image
+from vgg_batcher import resolve_preprocess
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_poke_pen_model(model_path):
+    """
+    Loads the poke/pen classifier with the backend matching the file extension.
+
+    - .hdf5 / .h5 / .keras: Keras (imports TensorFlow).
+    - .onnx: ONNX Runtime on CPU (INT8 models from quantize_int8 included).
+    - .xml: OpenVINO IR.
+
+    Every backend exposes predict(batch) and predict_on_batch(batch) on a (B, 224, 224, 3) float32 batch,
+    so it can be used by PredictionBatcher and make_prediction_VGG19.
+    """
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension == '.onnx':
+        return OnnxPokePenModel(model_path)
+    if extension == '.xml':
+        return OpenVINOPokePenModel(model_path)
+    # Imported here so the ONNX/OpenVINO backends never pull in TensorFlow
+    from keras.models import load_model
+    return load_model(model_path)
+
+
+class OnnxPokePenModel:
+    """
+    Poke/pen classifier running on ONNX Runtime.
+
+    Parameters:
+    - onnx_path (str): Model exported by export_to_onnx (or its INT8 copy).
+    - num_threads (int or None): intra-op threads; None lets ONNX Runtime decide.
+    """
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, **kwargs):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    predict_on_batch = predict
+
+
+class OpenVINOPokePenModel:
+    """
+    Poke/pen classifier running on OpenVINO (CPU).
+
+    Parameters:
+    - xml_path (str): OpenVINO IR converted from the ONNX export.
+    """
+
+    def __init__(self, xml_path):
+        import openvino as ov
+
+        self.compiled_model = ov.Core().compile_model(xml_path, 'CPU')
+        self.output = self.compiled_model.output(0)
+
+    def predict(self, batch, **kwargs):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.compiled_model(batch)[self.output]
+
+    predict_on_batch = predict
+
+
+def export_to_onnx(model_path, onnx_path, size=(224, 224), opset=13):
+    """
+    Exports the Keras poke/pen classifier (THIS_model.hdf5) to ONNX. Needs tensorflow and tf2onnx,
+    only on the machine doing the export.
+
+    Parameters:
+    - model_path (str): Keras .hdf5 model.
+    - onnx_path (str): Output .onnx file.
+    - size (tuple): (width, height) of the model input.
+    - opset (int): ONNX opset.
+
+    Returns:
+    - str: onnx_path.
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from keras.models import load_model
+
+    model = load_model(model_path)
+    input_signature = [tf.TensorSpec((None, size[1], size[0], 3), tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=onnx_path)
+    return onnx_path
+
+
+def list_crop_images(crop_dirs):
+    """Lists the images of one or more crop folders (searched recursively), sorted."""
+    if isinstance(crop_dirs, str):
+        crop_dirs = [crop_dirs]
+    image_paths = []
+    for crop_dir in crop_dirs:
+        for root, _, files in os.walk(crop_dir):
+            image_paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(image_paths)
+
+
+def load_crop_batch(image_paths, size=(224, 224), preprocess=None):
+    """Loads and preprocesses crops into a (B, H, W, 3) float32 batch (preprocess: see resolve_preprocess)."""
+    preprocess = resolve_preprocess(preprocess)
+    batch = np.empty((len(image_paths), size[1], size[0], 3), dtype=np.float32)
+    for i, image_path in enumerate(image_paths):
+        with Image.open(image_path) as image:
+            batch[i] = preprocess(image, size)
+    return batch
+
+
+class CropCalibrationReader:
+    """
+    Feeds crops to onnxruntime's static quantisation calibration (CalibrationDataReader interface).
+
+    Parameters:
+    - image_paths (list): Calibration crops.
+    - input_name (str): Model input name.
+    - batch_size (int): Crops per calibration batch.
+    """
+
+    def __init__(self, image_paths, input_name, batch_size=16, size=(224, 224), preprocess=None):
+        self.image_paths = image_paths
+        self.input_name = input_name
+        self.batch_size = batch_size
+        self.size = size
+        self.preprocess = resolve_preprocess(preprocess)
+        self.position = 0
+
+    def get_next(self):
+        if self.position >= len(self.image_paths):
+            return None
+        paths = self.image_paths[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        return {self.input_name: load_crop_batch(paths, self.size, self.preprocess)}
+
+    def rewind(self):
+        self.position = 0
+
+
+def quantize_int8(onnx_path, output_path, calibration_dirs, max_calibration_images=500, seed=0, preprocess=None):
+    """
+    Post-training static INT8 quantisation of the ONNX poke/pen classifier, calibrated on crop folders.
+
+    Parameters:
+    - onnx_path (str): FP32 model from export_to_onnx.
+    - output_path (str): INT8 .onnx output.
+    - calibration_dirs (str or list): Folders with hand crops (e.g. the VGG-19 training crops).
+    - max_calibration_images (int): Random subset size used for calibration.
+    - seed (int): Seed of the subset selection.
+    - preprocess (str or callable): Required. Preprocessing the model was trained with (see resolve_preprocess).
+
+    Returns:
+    - str: output_path.
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    preprocess = resolve_preprocess(preprocess)
+
+    image_paths = list_crop_images(calibration_dirs)
+    if not image_paths:
+        raise ValueError(f"No calibration images found in {calibration_dirs}")
+    if len(image_paths) > max_calibration_images:
+        rng = np.random.default_rng(seed)
+        image_paths = sorted(rng.choice(image_paths, max_calibration_images, replace=False).tolist())
+
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(
+        onnx_path,
+        output_path,
+        CropCalibrationReader(image_paths, input_name, preprocess=preprocess),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    return output_path
+
+
+def compare_backends(reference_model, candidate_models, crop_dirs, batch_size=16, class_names=None,
+                     preprocess=None):
+    """
+    Compares candidate backends against the reference (Keras) model on a set of crops.
+
+    If the crops are stored in one sub-folder per class (the flow_from_directory layout), accuracy is
+    also reported; class indices follow class_names, or the sorted sub-folder names.
+
+    Parameters:
+    - reference_model: Keras model (or any backend) used as reference.
+    - candidate_models (dict): name -> backend (e.g. {'onnx': ..., 'onnx_int8': ...}).
+    - crop_dirs (str or list): Crop folders.
+    - batch_size (int): Crops per model call.
+    - class_names (list): Class folder names in model output order.
+    - preprocess (str or callable): Required. Preprocessing the models were trained with (see resolve_preprocess).
+
+    Returns:
+    - dict: name -> {'agreement', 'max_abs_diff', 'mean_abs_diff', 'accuracy', 'ms_per_crop'}.
+      'reference' holds the reference model's accuracy and timing.
+    """
+    preprocess = resolve_preprocess(preprocess)
+    image_paths = list_crop_images(crop_dirs)
+    if not image_paths:
+        raise ValueError(f"No images found in {crop_dirs}")
+
+    labels = None
+    if class_names is None and isinstance(crop_dirs, str):
+        class_names = sorted(d for d in os.listdir(crop_dirs) if os.path.isdir(os.path.join(crop_dirs, d)))
+    if class_names:
+        class_index = {name: i for i, name in enumerate(class_names)}
+        folder_names = [os.path.basename(os.path.dirname(path)) for path in image_paths]
+        if all(name in class_index for name in folder_names):
+            labels = np.array([class_index[name] for name in folder_names])
+
+    def run(model):
+        outputs = []
+        start = time.perf_counter()
+        for i in range(0, len(image_paths), batch_size):
+            batch = load_crop_batch(image_paths[i:i + batch_size], preprocess=preprocess)
+            outputs.append(np.asarray(model.predict_on_batch(batch)))
+        elapsed = time.perf_counter() - start
+        return np.concatenate(outputs), elapsed * 1000 / len(image_paths)
+
+    reference_outputs, reference_ms = run(reference_model)
+    reference_classes = reference_outputs.argmax(axis=1)
+    results = {'reference': {
+        'accuracy': float(np.mean(reference_classes == labels)) if labels is not None else None,
+        'ms_per_crop': reference_ms,
+    }}
+
+    for name, model in candidate_models.items():
+        outputs, ms_per_crop = run(model)
+        abs_diff = np.abs(outputs - reference_outputs)
+        classes = outputs.argmax(axis=1)
+        results[name] = {
+            'agreement': float(np.mean(classes == reference_classes)),
+            'max_abs_diff': float(abs_diff.max()),
+            'mean_abs_diff': float(abs_diff.mean()),
+            'accuracy': float(np.mean(classes == labels)) if labels is not None else None,
+            'ms_per_crop': ms_per_crop,
+        }
+    return results
+
+# Example usage
+#export_to_onnx('/Users/nunofernandes/PycharmProjects/challenge_vc/THIS_model.hdf5', 'THIS_model.onnx')
+#quantize_int8('THIS_model.onnx', 'THIS_model_int8.onnx', '/Users/nunofernandes/PycharmProjects/challenge_vc/cropped', preprocess='vgg19')
+#compare_backends(load_poke_pen_model('THIS_model.hdf5'),
+#                 {'onnx': load_poke_pen_model('THIS_model.onnx'), 'onnx_int8': load_poke_pen_model('THIS_model_int8.onnx')},
+#                 '/Users/nunofernandes/PycharmProjects/challenge_vc/cropped', preprocess='vgg19')
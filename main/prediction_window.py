@@ -0,0 +1,88 @@
+from collections import deque
+from itertools import islice
+
+# Classifier column and threshold of the predictions detect_poke_phase and detect_pen_phase act on
+POKE_COLUMN, POKE_THRESHOLD = 1, 0.3
+PEN_COLUMN, PEN_THRESHOLD = 2, 0.8
+
+# (column, threshold, count): only the first `count` predictions above threshold of the whole history can change
+# the outcome of a scan once they are older than the window (see PredictionWindow)
+LANDMARK_RULES = ((POKE_COLUMN, POKE_THRESHOLD, 2), (PEN_COLUMN, PEN_THRESHOLD, 1))
+
+
+class PredictionWindow:
+    """
+    The VGG-19 predictions scanned by detect_poke_phase and detect_pen_phase: the last K predictions, plus the
+    few older ones that still matter.
+
+    main() never clears its predictions list, so every frame rescans the whole history. A scan only depends on
+    the history through the qualifying predictions (the same lines are found for each of them, and the
+    detector state saturates: line lists of length 3, poke counted from the first two qualifying predictions,
+    pen from the first one) and on the number of predictions after them, capped at 3. So keeping the first
+    qualifying predictions of every landmark rule ("landmarks") ahead of the last K predictions gives the
+    same phases and detector state as scanning the whole list, with at most K + 3 predictions per scan.
+
+    Parameters:
+    - size (int): Number of recent predictions kept (K); at least skip_latest + 2.
+    - skip_latest (int): Newest predictions left out of the scan (the old predictions[:-3]).
+    - landmark_rules (tuple): (column, threshold, count) rules, see LANDMARK_RULES.
+    """
+
+    def __init__(self, size=32, skip_latest=3, landmark_rules=LANDMARK_RULES):
+        if size < skip_latest + 2:
+            raise ValueError("size must be at least skip_latest + 2")
+        self.size = size
+        self.skip_latest = skip_latest
+        self.landmark_rules = landmark_rules
+        self.predictions = deque(maxlen=size)
+        self.landmarks = []  # (index, prediction) of the landmark predictions, oldest first
+        self.landmark_counts = [0] * len(landmark_rules)
+        self.count = 0  # Predictions appended since the last clear
+
+    def append(self, prediction):
+        is_landmark = False
+        for rule, (column, threshold, count) in enumerate(self.landmark_rules):
+            if self.landmark_counts[rule] < count and prediction[column] > threshold:
+                self.landmark_counts[rule] += 1
+                is_landmark = True
+        if is_landmark:
+            self.landmarks.append((self.count, prediction))
+        self.predictions.append(prediction)
+        self.count += 1
+
+    def clear(self):
+        self.predictions.clear()
+        self.landmarks = []
+        self.landmark_counts = [0] * len(self.landmark_rules)
+        self.count = 0
+
+    def __len__(self):
+        return len(self.predictions)
+
+    def __iter__(self):
+        return iter(self.predictions)
+
+    def __getitem__(self, index):
+        return self.predictions[index]
+
+    def settled(self):
+        """
+        Predictions to scan, oldest first: the landmarks older than the window, then the predictions in the
+        window except the newest skip_latest ones.
+        """
+        first_in_window = self.count - len(self.predictions)
+        for index, prediction in self.landmarks:
+            if index >= first_in_window:
+                break
+            yield prediction
+        yield from islice(self.predictions, max(len(self.predictions) - self.skip_latest, 0))
+
+
+def settled_predictions(predictions, skip_latest=3):
+    """
+    Predictions the phase detectors analyse: a PredictionWindow's settled part, or predictions[:-3]
+    for a plain list.
+    """
+    if isinstance(predictions, PredictionWindow):
+        return predictions.settled()
+    return islice(predictions, max(len(predictions) - skip_latest, 0))
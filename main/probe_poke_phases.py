@@ -1,10 +1,15 @@
+from frame_differencing import FrameDiff
+from main_helper import distance_moved
+from prediction_window import settled_predictions, POKE_COLUMN, POKE_THRESHOLD
+
+
 def detect_poke_phase(predictions, previous_image, image_cropped, current_x_center_dominant, current_y_center_dominant,
-                      phases, line_lengths, thetas, first_poke_x, first_poke_y):
+                      phases, line_lengths, thetas, first_poke_x, first_poke_y, frame_diff=None):
     """
     Detects 'poke' phase based on predictions and updates relevant parameters.
 
     Parameters:
-    - predictions (list): List of model predictions.
+    - predictions (PredictionWindow or list): Recent model predictions.
     - previous_image (ndarray): Previous frame image.
     - image_cropped (ndarray): Current frame image.
     - current_x_center_dominant (float): X-coordinate of the dominant hand's center in the current frame.
@@ -14,6 +19,7 @@ def detect_poke_phase(predictions, previous_image, image_cropped, current_x_cent
     - thetas (list): List of angles from recent detections.
     - first_poke_x (float): X-coordinate of the first poke action.
     - first_poke_y (float): Y-coordinate of the first poke action.
+    - frame_diff (FrameDiff): Shared difference/lines of (previous_image, image_cropped); built here if None.
 
     Returns:
     - tuple: Updated phases, line_lengths, thetas, first_poke_x, first_poke_y.
@@ -26,13 +32,15 @@ def detect_poke_phase(predictions, previous_image, image_cropped, current_x_cent
 
     line_length = None
     theta = None
+    # The images are the same for every prediction: the frame difference and lines are computed at most once
+    # per frame pair, and shared with the other detector when frame_diff is passed in
+    if frame_diff is None:
+        frame_diff = FrameDiff(previous_image, image_cropped)
 
-    for prediction in predictions[:-3]:  # Analyzing the last few predictions
-        if prediction[1] > 0.3:  # Poke detection condition
+    for prediction in settled_predictions(predictions):  # Analyzing the last few predictions
+        if prediction[POKE_COLUMN] > POKE_THRESHOLD:  # Poke detection condition
             # Detect poke lines
-            line_length, theta = detect_poke_pen_lines(
-                image_before=previous_image,
-                image_after=image_cropped,
+            line_length, theta = frame_diff.detect(
                 type="poke",
                 min_length_threshold=31.14,
                 max_length_threshold=31.149
@@ -73,3 +81,20 @@ def detect_poke_phase(predictions, previous_image, image_cropped, current_x_cent
 
     return phases, line_lengths, thetas, first_poke_x, first_poke_y
 
+
+
+def update_poke_state(state, frame_diff, current_x_center_dominant, current_y_center_dominant):
+    """
+    detect_poke_phase on a PipelineState: reads state.predictions and updates state.phases and state.poke.
+
+    Returns:
+    - bool: True if the poke counter increased.
+    """
+    poke = state.poke
+    poke_count = state.phases['poke']
+    _, poke.line_lengths, poke.thetas, poke.first_x, poke.first_y = detect_poke_phase(
+        state.predictions, frame_diff.image_before, frame_diff.image_after,
+        current_x_center_dominant, current_y_center_dominant,
+        state.phases, poke.line_lengths, poke.thetas, poke.first_x, poke.first_y, frame_diff=frame_diff
+    )
+    return state.phases['poke'] > poke_count
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets; a last +Inf bucket catches the rest
+BUCKET_BOUNDS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                 2.5, 5.0)
+
+
+class _Span:
+    """Context manager timing one stage (one reusable instance per stage)."""
+    __slots__ = ('profiler', 'index', 'start')
+
+    def __init__(self, profiler, index):
+        self.profiler = profiler
+        self.index = index
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler._record(self.index, self.start, time.perf_counter_ns())
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullProfiler:
+    """Disabled profiler: span() returns a shared no-op context manager, so instrumented code costs a method call."""
+    enabled = False
+
+    def span(self, stage):
+        return _NULL_SPAN
+
+    def call(self, stage, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def set_frame(self, frame_number):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StageProfiler:
+    """
+    Timings and call counts of the per-frame stages, in fixed-size latency histograms.
+
+    Instrumented code wraps a stage in `with profiler.span('crop_hand_region'):` (or profiler.call(...)).
+    Each stage has a preallocated histogram (BUCKET_BOUNDS), a call count, a total and a maximum; recording a
+    call is a bisect and a few integer updates, with no allocation. Stages are registered on first use.
+
+    Spans of the frames in trace_frames are also kept as a Chrome trace timeline (chrome://tracing or
+    https://ui.perfetto.dev), up to max_trace_events spans.
+
+    Parameters:
+    - trace_frames (tuple or None): (first, last) frame numbers (inclusive) to trace; None traces nothing.
+    - max_trace_events (int): Maximum number of spans kept for the trace.
+    """
+    enabled = True
+
+    def __init__(self, trace_frames=None, max_trace_events=100000):
+        self.bounds_ns = [int(bound * 1e9) for bound in BUCKET_BOUNDS]
+        self.stages = []
+        self.counts = []
+        self.totals_ns = []
+        self.max_ns = []
+        self.histograms = []
+        self._spans = {}
+        self.trace_frames = trace_frames
+        self.max_trace_events = max_trace_events
+        self.trace_events = []
+        self.frame_number = None
+        self._tracing = False
+        self._origin_ns = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def _register(self, stage):
+        index = len(self.stages)
+        self.stages.append(stage)
+        self.counts.append(0)
+        self.totals_ns.append(0)
+        self.max_ns.append(0)
+        self.histograms.append([0] * (len(self.bounds_ns) + 1))
+        self._spans[stage] = _Span(self, index)
+        return self._spans[stage]
+
+    def span(self, stage):
+        """Context manager timing one call of a stage (not re-entrant for the same stage)."""
+        span = self._spans.get(stage)
+        return span if span is not None else self._register(stage)
+
+    def call(self, stage, function, *args, **kwargs):
+        """Calls function(*args, **kwargs) and times it as one call of stage."""
+        with self.span(stage):
+            return function(*args, **kwargs)
+
+    def set_frame(self, frame_number):
+        """Frame being processed (used to select the traced spans)."""
+        self.frame_number = frame_number
+        self._tracing = self.trace_frames is not None and \
+            self.trace_frames[0] <= frame_number <= self.trace_frames[1]
+
+    def _record(self, index, start_ns, end_ns):
+        elapsed = end_ns - start_ns
+        self.counts[index] += 1
+        self.totals_ns[index] += elapsed
+        if elapsed > self.max_ns[index]:
+            self.max_ns[index] = elapsed
+        self.histograms[index][bisect_left(self.bounds_ns, elapsed)] += 1
+        if self._tracing and len(self.trace_events) < self.max_trace_events:
+            self.trace_events.append((index, start_ns, elapsed, threading.get_ident(), self.frame_number))
+
+    def quantile(self, stage, q):
+        """Upper bound (seconds) of the histogram bucket holding quantile q of a stage (None if never called)."""
+        index = self.stages.index(stage)
+        count = self.counts[index]
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bucket, bucket_count in enumerate(self.histograms[index]):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                return BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else self.max_ns[index] / 1e9
+        return self.max_ns[index] / 1e9
+
+    def to_dict(self):
+        """JSON-ready snapshot: per stage count, total/mean/max seconds, p50/p99 bucket bounds and buckets."""
+        stages = {}
+        for index, stage in enumerate(self.stages):
+            count = self.counts[index]
+            stages[stage] = {
+                'count': count,
+                'total_s': self.totals_ns[index] / 1e9,
+                'mean_s': self.totals_ns[index] / count / 1e9 if count else None,
+                'max_s': self.max_ns[index] / 1e9,
+                'p50_s': self.quantile(stage, 0.5),
+                'p99_s': self.quantile(stage, 0.99),
+                'buckets': dict(zip([str(bound) for bound in BUCKET_BOUNDS] + ['+Inf'], self.histograms[index])),
+            }
+        return {'frame_number': self.frame_number, 'stages': stages}
+
+    def to_prometheus(self, prefix='pokayoke'):
+        """Prometheus text exposition of the stage histograms (<prefix>_stage_seconds)."""
+        name = f"{prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each per-frame stage.", f"# TYPE {name} histogram"]
+        for index, stage in enumerate(self.stages):
+            cumulative = 0
+            for bound, bucket_count in zip([repr(bound) for bound in BUCKET_BOUNDS] + ['+Inf'], self.histograms[index]):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {self.totals_ns[index] / 1e9!r}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {self.counts[index]}')
+        if self.frame_number is not None:
+            lines.append(f"# TYPE {prefix}_frame_number gauge")
+            lines.append(f"{prefix}_frame_number {self.frame_number}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes the metrics to path: JSON for a .json file, Prometheus text otherwise (e.g. node_exporter's textfile collector)."""
+        text = json.dumps(self.to_dict(), indent=1) if path.endswith('.json') else self.to_prometheus()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+    def write_chrome_trace(self, path):
+        """Writes the traced spans as a Chrome trace (JSON array of complete 'X' events, microseconds)."""
+        events = [{
+            'name': self.stages[index],
+            'ph': 'X',
+            'ts': (start_ns - self._origin_ns) / 1000,
+            'dur': elapsed_ns / 1000,
+            'pid': self._pid,
+            'tid': thread_id,
+            'args': {'frame': frame_number},
+        } for index, start_ns, elapsed_ns, thread_id, frame_number in self.trace_events]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        """
+        Serves the metrics over HTTP on a background thread: /metrics (Prometheus text) and /metrics.json.
+
+        Returns:
+        - ThreadingHTTPServer (call shutdown() and server_close() to stop it).
+        """
+        profiler = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, content_type = json.dumps(profiler.to_dict()).encode(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, content_type = profiler.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="StageProfiler", daemon=True).start()
+        return server
+
+
+# Example usage
+#profiler = StageProfiler(trace_frames=(1000, 1100))
+#stream, events = analyze_recording(model_poke_pen, input_folder, txt_dir, profiler=profiler, preprocess='vgg19')
+#profiler.write('/Users/nunofernandes/PycharmProjects/challenge_vc/metrics.prom')
+#profiler.write_chrome_trace('/Users/nunofernandes/PycharmProjects/challenge_vc/trace.json')
@@ -0,0 +1,226 @@
+"""
+Analyses one long recording on several processes by splitting it at the idle periods between operations.
+
+Usage:
+    python recording_segments.py frames/ labels/ model.onnx --preprocess vgg19 --workers 8
+
+Only the poke/pen part of the analysis is expensive (frame decode, hand crop, VGG-19 and Hough lines), and
+it is also the only part that needs the frames. The start/end logic reads nothing but the YOLO detections,
+so the recording is processed in three steps:
+
+1. scan_recording runs the start/end logic over the detection store (no frames, no model, vectorised with
+   hand_tracks). It gives the exact operations, durations and the list of crops a sequential run would classify.
+2. The crops are split at the start of an operation (the hands are idle before it, and every crop pair of
+   an operation lies inside it) and each segment is classified on a worker process (classify_segment).
+3. stitch_segments replays the poke/pen detectors over the classified crops, in frame order, with the state
+   carried from one operation to the next like in a sequential run.
+
+The phases, metrics and events are the same as analyze_recording with the same batch size.
+"""
+import argparse
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from detection_store import open_detection_store
+from frame_differencing import FrameDiff
+from frames import FrameSource
+from hand_tracks import load_hand_tracks, detect_start_end
+from main_helper import crop_hand_region
+from poka_yoke_stream import PokaYokeStream
+from station_runner import _init_worker, _get_model, summarize_stream
+from vgg_batcher import PredictionBatcher, PREPROCESSING
+
+
+def scan_recording(txt_dir, n_frames=None, prediction_window_size=32, frame_stride=1):
+    """
+    Runs the start/end logic over the detections only, with the vectorised offline analysis of hand_tracks.
+
+    Parameters:
+    - txt_dir (str): YOLO labels directory, .dets store or DetectionStore.
+    - n_frames (int): Number of frames to analyse (defaults to every frame of the store).
+    - prediction_window_size (int): Prediction window of the stream (used later by stitch_segments).
+    - frame_stride (int): Frame stride of the run (see load_hand_tracks).
+
+    Returns:
+    - Tuple: (stream, events) with a detections-only PokaYokeStream in the state a sequential run reaches
+      (its crop_jobs are the crops to classify) and the start/end PhaseEvents.
+    """
+    tracks = load_hand_tracks(txt_dir, n_frames=n_frames, frame_stride=frame_stride)
+    stream = PokaYokeStream(None, dominant_hand_position=tracks.dominant_hand_position,
+                            prediction_window_size=prediction_window_size, history_size=None,
+                            operation_history_size=None)
+    analysis = detect_start_end(tracks, stream.state)
+    stream.crop_jobs = analysis.crop_jobs
+    stream.last_reset_frame = analysis.last_reset_frame
+    stream.frame_number = tracks.n_frames - 1
+    return stream, analysis.events
+
+
+def idle_split_points(events):
+    """Frames where the recording can be split: the start of every operation (idle hands before it)."""
+    return [event.frame_number for event in events if event.phase == 'start']
+
+
+def split_crop_jobs(crop_jobs, split_points, segments):
+    """
+    Groups the crops into at most `segments` contiguous segments of similar size, cut only at split points.
+
+    Returns:
+    - List of lists of CropJob.
+    """
+    # Crops of one operation stay together
+    operations = []
+    for job in crop_jobs:
+        operation = bisect_right(split_points, job.frame_number)
+        if not operations or operations[-1][0] != operation:
+            operations.append((operation, []))
+        operations[-1][1].append(job)
+
+    target = len(crop_jobs) / max(segments, 1)
+    chunks = []
+    current = []
+    assigned = 0
+    for _, jobs in operations:
+        current.extend(jobs)
+        assigned += len(jobs)
+        if assigned >= target * (len(chunks) + 1) and len(chunks) < segments - 1:
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def classify_segment(model_path, input_folder, txt_dir, crop_jobs, frame_stride=1, batch_size=8, *, preprocess):
+    """
+    Crops and classifies the hand crops of one segment and finds the Hough lines of every crop pair.
+    Runs inside a worker process. preprocess is the classifier's preprocessing (see vgg_batcher.resolve_preprocess).
+
+    Returns:
+    - List of (frame_number, pred, lines) tuples, lines being the cv2.HoughLines output of the pair.
+    """
+    detection_store = open_detection_store(txt_dir)
+    batcher = PredictionBatcher(_get_model(model_path), batch_size=batch_size, size=(224, 224),
+                                preprocess=preprocess)
+    jobs = {job.frame_number: job for job in crop_jobs}
+    needed_frames = set(jobs) | {job.previous_frame_number for job in crop_jobs}
+
+    crops = {}
+    results = []
+    with FrameSource(input_folder, stride=frame_stride, start=min(needed_frames),
+                     stop=max(needed_frames) + 1) as frame_source:
+        for frame in frame_source:
+            frame_number = frame.frame_number
+            if frame_number not in needed_frames:
+                continue
+            crops[frame_number] = crop_hand_region(frame, detection_store.frame_detections(frame_number * frame_stride),
+                                                   width_reduction=0.8, height_reduction=0.6, move_factor=1)
+            if frame_number in jobs:
+                # Every crop is the previous crop of at most one later crop
+                previous_crop = crops.pop(jobs[frame_number].previous_frame_number)
+                ready = batcher.submit(crops[frame_number],
+                                       (FrameDiff(previous_crop, crops[frame_number]), frame_number))
+                results.extend((n, pred, frame_diff.lines) for (frame_diff, n), pred in ready)
+    results.extend((n, pred, frame_diff.lines) for (frame_diff, n), pred in batcher.flush())
+    return results
+
+
+def stitch_segments(stream, events, segment_results):
+    """
+    Replays the poke/pen detectors over the classified crops of every segment, in frame order.
+
+    Parameters:
+    - stream (PokaYokeStream): Detections-only stream from scan_recording (updated in place).
+    - events (list): Start/end PhaseEvents from scan_recording.
+    - segment_results (list): Results of classify_segment, one list per segment.
+
+    Returns:
+    - Tuple: (stream, events), as returned by analyze_recording.
+    """
+    phases = stream.phases
+    jobs = {job.frame_number: job for job in stream.crop_jobs}
+    records = sorted((record for results in segment_results for record in results), key=lambda r: r[0])
+    start_frames = idle_split_points(events)
+
+    stitched_events = list(events)
+    operation = 0
+    for frame_number, pred, lines in records:
+        # The counters are reset when an operation starts
+        while operation < len(start_frames) and start_frames[operation] < frame_number:
+            phases['poke'] = 0
+            phases['pen'] = 0
+            operation += 1
+        job = jobs[frame_number]
+        stitched_events.extend(stream._apply_predictions([(
+            (FrameDiff.from_lines(lines), job.x_center_dominant, job.y_center_dominant, frame_number), pred
+        )]))
+
+    # Idle frames after the last classified crop reset the counters too
+    if stream.last_reset_frame is not None and (not records or stream.last_reset_frame > records[-1][0]):
+        phases['poke'] = 0
+        phases['pen'] = 0
+
+    stitched_events.sort(key=lambda event: event.frame_number)
+    return stream, stitched_events
+
+
+def analyze_recording_parallel(model_path, input_folder, txt_dir, workers=None, segments=None,
+                               threads_per_worker=1, frame_stride=1, batch_size=8, prediction_window_size=32, *,
+                               preprocess):
+    """
+    Same result as analyze_recording(load_poke_pen_model(model_path), input_folder, txt_dir, preprocess=preprocess),
+    computed on a
+    process pool.
+
+    Parameters:
+    - model_path (str): Poke/pen classifier (.hdf5, .onnx or .xml), loaded once per worker.
+    - input_folder (str): Video file or folder of frame_XXXXX.jpg images.
+    - txt_dir (str): YOLO labels directory or .dets store.
+    - workers (int): Worker processes (defaults to the CPU count).
+    - segments (int): Number of segments (defaults to workers).
+    - threads_per_worker (int): Threads each worker may use for OpenCV/TensorFlow/ONNX Runtime.
+    - frame_stride (int): Keep one frame out of every frame_stride frames of input_folder.
+    - batch_size (int): VGG-19 micro-batch size.
+    - prediction_window_size (int): Number of recent predictions kept for the phase detectors.
+    - preprocess (str or callable): Required keyword. Preprocessing the classifier was trained with (see
+      vgg_batcher.resolve_preprocess).
+
+    Returns:
+    - Tuple: (stream, events) with the final PokaYokeStream state and the list of PhaseEvent.
+    """
+    detection_store = open_detection_store(txt_dir)
+    # A sequential run stops at the end of the shorter of the recording and the labels
+    n_frames = min(-(-len(detection_store) // frame_stride), FrameSource(input_folder, stride=frame_stride).frame_count())
+    stream, events = scan_recording(detection_store, n_frames, prediction_window_size, frame_stride)
+
+    workers = workers or os.cpu_count()
+    chunks = split_crop_jobs(stream.crop_jobs, idle_split_points(events), segments or workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        futures = [pool.submit(classify_segment, model_path, input_folder, detection_store.store_path, chunk,
+                               frame_stride, batch_size, preprocess=preprocess) for chunk in chunks]
+        segment_results = [future.result() for future in futures]
+
+    return stitch_segments(stream, events, segment_results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Analyse one recording on several processes.")
+    parser.add_argument('frames', help="Video file or folder of frame_XXXXX.jpg images")
+    parser.add_argument('labels', help="YOLO labels directory or .dets store")
+    parser.add_argument('model', help="Poke/pen classifier (.hdf5, .onnx or .xml)")
+    parser.add_argument('--preprocess', required=True, choices=sorted(PREPROCESSING),
+                        help="Preprocessing the classifier was trained with")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--segments', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--frame-stride', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    stream, events = analyze_recording_parallel(args.model, args.frames, args.labels, workers=args.workers,
+                                                segments=args.segments, threads_per_worker=args.threads_per_worker,
+                                                frame_stride=args.frame_stride, batch_size=args.batch_size,
+                                                preprocess=args.preprocess)
+    print(json.dumps(summarize_stream(stream, events), indent=1))
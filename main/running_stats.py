@@ -0,0 +1,143 @@
+import math
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P² algorithm (Jain & Chlamtac, 1985): five markers,
+    O(1) memory and time per value. Exact while fewer than five values have been seen.
+
+    Parameters:
+    - p (float): Quantile in [0, 1] (0.5 for the median, 0.95 for p95).
+    """
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def update(self, value):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        positions = self.positions
+        # Cell of the new value; the extreme markers follow the minimum and maximum
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in range(1, 4):
+            delta = self.desired[i] - positions[i]
+            if (delta >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (delta <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if delta > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+        )
+
+    @property
+    def value(self):
+        """Current estimate (None before the first value); linear interpolation like np.percentile below 5 values."""
+        heights = self.heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            rank = self.p * (len(heights) - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, len(heights) - 1)
+            return heights[lower] + (heights[upper] - heights[lower]) * (rank - lower)
+        return heights[2]
+
+
+class RunningStats:
+    """
+    Count, sum, mean, variance, min/max and p50/p95 of a stream of values, updated in O(1) per value.
+
+    Used for the operation durations: update_buffer_frame and FrameProcessor update it once per operation,
+    and the HUD and reports read it without going over the whole shift.
+
+    Parameters:
+    - quantiles (tuple): Quantiles tracked with a P2Quantile sketch.
+    """
+    __slots__ = ('count', 'total', 'mean', '_m2', 'min', 'max', 'quantiles')
+
+    def __init__(self, quantiles=(0.5, 0.95)):
+        self.count = 0
+        self.total = 0  # Exact sum for integer values (frame counts)
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.quantiles = {p: P2Quantile(p) for p in quantiles}
+
+    def update(self, value):
+        """Adds one value (Welford's update for the mean and variance)."""
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+        for sketch in self.quantiles.values():
+            sketch.update(value)
+
+    @property
+    def variance(self):
+        """Population variance (np.var)."""
+        return self._m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, p):
+        """Estimate of a tracked quantile (None before the first value)."""
+        return self.quantiles[p].value
+
+    @property
+    def p50(self):
+        return self.quantile(0.5)
+
+    @property
+    def p95(self):
+        return self.quantile(0.95)
+
+    def to_dict(self):
+        """JSON-ready snapshot."""
+        stats = {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+        stats.update({f"p{round(p * 100):g}": sketch.value for p, sketch in self.quantiles.items()})
+        return stats
+
+
+# Example usage
+#stats = RunningStats()
+#for duration in [31, 28, 40, 35]:
+#    stats.update(duration)
+#print(stats.mean, stats.p50, stats.p95)
@@ -0,0 +1,238 @@
+"""
+Runs many station recordings concurrently on a process pool.
+
+Usage:
+    python station_runner.py manifest.json results/ --workers 16 --threads-per-worker 2
+    python station_runner.py manifest.json results/ --checkpoint-every 2000 --resume
+
+The manifest is a JSON list (or a .jsonl file with one job per line). Each job has:
+- name: Result file name, unique in the manifest (defaults to the frames folder/video name, prefixed with its
+  parent folders when several jobs share it).
+- frames: Video file or folder of frame_XXXXX.jpg images.
+- labels: YOLO labels directory or .dets store (not needed with yolo_weights).
+- model: Poke/pen classifier (.hdf5, .onnx or .xml).
+- preprocess: Preprocessing the classifier was trained with ('vgg19' or 'rescale', see vgg_batcher.PREPROCESSING).
+- Optional: yolo_weights, frame_stride, batch_size, classifier_gate (true, or a dict of ChangeGate parameters:
+  skip the classifier for unchanged hand crops; the result then has the gate's hit rate), diff_window_scale
+  (ROI frame differencing around the dominant hand), detect_every (with yolo_weights: run YOLO on one frame out
+  of detect_every and track the hands in between; the result then has the detector's call rate), batch_crops
+  (cut and preprocess the hand crops a batch at a time, same predictions).
+
+Each worker loads a classifier once and reuses it for every job with the same model path.
+With --checkpoint-every, each job checkpoints to <output_dir>/<name>.ckpt (removed once its result is written);
+--resume continues interrupted jobs from their checkpoint. With --profile, every stage of each job is timed: the
+histograms go into the result JSON ('profile') and <output_dir>/<name>.prom (Prometheus text).
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Classifiers already loaded in this worker process, by model path
+_MODELS = {}
+
+
+def _default_job_names(frames_paths):
+    """
+    Result names for jobs without one: the frames folder/video name, or, when several jobs share it (e.g.
+    .../st1/frames and .../st2/frames), their path below the common parent joined with '_' (st1_frames).
+    """
+    paths = [os.path.splitext(os.path.normpath(os.path.abspath(path)))[0] for path in frames_paths]
+    names = [os.path.basename(path) for path in paths]
+    for name in set(names):
+        shared = [i for i, other in enumerate(names) if other == name]
+        if len(shared) > 1:
+            parent = os.path.commonpath([paths[i] for i in shared])
+            for i in shared:
+                names[i] = os.path.relpath(paths[i], os.path.dirname(parent) if paths[i] == parent else parent) \
+                    .replace(os.sep, '_')
+    return names
+
+
+def load_manifest(manifest_path):
+    """
+    Reads the jobs of a .json (list) or .jsonl (one job per line) manifest.
+
+    Raises:
+    - ValueError: If two jobs have the same name (they would write the same result and checkpoint files).
+    """
+    with open(manifest_path, 'r') as file:
+        if manifest_path.endswith('.jsonl'):
+            jobs = [json.loads(line) for line in file if line.strip()]
+        else:
+            jobs = json.load(file)
+    unnamed = [job for job in jobs if 'name' not in job]
+    for job, name in zip(unnamed, _default_job_names([job['frames'] for job in unnamed])):
+        job['name'] = name
+    names = [job['name'] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate job names in {manifest_path}: {duplicates}; set a unique 'name' for these jobs")
+    for job in jobs:
+        if not job.get('preprocess'):
+            raise ValueError(f"Job {job['name']} has no 'preprocess' (the preprocessing its model was trained with)")
+    return jobs
+
+
+def _init_worker(threads_per_worker):
+    """Limits the math libraries of each worker so the workers do not oversubscribe the cores."""
+    if threads_per_worker is not None:
+        for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+            os.environ[variable] = str(threads_per_worker)
+        os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+        import cv2
+        cv2.setNumThreads(threads_per_worker)
+
+
+def _get_model(model_path):
+    if model_path not in _MODELS:
+        from poke_pen_backend import load_poke_pen_model
+        _MODELS[model_path] = load_poke_pen_model(model_path)
+    return _MODELS[model_path]
+
+
+def summarize_stream(stream, events):
+    """JSON-ready summary of an analysed recording."""
+    from poka_yoke_stream import summarize_operations
+
+    state = stream.state
+    operations = summarize_operations(events)
+    return {
+        'phases': dict(state.phases),
+        'operations': state.phases['end'],
+        'success_ratio': sum(o['success'] for o in operations) / len(operations) if operations else 0,
+        'operation_results': operations,
+        'start_frames': [int(f) for f in state.start.start_frames],
+        'end_frames': [int(f) for f in state.end.end_frames],
+        'durations': [int(d) for d in state.end.durations],
+        'metrics': {
+            'duration': [float(v) for v in state.metrics['duration']],
+            'total': [int(v) for v in state.metrics['total']],
+            'duration_stats': state.metrics['duration_stats'].to_dict(),
+        },
+        'events': [{'frame_number': int(e.frame_number), 'phase': e.phase, 'count': int(e.count)} for e in events],
+        'frames': stream.frame_number + 1,
+    }
+
+
+def run_job(job, output_dir, checkpoint_every=None, resume=False, profile=False):
+    """
+    Analyses one recording and writes <output_dir>/<name>.json. Runs inside a worker process.
+
+    Parameters:
+    - job (dict): Job (see load_manifest).
+    - output_dir (str): Directory for the result file (and the checkpoint).
+    - checkpoint_every (int or None): Checkpoint to <output_dir>/<name>.ckpt every checkpoint_every frames.
+    - resume (bool): Continue from <output_dir>/<name>.ckpt if it exists.
+    - profile (bool): Time every stage (see profiling.StageProfiler) and write <output_dir>/<name>.prom.
+    """
+    from poka_yoke_stream import analyze_recording
+    from profiling import StageProfiler, NULL_PROFILER
+
+    start_time = time.perf_counter()
+    model_poke_pen = _get_model(job['model'])
+    checkpoint_path = os.path.join(output_dir, f"{job['name']}.ckpt")
+    from vgg_batcher import ChangeGate
+    profiler = StageProfiler() if profile else NULL_PROFILER
+    gate_options = job.get('classifier_gate')
+    classifier_gate = None
+    if gate_options:
+        classifier_gate = ChangeGate(**gate_options) if isinstance(gate_options, dict) else ChangeGate()
+    hand_detector = None
+    if job.get('yolo_weights') and job.get('detect_every'):
+        from hand_detector import YoloHandDetector
+        from hand_tracker import TrackedHandDetector
+        hand_detector = TrackedHandDetector(YoloHandDetector(job['yolo_weights']), detect_every=job['detect_every'])
+    stream, events = analyze_recording(
+        model_poke_pen,
+        job['frames'],
+        job.get('labels'),
+        yolo_weights=job.get('yolo_weights'),
+        frame_stride=job.get('frame_stride', 1),
+        batch_size=job.get('batch_size', 8),
+        checkpoint_path=checkpoint_path if checkpoint_every or resume else None,
+        checkpoint_every=checkpoint_every or 1000,
+        resume=resume,
+        profiler=profiler,
+        classifier_gate=classifier_gate,
+        diff_window_scale=job.get('diff_window_scale'),
+        hand_detector=hand_detector,
+        batch_crops=job.get('batch_crops', False),
+        preprocess=job['preprocess'],
+    )
+    result = summarize_stream(stream, events)
+    result.update({'name': job['name'], 'job': job, 'seconds': time.perf_counter() - start_time})
+
+    os.makedirs(output_dir, exist_ok=True)
+    if classifier_gate is not None:
+        result['classifier_gate'] = dict(classifier_gate.to_dict(), model_calls=stream.batcher.model_calls)
+    if hand_detector is not None:
+        result['hand_detection'] = hand_detector.to_dict()
+    if profile:
+        result['profile'] = profiler.to_dict()
+        profiler.write(os.path.join(output_dir, f"{job['name']}.prom"))
+    output_path = os.path.join(output_dir, f"{job['name']}.json")
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(result, file, indent=1)
+    os.replace(tmp_path, output_path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return output_path
+
+
+def run_jobs(jobs, output_dir, workers=None, threads_per_worker=1, overwrite=False, checkpoint_every=None,
+             resume=False, profile=False):
+    """
+    Shards the jobs across a process pool.
+
+    Parameters:
+    - jobs (list): Job dicts (see load_manifest).
+    - output_dir (str): Shared directory for the per-job result files.
+    - workers (int): Worker processes (defaults to the CPU count).
+    - threads_per_worker (int): Threads each worker may use for OpenCV/TensorFlow/ONNX Runtime.
+    - overwrite (bool): Re-run jobs whose result file already exists.
+    - checkpoint_every (int or None): Frames between checkpoints of each job (None: no checkpoints).
+    - resume (bool): Continue interrupted jobs from their checkpoint.
+    - profile (bool): Time the stages of every job.
+
+    Returns:
+    - dict: job name -> result path, or the exception raised by the job.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if not overwrite:
+        jobs = [job for job in jobs if not os.path.exists(os.path.join(output_dir, f"{job['name']}.json"))]
+
+    # Jobs sharing a model are submitted together, so each worker mostly keeps the model it already loaded
+    jobs = sorted(jobs, key=lambda job: job['model'])
+    outcomes = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        futures = {pool.submit(run_job, job, output_dir, checkpoint_every, resume, profile): job['name'] for job in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                outcomes[name] = future.result()
+                print(f"{name}: done")
+            except Exception as error:
+                outcomes[name] = error
+                print(f"{name}: failed ({error!r})")
+    return outcomes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run Poka-Yoke analyses of many recordings in parallel.")
+    parser.add_argument('manifest', help="JSON/JSONL list of jobs")
+    parser.add_argument('output_dir', help="Directory for the per-job result files")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--overwrite', action='store_true', help="Re-run jobs that already have a result")
+    parser.add_argument('--checkpoint-every', type=int, default=None,
+                        help="Checkpoint each job every N frames to <output_dir>/<name>.ckpt")
+    parser.add_argument('--resume', action='store_true', help="Continue interrupted jobs from their checkpoint")
+    parser.add_argument('--profile', action='store_true', help="Time every stage and write <output_dir>/<name>.prom")
+    args = parser.parse_args()
+
+    run_jobs(load_manifest(args.manifest), args.output_dir, workers=args.workers,
+             threads_per_worker=args.threads_per_worker, overwrite=args.overwrite,
+             checkpoint_every=args.checkpoint_every, resume=args.resume, profile=args.profile)
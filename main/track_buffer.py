@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class TrackBuffer:
+    """
+    Fixed-capacity ring buffer of one hand track series (x centers, y centers, heights, ...).
+
+    Behaves like the list it replaces for what the detectors use (append, clear, len, indexing with negative
+    indices, iteration oldest first), but keeps only the last `capacity` values in a preallocated array, so a
+    live stream uses the same memory after 12 hours as after 12 seconds, and indexing is O(1) (a deque is O(n)
+    in the middle).
+
+    Values are stored as float64 by default, like the Python floats of the list, so the detectors compare the
+    same values (float32 would round the label file values).
+
+    Parameters:
+    - capacity (int): Number of values kept.
+    - dtype: NumPy dtype of the values.
+    """
+    __slots__ = ('capacity', '_values', '_start', '_size')
+
+    def __init__(self, capacity, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.capacity = capacity
+        self._values = np.zeros(capacity, dtype=dtype)
+        self._start = 0
+        self._size = 0
+
+    def append(self, value):
+        if self._size < self.capacity:
+            self._values[(self._start + self._size) % self.capacity] = value
+            self._size += 1
+        else:
+            # Full: overwrite the oldest value
+            self._values[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("TrackBuffer index out of range")
+        return self._values[(self._start + index) % self.capacity].item()
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self._values[(self._start + index) % self.capacity].item()
+
+    def to_array(self):
+        """Copy of the values, oldest first."""
+        end = self._start + self._size
+        if end <= self.capacity:
+            return self._values[self._start:end].copy()
+        return np.concatenate([self._values[self._start:], self._values[:end - self.capacity]])
+
+    def __repr__(self):
+        return f"TrackBuffer({self.to_array().tolist()}, capacity={self.capacity})"
@@ -0,0 +1,369 @@
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+from frames import load_frame
+from hand_crops import crop_boxes
+from profiling import NULL_PROFILER
+
+
+def _resized_rgb(image, size):
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.asarray(image))
+    return np.asarray(image.convert('RGB').resize(size), dtype=np.float32)
+
+
+def preprocess_crop(image, size=(224, 224)):
+    """
+    'rescale' preprocessing: RGB, resized to size and rescaled to [0, 1] (models trained on rescaled crops,
+    e.g. ImageDataGenerator(rescale=1/255)).
+
+    Parameters:
+    - image (PIL.Image or ndarray): Hand crop from crop_hand_region.
+    - size (tuple): (width, height) expected by the model.
+
+    Returns:
+    - ndarray: float32 array of shape (height, width, 3).
+    """
+    return _resized_rgb(image, size) / 255.0
+
+
+# ImageNet channel means (BGR) subtracted by keras.applications.vgg19.preprocess_input
+VGG19_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def preprocess_vgg19(image, size=(224, 224)):
+    """
+    'vgg19' preprocessing: RGB resized to size, then keras.applications.vgg19.preprocess_input (BGR, ImageNet
+    means subtracted, no scaling), for models trained with that function.
+
+    Returns:
+    - ndarray: float32 array of shape (height, width, 3).
+    """
+    return _resized_rgb(image, size)[..., ::-1] - VGG19_BGR_MEAN
+
+
+# Preprocessings a poke/pen classifier may have been trained with. The deployed model's preprocessing is the
+# one of make_prediction_VGG19 (VGG19_helper); there is no default, callers pass it explicitly.
+PREPROCESSING = {
+    'rescale': preprocess_crop,
+    'vgg19': preprocess_vgg19,
+}
+
+
+def resolve_preprocess(preprocess):
+    """
+    Preprocessing function from a PREPROCESSING name or a preprocess(image, size) callable.
+
+    Raises:
+    - ValueError: If preprocess is None or an unknown name.
+    """
+    if preprocess is None:
+        raise ValueError("The poke/pen classifier needs the preprocessing it was trained with (the one of "
+                         f"make_prediction_VGG19): pass preprocess, one of {sorted(PREPROCESSING)} or a callable")
+    if isinstance(preprocess, str):
+        if preprocess not in PREPROCESSING:
+            raise ValueError(f"Unknown preprocessing {preprocess!r}, expected one of {sorted(PREPROCESSING)}")
+        return PREPROCESSING[preprocess]
+    return preprocess
+
+
+def _preprocess_into(row, image, preprocess, size):
+    """Writes the preprocessed crop into one batch row (all zeros for an empty crop, e.g. a frame without hands)."""
+    if np.asarray(image).size == 0:
+        row[...] = 0
+    else:
+        row[...] = preprocess(image, size)
+
+
+def crop_hand_batch(frames, detections, preprocess, size=(224, 224), out=None, width_reduction=0.8,
+                    height_reduction=0.6, move_factor=1):
+    """
+    Crops the hand region of several frames (of one or several streams) straight into a classifier batch.
+
+    The crop rectangles of all the frames are computed in one NumPy pass (hand_crops.crop_boxes); each crop is
+    a view of its frame, preprocessed into its row of the batch with the classifier's preprocessing. A row is
+    the one PredictionBatcher.submit gives for the crop of crop_hand_region, so the predictions do not change.
+
+    Parameters:
+    - frames (list): Frames, RGB arrays, PIL images or image paths (see load_frame).
+    - detections: Detections of the frames: one (N, 5) array or list of rows per frame, or a stacked
+      (B, N, 5) array (see hand_crops.stack_detections).
+    - preprocess (str or callable): PREPROCESSING name or callable (see resolve_preprocess).
+    - size (tuple): (width, height) expected by the model.
+    - out (ndarray): Preallocated (B', height, width, 3) float32 batch with B' >= len(frames), reused between
+      calls; allocated if None.
+    - width_reduction, height_reduction, move_factor: As in crop_hand_region.
+
+    Returns:
+    - Tuple: (batch, boxes) with the (B, height, width, 3) float32 batch (a view of out) and the (B, 4) integer
+      crop boxes. Frames without hands give an all-zero row.
+    """
+    preprocess = resolve_preprocess(preprocess)
+    frames = [load_frame(frame) for frame in frames]
+    if out is None:
+        out = np.empty((len(frames), size[1], size[0], 3), dtype=np.float32)
+    batch = out[:len(frames)]
+    boxes = crop_boxes([frame.width for frame in frames], [frame.height for frame in frames], detections,
+                       width_reduction, height_reduction, move_factor)
+    if len(boxes) != len(frames):
+        raise ValueError(f"Got detections for {len(boxes)} frames, expected {len(frames)}")
+    for row, frame, box in zip(batch, frames, boxes):
+        _preprocess_into(row, frame.crop(box), preprocess, size)
+    return batch, boxes
+
+
+def crop_thumbnail(image, size=(16, 16)):
+    """Grayscale float32 thumbnail (INTER_AREA) of a hand crop, the signature ChangeGate compares."""
+    pixels = np.asarray(image.convert('RGB') if isinstance(image, Image.Image) else image)
+    gray = cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY) if pixels.ndim == 3 else pixels
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def difference_hash(thumbnail):
+    """64-bit dHash of a thumbnail: sign of the horizontal gradient on a 9x8 downsample."""
+    small = cv2.resize(thumbnail, (9, 8), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).view('>u8')[0]
+
+
+class ChangeGate:
+    """
+    Decides when a hand crop is close enough to the last classified crop to reuse its prediction.
+
+    A crop matches when its dHash is within max_hash_distance bits of the reference crop's and the mean
+    absolute difference of their 16x16 grayscale thumbnails (diff energy) is at most max_mean_diff grey
+    levels. Crops are always compared with the last crop that went through the classifier, not with the
+    previous (reused) one, so slow drifts still trigger a new prediction; max_reuse caps consecutive reuses.
+    The reference is dropped by reset() (e.g. at the start of an operation) and when update() is given a
+    frame_number that does not follow the previous one, so a crop is never matched across a gap.
+
+    Parameters:
+    - max_hash_distance (int): Maximum Hamming distance between the dHashes.
+    - max_mean_diff (float): Maximum mean absolute thumbnail difference (0-255).
+    - max_reuse (int): Crops in a row that may reuse one prediction.
+    """
+    __slots__ = ('max_hash_distance', 'max_mean_diff', 'max_reuse', '_thumbnail', '_hash', '_reuse_count',
+                 '_frame_number', 'hits', 'misses')
+
+    def __init__(self, max_hash_distance=4, max_mean_diff=4.0, max_reuse=30):
+        self.max_hash_distance = max_hash_distance
+        self.max_mean_diff = max_mean_diff
+        self.max_reuse = max_reuse
+        self._thumbnail = None
+        self._hash = None
+        self._reuse_count = 0
+        self._frame_number = None  # Frame of the last crop passed to update
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self):
+        """Forgets the reference crop: the next crop is classified."""
+        self._thumbnail = None
+        self._hash = None
+        self._reuse_count = 0
+        self._frame_number = None
+
+    def update(self, image, frame_number=None):
+        """
+        Parameters:
+        - image: Hand crop.
+        - frame_number (int or None): Frame of the crop; if it does not follow the previous crop's, the gate
+          is reset first.
+
+        Returns:
+        - bool: True if the prediction of the reference crop can be reused for image; otherwise image becomes
+          the reference crop (it has to be classified).
+        """
+        if frame_number is not None:
+            if self._frame_number is not None and frame_number != self._frame_number + 1:
+                self.reset()
+            self._frame_number = frame_number
+        if np.asarray(image).size == 0:
+            self.misses += 1
+            return False
+        thumbnail = crop_thumbnail(image)
+        image_hash = difference_hash(thumbnail)
+        if self._thumbnail is not None and self._reuse_count < self.max_reuse and \
+                bin(int(image_hash ^ self._hash)).count('1') <= self.max_hash_distance and \
+                np.abs(thumbnail - self._thumbnail).mean() <= self.max_mean_diff:
+            self._reuse_count += 1
+            self.hits += 1
+            return True
+        self._thumbnail = thumbnail
+        self._hash = image_hash
+        self._reuse_count = 0
+        self.misses += 1
+        return False
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_dict(self):
+        return {'crops': self.hits + self.misses, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate}
+
+
+class PredictionBatcher:
+    """
+    Collects hand crops and runs the poke/pen classifier on them in batches.
+
+    Results are returned in submission order as (context, prediction) pairs, where context is whatever
+    the caller submitted with the crop (images and hand positions the phase detectors need).
+
+    Parameters:
+    - model: Classifier with predict_on_batch (Keras) or predict, taking a (B, H, W, 3) float32 batch.
+    - batch_size (int): Crops per model call.
+    - max_latency (float or None): Seconds a crop may wait for the batch to fill before it is flushed.
+      None waits for a full batch (offline runs).
+    - size (tuple): (width, height) expected by the model.
+    - preprocess (str or callable): Required. PREPROCESSING name or preprocess(image, size) -> (H, W, 3) array;
+      must be the preprocessing of make_prediction_VGG19 for the deployed model (see resolve_preprocess).
+    - profiler (StageProfiler): Times the 'vgg_preprocess' and 'vgg_inference' stages (disabled by default).
+    - gate (ChangeGate or None): Reuse the previous prediction for crops that have not changed (no
+      preprocessing, no batch row). Results keep the submission order and the batches are flushed at the
+      same points; only the number of rows sent to the model shrinks.
+
+    Crops are queued with submit (an already cut crop) or submit_frame (a frame and its detections, cut at
+    flush time with the other queued frames by crop_hand_batch); both give the same rows.
+    """
+
+    def __init__(self, model, batch_size=8, max_latency=None, size=(224, 224), preprocess=None,
+                 clock=time.monotonic, profiler=NULL_PROFILER, gate=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.size = size
+        self.preprocess = resolve_preprocess(preprocess)
+        self.clock = clock
+        self.batch = np.empty((batch_size, size[1], size[0], 3), dtype=np.float32)
+        self.contexts = []
+        self.rows = []  # Batch row of each pending crop's prediction (-1: last_prediction, None: not cut yet)
+        self.queued_frames = []  # (frame, detections, frame_number) of submit_frame, not cut yet
+        self.batch_rows = 0
+        self.reference_row = -1  # Row of the last classified crop (-1: it was in an earlier batch)
+        self.last_prediction = None
+        self.oldest_submit_time = None
+        self.model_calls = 0
+        self.profiler = profiler
+        self.gate = gate
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def submit(self, image, context=None, frame_number=None):
+        """
+        Queues one crop.
+
+        Parameters:
+        - image: Hand crop.
+        - context: Returned with the crop's prediction.
+        - frame_number (int or None): Frame of the crop, lets the gate reset after a gap (see ChangeGate.update).
+
+        Returns:
+        - List of (context, prediction) pairs that became ready (empty while the batch is filling).
+        """
+        if not self.contexts:
+            self.oldest_submit_time = self.clock()
+        self._cut_queued_frames()  # The gate sees the crops in submission order
+        self.rows.append(self._add_crop(image, frame_number))
+        self.contexts.append(context)
+
+        if len(self.contexts) >= self.batch_size:
+            return self.flush()
+        return self.poll()
+
+    def submit_frame(self, frame, detections, context=None, frame_number=None):
+        """
+        Queues the hand crop of a frame, cut with crop_hand_region's box. The crops of the frames queued this way
+        are cut and preprocessed together when the batch is flushed (crop_hand_batch: one NumPy pass for the
+        boxes, rows written straight into the batch), with the same rows and predictions as submit.
+
+        Parameters:
+        - frame: Frame, RGB array, PIL image or image path (kept until the batch is flushed).
+        - detections: Detections of the frame, (class_id, x_center, y_center, width, height) rows.
+        - context: Returned with the crop's prediction.
+        - frame_number (int or None): Frame of the crop (see submit).
+
+        Returns:
+        - List of (context, prediction) pairs that became ready (empty while the batch is filling).
+        """
+        if not self.contexts:
+            self.oldest_submit_time = self.clock()
+        self.queued_frames.append((load_frame(frame, frame_number), detections, frame_number))
+        self.rows.append(None)
+        self.contexts.append(context)
+
+        if len(self.contexts) >= self.batch_size:
+            return self.flush()
+        return self.poll()
+
+    def _add_crop(self, image, frame_number):
+        """Gate check and preprocessing of one crop; returns the batch row of its prediction."""
+        reuse = False
+        if self.gate is not None:
+            with self.profiler.span('classifier_gate'):
+                reuse = self.gate.update(image, frame_number)
+        if reuse:
+            return self.reference_row
+        with self.profiler.span('vgg_preprocess'):
+            _preprocess_into(self.batch[self.batch_rows], image, self.preprocess, self.size)
+        self.reference_row = self.batch_rows
+        self.batch_rows += 1
+        return self.reference_row
+
+    def _cut_queued_frames(self):
+        """Cuts the crops of the frames queued by submit_frame into the batch (they are the last pending rows)."""
+        if not self.queued_frames:
+            return
+        frames, detections, frame_numbers = zip(*self.queued_frames)
+        first = len(self.rows) - len(frames)
+        if self.gate is None:
+            with self.profiler.span('vgg_preprocess'):
+                crop_hand_batch(frames, list(detections), self.preprocess, self.size,
+                                out=self.batch[self.batch_rows:])
+            self.rows[first:] = range(self.batch_rows, self.batch_rows + len(frames))
+            self.batch_rows += len(frames)
+            self.reference_row = self.batch_rows - 1
+        else:
+            # The gate decides crop by crop, in order; the boxes are still computed in one pass
+            boxes = crop_boxes([frame.width for frame in frames], [frame.height for frame in frames],
+                               list(detections))
+            for i, (frame, box, frame_number) in enumerate(zip(frames, boxes, frame_numbers)):
+                self.rows[first + i] = self._add_crop(frame.crop(box), frame_number)
+        self.queued_frames = []
+
+    def poll(self):
+        """Flushes the pending crops if the oldest one has waited longer than max_latency."""
+        if self.contexts and self.max_latency is not None and \
+                self.clock() - self.oldest_submit_time >= self.max_latency:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Runs the model on all pending crops and returns their (context, prediction) pairs in order."""
+        if not self.contexts:
+            return []
+        self._cut_queued_frames()
+        predictions = None
+        if self.batch_rows:
+            batch = self.batch[:self.batch_rows]
+            with self.profiler.span('vgg_inference'):
+                if hasattr(self.model, 'predict_on_batch'):
+                    predictions = self.model.predict_on_batch(batch)
+                else:
+                    predictions = self.model.predict(batch)
+            predictions = np.asarray(predictions)
+            self.model_calls += 1
+
+        ready = [(context, predictions[row] if row >= 0 else self.last_prediction)
+                 for context, row in zip(self.contexts, self.rows)]
+        if self.reference_row >= 0:
+            self.last_prediction = predictions[self.reference_row]
+        self.contexts = []
+        self.rows = []
+        self.batch_rows = 0
+        self.reference_row = -1
+        self.oldest_submit_time = None
+        return ready